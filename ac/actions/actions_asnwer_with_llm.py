@@ -1,3 +1,4 @@
+import asyncio
 import requests
 import json
 
@@ -5,22 +6,109 @@ from typing import Any, Text, Dict, List
 
 from rasa_sdk import Tracker, FormValidationAction, Action
 from rasa_sdk.executor import CollectingDispatcher
-from rasa_sdk.events import EventType, SlotSet
+from rasa_sdk.events import EventType, SlotSet, BotUttered
 from rasa_sdk.types import DomainDict
 
-from .query_rag import query_rag
+from .startup import STARTUP_PROFILE, BackgroundLoader
+from .config import get_config
+from .streaming import create_socketio_emitter, SocketIOChunkSink
+from .telemetry import start_metrics_server
+from .admission import AdmissionRejected, USER_RATE_LIMITER, ERROR_BUSY, ERROR_RATE_LIMITED
+
+CONFIG = get_config()
+# only the socket.io channel of the chat widget can show partial answers, every other channel gets the whole answer at once
+STREAMING_CHANNEL = "socketio"
+# how long a question asked right after a restart waits for the RAG stack to finish loading
+RAG_STARTUP_WAIT_SECONDS = CONFIG.get_float('RAG_STARTUP_WAIT_SECONDS', 60.0)
+
+
+def load_rag_stack():
+    """
+        Imports langchain, chroma, fastembed and the LLM client (through `query_rag`) and loads the embedding model and
+        the indexes. Done in a background thread, so the action server, and the make-bot form with it, starts serving
+        without waiting for it.
+    """
+    from . import query_rag
+    query_rag.warm_up_retrieval_engine()
+    # new index snapshots and conf.txt/prompt_template.txt edits are picked up from here on, without a restart
+    query_rag.start_hot_reload()
+    return query_rag
+
+
+RAG_STACK = BackgroundLoader("rag_stack", load_rag_stack)
+RAG_STACK.start()
+# /metrics of the RAG and make-bot actions, on its own port next to the action server
+start_metrics_server()
+
+STREAMING_EMITTER = (
+    create_socketio_emitter(CONFIG.get_str('STREAMING_MESSAGE_QUEUE_URL', ''))
+    if CONFIG.get_bool('LLM_STREAMING_ENABLED', False) else None
+)
+
+ERROR_ANSWER_TIMEOUT = "Sorry, it is taking me too long to find an answer right now. Please try again in a moment."
+SLOT_USER_ID = "user_id"
 
 class ActionAnswerWithLLM(Action):
 
     def name(self) -> Text:
         return "answer_with_llm"
 
-    def run(self, dispatcher: CollectingDispatcher,
+    async def run(self, dispatcher: CollectingDispatcher,
             tracker: Tracker,
             domain: Dict[Text, Any]) -> List[Dict[Text, Any]]:
 
-        print("call!\n")
+        # keyed on the logged in user, so several tabs share one limit; the conversation when there is none
+        if not USER_RATE_LIMITER.allow(tracker.get_slot(SLOT_USER_ID) or tracker.sender_id):
+            dispatcher.utter_message(text=ERROR_RATE_LIMITED)
+            return []
 
-        dispatcher.utter_message(query_rag(tracker.latest_message.get('text', 'Default question')))
+        try:
+            query_rag = await RAG_STACK.get_async(RAG_STARTUP_WAIT_SECONDS)
+        except asyncio.TimeoutError:
+            print("ERROR: answer_with_llm timed out waiting for the RAG stack to load")
+            dispatcher.utter_message(text=ERROR_ANSWER_TIMEOUT)
+            return []
+        except Exception:
+            # already logged by the loader, the next question tries to load it again
+            dispatcher.utter_message(text=ERROR_ANSWER_TIMEOUT)
+            return []
+
+        sink = None
+        if STREAMING_EMITTER is not None and tracker.get_latest_input_channel() == STREAMING_CHANNEL:
+            # with session_persistence disabled in credentials.yml, the sender id is the socket.io session id
+            sink = SocketIOChunkSink(STREAMING_EMITTER, query_rag.STREAMING_BOT_MESSAGE_EVT, tracker.sender_id, query_rag.STREAMING_MIN_CHUNK_CHARS)
+
+        try:
+            answer = await query_rag.query_rag_async(
+                tracker.latest_message.get('text', 'Default question'),
+                on_token=sink.push if sink is not None else None,
+            )
+            if sink is not None:
+                await sink.flush()
+        except asyncio.TimeoutError:
+            # one of the stages went over its time budget, the pending LLM call was cancelled
+            print("ERROR: answer_with_llm timed out")
+            dispatcher.utter_message(text=ERROR_ANSWER_TIMEOUT)
+            return []
+        except AdmissionRejected as e:
+            # shed before any embedding or LLM work, the user gets a fast reply instead of a long wait
+            print(f"ERROR: answer_with_llm {e}")
+            dispatcher.utter_message(text=ERROR_BUSY)
+            return []
+
+        if sink is not None and sink.emitted and not sink.failed:
+            # the widget already received the answer chunk by chunk, only record it in the conversation
+            return [BotUttered(text=answer)]
+        if sink is not None and sink.emitted:
+            # the stream broke off: the widget shows the chunks it got, it only needs the rest of the answer
+            rest = answer[sink.emitted_chars:].strip()
+            if rest:
+                dispatcher.utter_message(rest)
+            return [BotUttered(text=answer[:sink.emitted_chars].strip())]
+
+        dispatcher.utter_message(answer)
 
         return []
+
+
+STARTUP_PROFILE.mark("answer_with_llm_actions")
@@ -1,4 +1,7 @@
+from .startup import STARTUP_PROFILE
 from .classes import Environment, RazgaRUI, Helper, RazgaRUI_factory
+from .admission import admitted, PRIORITY_MAKE_BOT
+from .prefetch import PREFETCH_STORE
 
 import requests
 import json
@@ -25,6 +28,7 @@ INTENT_WANTS_NEW_BOT = "INT_wants_new_bot"
 ERROR_API_ACCESS = "Could not access the API for making bot. Please try again later. Making Bot had been cancelled."
 ERROR_NO_CONNECTOR = "You do not have a connector named \"{}\". Try again."
 ERROR_NO_INSTRUMENT = "The exchange instrument specified ({}) was not found. Try again."
+ERROR_NO_INSTRUMENT_SUGGESTIONS = "The exchange instrument specified ({}) was not found. Did you mean one of these?"
 ERROR_BOT_CREATION = "The API could not make your bot! Please try again later. Making Bot had been cancelled."
 URL_EXCHANGE_CONNECTORS = "exchange_connectors.php"
 ERROR_NO_CONNECTORS = f"You do not have any Exchange Connectors. Please create one first from the [Exchange Connectors page]({URL_EXCHANGE_CONNECTORS}). Once you are done, come back and type in 'new bot' to proceed"
@@ -55,11 +59,33 @@ YES_NO_BUTTONS = [
     {"title": BUTTON_NO, "payload": PAYLOAD_DENY},
 ]
 LETS_RESUME_MESSAGE = "Ok, let's resume"
+# keys of the prefetched data in PREFETCH_STORE
+PREFETCH_XCONNS = ("xconns",)
+PREFETCH_XINSTRUMENT_BUTTONS = "xinstrument_buttons"
+
+
+def fetch_xconns(user_id, env):
+    return RazgaRUI_factory(user_id, env).getXConnList()
+
+
+def fetch_xinstrument_buttons(user_id, env, xconn_name):
+    razgar_user = RazgaRUI_factory(user_id, env)
+    buttons = Helper.mapXInstrumentsListToButtons(razgar_user.getXInstrumentListByXConnName(xconn_name))
+    # built now too, the typed instrument is validated against it
+    razgar_user.getXInstrumentSearchIndex(xconn_name)
+    return buttons
+
 
 class ValidateFRMMakeNewBot(FormValidationAction):
     def name(self) -> Text:
         return "validate_FRM_make_new_bot"
 
+    async def run(self, dispatcher: CollectingDispatcher, tracker: Tracker, domain: DomainDict) -> List[EventType]:
+        # the form was just started: the user's connectors are fetched while the first prompt is on its way
+        if tracker.get_intent_of_latest_message() == INTENT_WANTS_NEW_BOT and tracker.get_slot(SLOT_XCONN_NAME) is None:
+            PREFETCH_STORE.start(tracker.sender_id, PREFETCH_XCONNS, fetch_xconns, tracker.get_slot(SLOT_USER_ID), tracker.get_slot(SLOT_ENV))
+        return await super().run(dispatcher, tracker, domain)
+
     def validate_SL_bot_name(self, slot_value: Any, dispatcher: CollectingDispatcher, tracker: Tracker, domain: DomainDict,) -> Dict[Text, Any]: 
         """
             Validates the user's input for the bot name slot. If the user wants to abort the bot creation process, this function returns the appropriate slot values to indicate the abort request. Otherwise, it returns the bot name slot value as provided by the user.
@@ -77,6 +103,8 @@ class ValidateFRMMakeNewBot(FormValidationAction):
         else: 
             return {SLOT_BOT_NAME: slot_value}
 
+    # database and bot API calls: off the event loop, ahead of the FAQ answers waiting for a slot
+    @admitted(PRIORITY_MAKE_BOT)
     def validate_SL_xconn_name(self, slot_value: Any, dispatcher: CollectingDispatcher, tracker: Tracker, domain: DomainDict, ) -> Dict[Text, Any]: 
         """
             Validates the user's input for the exchange connector name slot. If the user wants to abort the bot creation process, this function returns the appropriate slot values to indicate the abort request. Otherwise, it validates the provided exchange connector name and returns the slot value.
@@ -100,6 +128,9 @@ class ValidateFRMMakeNewBot(FormValidationAction):
                     dispatcher.utter_message(text=ERROR_NO_CONNECTOR.format(slot_value))
                     return {SLOT_XCONN_NAME: None}
                 else: 
+                    # the instrument prompt comes after the bot name, its buttons are fetched meanwhile
+                    PREFETCH_STORE.start(tracker.sender_id, (PREFETCH_XINSTRUMENT_BUTTONS, slot_value), fetch_xinstrument_buttons,
+                                         tracker.get_slot(SLOT_USER_ID), tracker.get_slot(SLOT_ENV), slot_value)
                     # set the chosen connector
                     return {SLOT_XCONN_NAME: slot_value}
 
@@ -109,6 +140,7 @@ class ValidateFRMMakeNewBot(FormValidationAction):
                 #force stop making bot process in the NLU
                 return {REQUESTED_SLOT_FIELD: None} 
 
+    @admitted(PRIORITY_MAKE_BOT)
     def validate_SL_xinstrument_name(self, slot_value: Any, dispatcher: CollectingDispatcher, tracker: Tracker, domain: DomainDict,) -> Dict[Text, Any]: 
         """
             Validates the user's input for the exchange instrument name slot. If the user wants to abort the bot creation process, this function returns the appropriate slot values to indicate the abort request. Otherwise, it validates the provided exchange instrument name and returns the slot value.
@@ -116,8 +148,8 @@ class ValidateFRMMakeNewBot(FormValidationAction):
             This function performs the following steps:
 
             1. If the user wants to abort the bot creation process, it returns the appropriate slot values to indicate the abort request.
-            2. If the user provides a valid exchange instrument name, it retrieves the corresponding instrument object from the database and returns the slot value.
-            3. If the provided exchange instrument name is not valid, it displays an error message and returns the slot value as `None`.
+            2. If the user provides a valid exchange instrument name (matched case and punctuation insensitively, or as an unambiguous prefix), it takes the corresponding instrument from the search index of the connector's exchange and returns the slot value.
+            3. If the provided exchange instrument name is not valid, it displays an error message with the closest instruments as buttons and returns the slot value as `None`.
             4. If there is an error accessing the API, it displays an error message and stops the bot creation process.
         """
 
@@ -133,11 +165,16 @@ class ValidateFRMMakeNewBot(FormValidationAction):
         try:   
             # user object instatiation
             razgar_user = RazgaRUI_factory(tracker.get_slot(SLOT_USER_ID), tracker.get_slot(SLOT_ENV))
-            # get instrument object from database (if slot_value and exchange-connector are valid pair) or 0.
-            xinstrument = razgar_user.getXInstrument(slot_value, tracker.get_slot(SLOT_XCONN_NAME)) 
-            if not xinstrument:
-                dispatcher.utter_message(text=ERROR_NO_INSTRUMENT.format(slot_value))
+            # resolve the typed name ("btc perp") to an instrument of the connector's exchange, or offer the closest ones
+            xinstrument, suggestions = razgar_user.searchXInstrument(slot_value, tracker.get_slot(SLOT_XCONN_NAME))
+            if xinstrument is None:
+                if suggestions:
+                    dispatcher.utter_message(text=ERROR_NO_INSTRUMENT_SUGGESTIONS.format(slot_value), buttons=Helper.mapXInstrumentSuggestionsToButtons(suggestions))
+                else:
+                    dispatcher.utter_message(text=ERROR_NO_INSTRUMENT.format(slot_value))
                 return {SLOT_XINSTRUMENT_NAME: None}
+            # the instrument of the connector's exchange, with the connector id
+            slot_value = xinstrument['name']
         except Exception as e: 
             print(f"ERROR: {e}")            
             dispatcher.utter_message(text=f"{ERROR_API_ACCESS} (4)")
@@ -147,7 +184,7 @@ class ValidateFRMMakeNewBot(FormValidationAction):
 
         # make the bot
         try:
-            xconn_id = razgar_user.getXConnByName(tracker.get_slot(SLOT_XCONN_NAME))[0]["id"]
+            xconn_id = xinstrument['xconn_id']
             xinstrument_id = xinstrument['id']
             bot_id = razgar_user.makeBot(tracker.get_slot(SLOT_BOT_NAME), xconn_id, xinstrument_id)
 
@@ -161,6 +198,7 @@ class ValidateFRMMakeNewBot(FormValidationAction):
         # reuse botname slot to store the generated bot id
         return {SLOT_XINSTRUMENT_NAME: slot_value, SLOT_BOT_NAME: bot_id} 
         
+    @admitted(PRIORITY_MAKE_BOT)
     def validate_SL_start_bot_flag(self,slot_value: Any, dispatcher: CollectingDispatcher, tracker: Tracker, domain: DomainDict, ) -> Dict[Text, Any]: 
         """
             Validates the user's intent to start the bot after the "Make Bot" process is complete. This function handles the following scenarios:
@@ -235,6 +273,7 @@ class ValidateFRMMakeNewBot(FormValidationAction):
 
         # user confirmed abortion
         elif tracker.get_intent_of_latest_message() == INTENT_AFFFIRM:
+            PREFETCH_STORE.cancel(tracker.sender_id)
             dispatcher.utter_message(text=MAKING_BOT_CANCELLED_MESSAGE)
             #force stop making bot process in the NLU
             return {REQUESTED_SLOT_FIELD: None}
@@ -266,13 +305,14 @@ class ActionAskSLXConnName(Action):
     def name(self) -> Text:
         return "action_ask_SL_xconn_name"
 
+    @admitted(PRIORITY_MAKE_BOT)
     def run(self, dispatcher: CollectingDispatcher, tracker: Tracker, domain: Dict) -> List[EventType]:
 
         try:
-            # instantiate user object
-            razgar_user = RazgaRUI_factory(tracker.get_slot(SLOT_USER_ID), tracker.get_slot(SLOT_ENV))
-            # fetch user's exchange connectors
-            xconns = razgar_user.getXConnList()
+            # fetched since the form started, or now
+            xconns = PREFETCH_STORE.get(tracker.sender_id, PREFETCH_XCONNS)
+            if xconns is None:
+                xconns = fetch_xconns(tracker.get_slot(SLOT_USER_ID), tracker.get_slot(SLOT_ENV))
             if len(xconns) == 0:
                 # the user has no exchange connectors
                 dispatcher.utter_message(text=ERROR_NO_CONNECTORS)
@@ -298,15 +338,16 @@ class ActionAskSLXInstrumentName(Action):
     def name(self) -> Text:
         return "action_ask_SL_xinstrument_name"
 
+    @admitted(PRIORITY_MAKE_BOT)
     def run(self, dispatcher: CollectingDispatcher, tracker: Tracker,  domain: Dict) -> List[EventType]:
 
         try:
-            # instantiate user object
-            razgar_user = RazgaRUI_factory(tracker.get_slot(SLOT_USER_ID), tracker.get_slot(SLOT_ENV))
-            # get possible options based on connector
-            xinstruments = razgar_user.getXInstrumentListByXConnName(tracker.get_slot(SLOT_XCONN_NAME)) # TODO: what if the xinstruments is empty?
-            # format to buttons list
-            buttons = Helper.mapXInstrumentsListToButtons(xinstruments)
+            # fetched since the connector was chosen, or now
+            xconn_name = tracker.get_slot(SLOT_XCONN_NAME)
+            buttons = PREFETCH_STORE.get(tracker.sender_id, (PREFETCH_XINSTRUMENT_BUTTONS, xconn_name))
+            if buttons is None:
+                # get possible options based on connector, formatted to buttons list
+                buttons = fetch_xinstrument_buttons(tracker.get_slot(SLOT_USER_ID), tracker.get_slot(SLOT_ENV), xconn_name) # TODO: what if the xinstruments is empty?
             # display prompt with buttons
             dispatcher.utter_message(text=CHOOSE_INSTRUMENT_PROMPT, buttons=buttons)
             return []
@@ -372,6 +413,8 @@ class ActionCleanMakeBotSlots(Action):
 
     def run(self, dispatcher: CollectingDispatcher, tracker: Tracker, domain: Dict[Text, Any]) -> List[Dict[Text, Any]]:
 
+        # the form is over, whatever was prefetched for it is not needed anymore
+        PREFETCH_STORE.cancel(tracker.sender_id)
         # set all slots to NONE
         return [
             SlotSet(SLOT_BOT_NAME, None), 
@@ -380,3 +423,7 @@ class ActionCleanMakeBotSlots(Action):
             SlotSet(SLOT_START_BOT_FLAG, None), 
             SlotSet(SLOT_ABORT_MAKE_BOT_FLAG, False)
         ]
+
+
+# the make-bot form can be served from here on, whether or not the RAG stack is loaded yet
+STARTUP_PROFILE.mark("make_bot_actions")
@@ -0,0 +1,231 @@
+from collections import OrderedDict
+from contextlib import asynccontextmanager
+from functools import partial, wraps
+from .config import get_config, add_config_listener
+from .telemetry import ADMISSION_WAIT_SECONDS, ADMISSION_REJECTIONS, ADMISSION_ACTIVE, ADMISSION_QUEUE_DEPTH
+import asyncio
+import heapq
+import itertools
+import threading
+import time
+
+ADMISSION_MAX_CONCURRENCY = 4
+ADMISSION_RESERVED_SLOTS = 1
+ADMISSION_MAX_QUEUE = 20
+ADMISSION_QUEUE_TIMEOUT_SECONDS = 10.0
+USER_RATE_LIMIT_PER_MINUTE = 10.0
+USER_RATE_LIMIT_BURST = 5
+USER_RATE_LIMIT_MAX_USERS = 10000
+
+# lower runs first
+PRIORITY_MAKE_BOT = 0
+PRIORITY_FAQ = 1
+PRIORITY_NAMES = {PRIORITY_MAKE_BOT: "make_bot", PRIORITY_FAQ: "faq"}
+# replies of a question that was shed or over the rate limit, also told apart by the load test
+ERROR_BUSY = "Sorry, I am getting a lot of questions right now. Please try again in a moment."
+ERROR_RATE_LIMITED = "You are asking questions faster than I can answer them. Please wait a few seconds and try again."
+
+def load_config(config):
+    global ADMISSION_MAX_CONCURRENCY, ADMISSION_RESERVED_SLOTS, ADMISSION_MAX_QUEUE, ADMISSION_QUEUE_TIMEOUT_SECONDS
+    global USER_RATE_LIMIT_PER_MINUTE, USER_RATE_LIMIT_BURST, USER_RATE_LIMIT_MAX_USERS
+    ADMISSION_MAX_CONCURRENCY = config.get_int('ADMISSION_MAX_CONCURRENCY', ADMISSION_MAX_CONCURRENCY)
+    ADMISSION_RESERVED_SLOTS = config.get_int('ADMISSION_RESERVED_SLOTS', ADMISSION_RESERVED_SLOTS)
+    ADMISSION_MAX_QUEUE = config.get_int('ADMISSION_MAX_QUEUE', ADMISSION_MAX_QUEUE)
+    ADMISSION_QUEUE_TIMEOUT_SECONDS = config.get_float('ADMISSION_QUEUE_TIMEOUT_SECONDS', ADMISSION_QUEUE_TIMEOUT_SECONDS)
+    USER_RATE_LIMIT_PER_MINUTE = config.get_float('USER_RATE_LIMIT_PER_MINUTE', USER_RATE_LIMIT_PER_MINUTE)
+    USER_RATE_LIMIT_BURST = config.get_int('USER_RATE_LIMIT_BURST', USER_RATE_LIMIT_BURST)
+    USER_RATE_LIMIT_MAX_USERS = config.get_int('USER_RATE_LIMIT_MAX_USERS', USER_RATE_LIMIT_MAX_USERS)
+
+load_config(get_config())
+
+
+class AdmissionRejected(Exception):
+    """
+        Raised instead of running a unit of work that was shed; `reason` is "queue_full" or "timeout".
+    """
+
+    def __init__(self, reason):
+        super().__init__(f"shed by admission control ({reason})")
+        self.reason = reason
+
+
+class TokenBucket:
+    __slots__ = ("tokens", "updated")
+
+    def __init__(self, burst, now):
+        self.tokens = float(burst)
+        self.updated = now
+
+    def take(self, now, rate_per_second, burst):
+        self.tokens = min(float(burst), self.tokens + (now - self.updated) * rate_per_second)
+        self.updated = now
+        if self.tokens < 1:
+            return False
+        self.tokens -= 1
+        return True
+
+
+class UserRateLimiter:
+    """
+        A token bucket per user: `burst` questions at once, then `rate_per_minute` on average. The buckets of the
+        `max_users` most recently seen users are kept, an evicted user starts again with a full bucket. A rate of 0
+        disables the limit.
+    """
+
+    def __init__(self, rate_per_minute, burst, max_users):
+        self._lock = threading.Lock()
+        self._buckets = OrderedDict()
+        self.configure(rate_per_minute, burst, max_users)
+
+    def configure(self, rate_per_minute, burst, max_users):
+        self.rate_per_minute = rate_per_minute
+        self.burst = max(1, burst)
+        self.max_users = max(1, max_users)
+
+    def allow(self, user_key):
+        if self.rate_per_minute <= 0:
+            return True
+        now = time.monotonic()
+        with self._lock:
+            bucket = self._buckets.pop(user_key, None) or TokenBucket(self.burst, now)
+            self._buckets[user_key] = bucket
+            while len(self._buckets) > self.max_users:
+                self._buckets.popitem(last=False)
+            allowed = bucket.take(now, self.rate_per_minute / 60, self.burst)
+        if not allowed:
+            ADMISSION_REJECTIONS.inc("rate_limited")
+        return allowed
+
+
+class AdmissionController:
+    """
+        Bounded concurrency for the heavy work of the action server (the embedding, search and LLM calls of an answer,
+        the database and bot API calls of the make-bot form), on the event loop of the action server. At most
+        `max_concurrency` units run at once; the others wait in a priority queue, make-bot work ahead of FAQ answers and
+        first come first served within a priority. `reserved_slots` of the slots are only given to make-bot work, so a
+        burst of questions never holds all of them.
+
+        FAQ answers are shed with `AdmissionRejected` when `max_queue` units are already waiting ("queue_full") or after
+        waiting `queue_timeout` seconds ("timeout"). Make-bot work is never shed, it only waits.
+    """
+
+    def __init__(self, max_concurrency, reserved_slots, max_queue, queue_timeout):
+        self._active = 0
+        self._queued = 0
+        # (priority, sequence, future); futures of waiters that gave up are done and skipped
+        self._waiters = []
+        self._sequence = itertools.count()
+        self._loop = None
+        self.configure(max_concurrency, reserved_slots, max_queue, queue_timeout)
+
+    def configure(self, max_concurrency, reserved_slots, max_queue, queue_timeout):
+        self.max_concurrency = max(1, max_concurrency)
+        self.reserved_slots = min(max(0, reserved_slots), self.max_concurrency - 1)
+        self.max_queue = max(0, max_queue)
+        self.queue_timeout = queue_timeout
+        # called from the hot reload thread, new slots may be free for the waiters
+        if self._loop is not None and not self._loop.is_closed():
+            self._loop.call_soon_threadsafe(self._dispatch)
+
+    def _limit(self, priority):
+        if priority == PRIORITY_MAKE_BOT:
+            return self.max_concurrency
+        return self.max_concurrency - self.reserved_slots
+
+    def _drop_abandoned(self):
+        while self._waiters and self._waiters[0][2].done():
+            heapq.heappop(self._waiters)
+
+    def _update_gauges(self):
+        ADMISSION_ACTIVE.set(self._active)
+        ADMISSION_QUEUE_DEPTH.set(self._queued)
+
+    def _dispatch(self):
+        self._drop_abandoned()
+        while self._waiters and self._active < self._limit(self._waiters[0][0]):
+            _priority, _sequence, future = heapq.heappop(self._waiters)
+            self._queued -= 1
+            self._active += 1
+            future.set_result(None)
+            self._drop_abandoned()
+        self._update_gauges()
+
+    def _abandon(self, future):
+        future.cancel()
+        self._queued -= 1
+        self._update_gauges()
+
+    def _reject(self, reason):
+        ADMISSION_REJECTIONS.inc(reason)
+        raise AdmissionRejected(reason)
+
+    async def _acquire(self, priority):
+        self._loop = asyncio.get_running_loop()
+        start = time.perf_counter()
+        self._drop_abandoned()
+        waiting_ahead = self._waiters and self._waiters[0][0] <= priority
+        if not waiting_ahead and self._active < self._limit(priority):
+            self._active += 1
+            self._update_gauges()
+        else:
+            if priority != PRIORITY_MAKE_BOT and self._queued >= self.max_queue:
+                self._reject("queue_full")
+            future = self._loop.create_future()
+            heapq.heappush(self._waiters, (priority, next(self._sequence), future))
+            self._queued += 1
+            self._update_gauges()
+            try:
+                await asyncio.wait((future,), timeout=None if priority == PRIORITY_MAKE_BOT else self.queue_timeout)
+            except asyncio.CancelledError:
+                # the slot may have been handed over in the meantime, it goes to the next waiter then
+                if future.done():
+                    self._release()
+                else:
+                    self._abandon(future)
+                raise
+            if not future.done():
+                self._abandon(future)
+                self._reject("timeout")
+        ADMISSION_WAIT_SECONDS.observe(time.perf_counter() - start, PRIORITY_NAMES[priority])
+
+    def _release(self):
+        self._active -= 1
+        self._dispatch()
+
+    @asynccontextmanager
+    async def slot(self, priority):
+        await self._acquire(priority)
+        try:
+            yield
+        finally:
+            self._release()
+
+    def stats(self):
+        return {"active": self._active, "queued": self._queued, "max_concurrency": self.max_concurrency}
+
+
+ADMISSION = AdmissionController(ADMISSION_MAX_CONCURRENCY, ADMISSION_RESERVED_SLOTS, ADMISSION_MAX_QUEUE, ADMISSION_QUEUE_TIMEOUT_SECONDS)
+USER_RATE_LIMITER = UserRateLimiter(USER_RATE_LIMIT_PER_MINUTE, USER_RATE_LIMIT_BURST, USER_RATE_LIMIT_MAX_USERS)
+
+
+def apply_config(config):
+    load_config(config)
+    ADMISSION.configure(ADMISSION_MAX_CONCURRENCY, ADMISSION_RESERVED_SLOTS, ADMISSION_MAX_QUEUE, ADMISSION_QUEUE_TIMEOUT_SECONDS)
+    USER_RATE_LIMITER.configure(USER_RATE_LIMIT_PER_MINUTE, USER_RATE_LIMIT_BURST, USER_RATE_LIMIT_MAX_USERS)
+
+add_config_listener(apply_config)
+
+
+def admitted(priority):
+    """
+        Turns a blocking action method into a coroutine that waits for a slot of `priority` and then runs the method in
+        the event loop's default executor, so the database and API calls of one conversation no longer block the others.
+        rasa_sdk awaits the coroutines returned by `run` and by the `validate_<slot>` methods.
+    """
+    def decorator(method):
+        @wraps(method)
+        async def admitted_method(*args, **kwargs):
+            async with ADMISSION.slot(priority):
+                return await asyncio.get_running_loop().run_in_executor(None, partial(method, *args, **kwargs))
+        return admitted_method
+    return decorator
@@ -0,0 +1,105 @@
+from langchain.schema import Document
+from collections import Counter
+import heapq
+import math
+import os
+import pickle
+import re
+
+TOKEN_PATTERN = re.compile(r"[a-z0-9]+")
+BM25_K1 = 1.5
+BM25_B = 0.75
+
+
+def tokenize(text):
+    # "BTC-PERPETUAL" -> ["btc", "perpetual"], same for the question and the chunks
+    return TOKEN_PATTERN.findall(text.lower())
+
+
+class BM25Index:
+    """
+        In-memory inverted index with BM25 scoring, built by the db-setup script next to the vector store.
+
+        Postings are kept per term as lists of (row, term frequency), so a search only touches the rows that share a
+        term with the question.
+    """
+
+    def __init__(self, ids, documents, metadatas, postings, lengths):
+        self.ids = ids
+        self.documents = documents
+        self.metadatas = metadatas
+        self.postings = postings
+        self.lengths = lengths
+        self.average_length = sum(lengths) / len(lengths) if lengths else 0
+        self.idf = {
+            term: math.log(1 + (len(lengths) - len(rows) + 0.5) / (len(rows) + 0.5))
+            for term, rows in postings.items()
+        }
+
+    @classmethod
+    def load(cls, path):
+        with open(path, 'rb') as file:
+            return cls(**pickle.load(file))
+
+    def search(self, query_text, k):
+        scores = {}
+        for term in set(tokenize(query_text)):
+            idf = self.idf.get(term)
+            if idf is None:
+                continue
+            for row, frequency in self.postings[term]:
+                norm = BM25_K1 * (1 - BM25_B + BM25_B * self.lengths[row] / self.average_length)
+                scores[row] = scores.get(row, 0.0) + idf * frequency * (BM25_K1 + 1) / (frequency + norm)
+        best = heapq.nlargest(k, scores.items(), key=lambda item: item[1])
+        return [
+            (Document(page_content=self.documents[row], metadata=dict(self.metadatas[row], id=self.ids[row])), score)
+            for row, score in best
+        ]
+
+
+class BM25IndexBuilder:
+    """
+        Collects the postings, texts and metadata of the chunks in memory and saves them as one pickle for
+        `BM25Index.load`. Unlike the rest of the db-setup pipeline it holds the whole corpus, as the loaded index does.
+    """
+
+    def __init__(self):
+        self.ids, self.documents, self.metadatas, self.lengths = [], [], [], []
+        self.postings = {}
+
+    def add(self, ids, documents, metadatas):
+        for chunk_id, document, metadata in zip(ids, documents, metadatas):
+            row = len(self.ids)
+            terms = Counter(tokenize(document))
+            for term, frequency in terms.items():
+                self.postings.setdefault(term, []).append((row, frequency))
+            self.ids.append(chunk_id)
+            self.documents.append(document)
+            self.metadatas.append(metadata or {})
+            self.lengths.append(sum(terms.values()))
+
+    def save(self, path):
+        tmp_path = path + '.tmp'
+        with open(tmp_path, 'wb') as file:
+            pickle.dump({
+                'ids': self.ids,
+                'documents': self.documents,
+                'metadatas': self.metadatas,
+                'postings': self.postings,
+                'lengths': self.lengths,
+            }, file)
+        os.replace(tmp_path, path)
+
+
+def reciprocal_rank_fusion(ranked_lists, weights, rrf_k=60):
+    """
+        Fuses ranked (document, score) lists by weighted reciprocal rank: every document scores
+        sum(weight / (rrf_k + rank)) over the lists it appears in. Documents are matched by their chunk id.
+    """
+    fused = {}
+    for results, weight in zip(ranked_lists, weights):
+        for rank, (doc, _score) in enumerate(results, start=1):
+            chunk_id = doc.metadata.get("id", doc.page_content)
+            previous_doc, previous_score = fused.get(chunk_id, (doc, 0.0))
+            fused[chunk_id] = (previous_doc, previous_score + weight / (rrf_k + rank))
+    return sorted(fused.values(), key=lambda item: item[1], reverse=True)
@@ -32,39 +32,289 @@ API_SUCCESS_CODE = 1
 FIELD_COMMUNICATION_CODE = "communicationCode"
 FIELD_LAST_CRASH_TEXT = "last_crash_text"
 SECRET_PASS_PHRASE = ""
+# set when the bot API deduplicates add-bot requests by the Idempotency-Key header, only then makeBot is retried
+MAKE_BOT_IDEMPOTENCY_SUPPORTED = False
+# connection pool per environment
+DB_POOL_SIZE = 5
+DB_POOL_CHECKOUT_TIMEOUT = 10
+DB_CONNECT_TIMEOUT = 5
+DB_QUERY_TIMEOUT_MS = 5000
+# query result caches
+XCONN_CACHE_TTL = 60
+XINSTRUMENT_CACHE_TTL = 600
+QUERY_CACHE_MAX_ENTRIES = 1000
+# instruments offered when a typed instrument name does not match
+XINSTRUMENT_SUGGESTIONS = 5
 
+from .instrument_search import InstrumentSearchIndex
+from .http_client import HTTPClient, IDEMPOTENCY_KEY_HEADER
+from .telemetry import timed_call, DB_POOL_IN_USE, DB_POOL_OPEN, DB_POOL_CONNECTS, DB_POOL_WAIT_SECONDS
 from mysql import connector
+from collections import OrderedDict
+from contextlib import contextmanager
 from enum import Enum
 import json
-import requests
+import queue
+import threading
+import time
+import uuid
 
 class Environment(Enum):
     DEV = 0
     TEST = 1
     APP = 2
 
+class DBConnectionPool:
+    """
+        Lazily filled pool of MySQL connections for one environment.
+
+        Connections are health checked (and reconnected if stale) when checked out, run in autocommit so a pooled
+        connection never reads from an old snapshot, and limit every SELECT to DB_QUERY_TIMEOUT_MS. When all connections
+        are in use, callers wait up to DB_POOL_CHECKOUT_TIMEOUT seconds for one to be released. Connections in use and
+        open, connects and checkout waits are exported on `/metrics`, labelled with the environment.
+    """
+
+    _pools = {}
+    _pools_lock = threading.Lock()
+
+    def __init__(self, db_conf, size=DB_POOL_SIZE, name=""):
+        self.db_conf = db_conf
+        self.name = name
+        self.size = size
+        self._idle = queue.LifoQueue()
+        self._lock = threading.Lock()
+        self._created = 0
+        self.in_use = 0
+        self.connects = 0
+        self.checkouts = 0
+        self.wait_time_total = 0.0
+        self.wait_time_max = 0.0
+
+    @classmethod
+    def forEnvironment(cls, env):
+        with cls._pools_lock:
+            if env not in cls._pools:
+                cls._pools[env] = cls(DB_01_CONFIG[env.value], name=env.name)
+            return cls._pools[env]
+
+    def _connect(self):
+        conn = connector.connect(**self.db_conf, connection_timeout=DB_CONNECT_TIMEOUT, autocommit=True)
+        if not conn.is_connected():
+            raise RuntimeError("Failed to connect to the database.")
+        cursor = conn.cursor()
+        cursor.execute("SET SESSION MAX_EXECUTION_TIME = %s", (DB_QUERY_TIMEOUT_MS,))
+        cursor.close()
+        with self._lock:
+            self.connects += 1
+        DB_POOL_CONNECTS.inc(self.name)
+        return conn
+
+    @staticmethod
+    def _isHealthy(conn):
+        try:
+            conn.ping(reconnect=False)
+            return True
+        except Exception:
+            return False
+
+    def acquire(self):
+        start = time.perf_counter()
+        conn = None
+        try:
+            conn = self._idle.get_nowait()
+        except queue.Empty:
+            with self._lock:
+                may_create = self._created < self.size
+                if may_create:
+                    self._created += 1
+                DB_POOL_OPEN.set(self._created, self.name)
+            if not may_create:
+                try:
+                    conn = self._idle.get(timeout=DB_POOL_CHECKOUT_TIMEOUT)
+                except queue.Empty:
+                    raise RuntimeError("Timed out waiting for a database connection.")
+
+        if conn is not None and not self._isHealthy(conn):
+            # stale connection (e.g. closed by wait_timeout on the server), replace it
+            self._close(conn)
+            conn = None
+        if conn is None:
+            try:
+                conn = self._connect()
+            except Exception:
+                with self._lock:
+                    self._created -= 1
+                    DB_POOL_OPEN.set(self._created, self.name)
+                raise
+
+        waited = time.perf_counter() - start
+        with self._lock:
+            self.in_use += 1
+            self.checkouts += 1
+            self.wait_time_total += waited
+            self.wait_time_max = max(self.wait_time_max, waited)
+            DB_POOL_IN_USE.set(self.in_use, self.name)
+        DB_POOL_WAIT_SECONDS.observe(waited, self.name)
+        return conn
+
+    def release(self, conn, broken=False):
+        with self._lock:
+            self.in_use -= 1
+            if broken:
+                self._created -= 1
+            DB_POOL_IN_USE.set(self.in_use, self.name)
+            DB_POOL_OPEN.set(self._created, self.name)
+        if broken:
+            self._close(conn)
+        else:
+            self._idle.put(conn)
+
+    @staticmethod
+    def _close(conn):
+        try:
+            conn.close()
+        except Exception:
+            pass
+
+    @contextmanager
+    def connection(self):
+        conn = self.acquire()
+        try:
+            yield conn
+        except connector.errors.OperationalError:
+            # lost or timed out connection, do not hand it out again
+            self.release(conn, broken=True)
+            raise
+        except BaseException:
+            self.release(conn)
+            raise
+        else:
+            self.release(conn)
+
+    def metrics(self):
+        with self._lock:
+            return {
+                "size": self.size,
+                "open": self._created,
+                "in_use": self.in_use,
+                "connects": self.connects,
+                "checkouts": self.checkouts,
+                "wait_time_avg": self.wait_time_total / self.checkouts if self.checkouts else 0.0,
+                "wait_time_max": self.wait_time_max,
+            }
+
+
+class TTLCache:
+    """
+        Size-bounded (least recently used first) cache whose entries expire after `ttl` seconds.
+
+        `getOrFetch` collapses concurrent misses on the same key into a single fetch: the first caller fetches, the others
+        wait for its result (or its error). Empty results are only kept with `cache_empty`.
+    """
+
+    class _PendingFetch:
+        def __init__(self):
+            self.event = threading.Event()
+            self.value = None
+            self.error = None
+
+    def __init__(self, ttl, max_entries=QUERY_CACHE_MAX_ENTRIES, cache_empty=True):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.cache_empty = cache_empty
+        self._entries = OrderedDict()
+        self._pending = {}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def getOrFetch(self, key, fetch):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and time.monotonic() - entry[0] < self.ttl:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry[1]
+            pending = self._pending.get(key)
+            leader = pending is None
+            if leader:
+                pending = self._pending[key] = self._PendingFetch()
+                self.misses += 1
+            else:
+                self.hits += 1
+
+        if not leader:
+            pending.event.wait()
+            if pending.error is not None:
+                raise pending.error
+            return pending.value
+
+        try:
+            pending.value = fetch()
+            if self.cache_empty or pending.value:
+                with self._lock:
+                    self._entries[key] = (time.monotonic(), pending.value)
+                    self._entries.move_to_end(key)
+                    while len(self._entries) > self.max_entries:
+                        self._entries.popitem(last=False)
+            return pending.value
+        except Exception as e:
+            pending.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._pending[key]
+            pending.event.set()
+
+    def peek(self, key):
+        # the cached value, or None without fetching it
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and time.monotonic() - entry[0] < self.ttl:
+                return entry[1]
+            return None
+
+    def invalidate(self, key):
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+# connectors per (environment, user), instruments per (environment, exchange) shared by all users. A user without
+# connectors is told to create one and come back, so an empty list is read again on the next form run
+XCONN_CACHE = TTLCache(XCONN_CACHE_TTL, cache_empty=False)
+XINSTRUMENT_CACHE = TTLCache(XINSTRUMENT_CACHE_TTL)
+# search indexes over the cached instrument lists, per (environment, exchange)
+XINSTRUMENT_INDEX_CACHE = TTLCache(XINSTRUMENT_CACHE_TTL)
+
+
 class RazgaRUI:
     def __init__(self, UID, ENV):
         self.UID = UID
         self.ENV = ENV
 
     @staticmethod
-    def EXECUTESQL(db_conf, query, params=None):     
-        with connector.connect(**db_conf) as conn:
-            if conn.is_connected():
-                cursor = conn.cursor(dictionary=True)
+    def EXECUTESQL(env, query, params=None, call="sql"):
+        # `call` names the query in the razgar_call_seconds metric
+        with timed_call("db", call), DBConnectionPool.forEnvironment(env).connection() as conn:
+            cursor = conn.cursor(dictionary=True)
+            try:
                 cursor.execute(query, params)
-                results = cursor.fetchall()
+                return cursor.fetchall()
+            finally:
                 cursor.close()
-                return results
-            else:
-                raise RuntimeError("Failed to connect to the database.")
     
     def getXConnList(self):
-        return self.EXECUTESQL(DB_01_CONFIG[self.ENV.value], "SELECT * FROM `exchange_connectors` WHERE investor_id = %s", (self.UID,))
+        return XCONN_CACHE.getOrFetch(
+            (self.ENV, str(self.UID)),
+            lambda: self.EXECUTESQL(self.ENV, "SELECT * FROM `exchange_connectors` WHERE investor_id = %s", (self.UID,), call="getXConnList"))
     
     def getXConnByName(self, name):
-        return self.EXECUTESQL(DB_01_CONFIG[self.ENV.value], "SELECT * FROM `exchange_connectors` WHERE investor_id = %s AND title = %s", (self.UID, name))
+        # served from the cached connector list, the form asks for the same connector several times
+        return [entry for entry in self.getXConnList() if entry.get('title') == name]
     
     def isXConnInList(self, name):
         xconns = self.getXConnList()
@@ -74,44 +324,91 @@ class RazgaRUI:
         return False
 
     def getXInstrumentListByXID(self, x_id):
-        return self.EXECUTESQL(DB_01_CONFIG[self.ENV.value], "SELECT * FROM `exchange_instruments` WHERE exchange_id = %s", (x_id,))
+        return XINSTRUMENT_CACHE.getOrFetch(
+            (self.ENV, x_id),
+            lambda: self.EXECUTESQL(self.ENV, "SELECT * FROM `exchange_instruments` WHERE exchange_id = %s", (x_id,), call="getXInstrumentListByXID"))
 
     def getXInstrumentListByXConnName(self, xconn_name):
         x_conn = self.getXConnByName(xconn_name)
         x_id = x_conn[0]["exchange_id"]
         return self.getXInstrumentListByXID(x_id)
     
-    def getXInstrument(self, xinstrument_name, xconn_name):
-        xinstruments = self.getXInstrumentListByXConnName(xconn_name)
-        for entry in xinstruments:
-            if entry.get('name') == xinstrument_name:
-                return entry
-        return 0
+    def getXInstrumentSearchIndex(self, xconn_name):
+        return self._xinstrumentSearchIndex(self.getXConnByName(xconn_name)[0]["exchange_id"])
+
+    def _xinstrumentSearchIndex(self, x_id):
+        return XINSTRUMENT_INDEX_CACHE.getOrFetch(
+            (self.ENV, x_id),
+            lambda: InstrumentSearchIndex(self.getXInstrumentListByXID(x_id)))
+
+    def searchXInstrument(self, xinstrument_name, xconn_name, limit=XINSTRUMENT_SUGGESTIONS):
+        """
+            Looks up a typed instrument name in the search index of the connector's exchange. Returns the instrument (with
+            the connector id as `xconn_id`) when the name matches one unambiguously (case and punctuation aside, or as a
+            unique prefix) and up to `limit` closest instruments otherwise, as (instrument or None, suggestions).
+
+            When the index of the exchange is not cached yet, an exact name is first looked up with the targeted
+            `findXInstrument`; the whole instrument list is only fetched, to build the index, for a name it does not find.
+        """
+        xconn = self.getXConnByName(xconn_name)[0]
+        if XINSTRUMENT_INDEX_CACHE.peek((self.ENV, xconn["exchange_id"])) is None:
+            xinstrument = self.findXInstrument(xinstrument_name, xconn_name)
+            if xinstrument:
+                return xinstrument, []
+        index = self._xinstrumentSearchIndex(xconn["exchange_id"])
+        xinstrument = index.resolve(xinstrument_name)
+        if xinstrument is not None:
+            return dict(xinstrument, xconn_id=xconn["id"]), []
+        return None, index.suggest(xinstrument_name, limit)
+
+    def findXInstrument(self, xinstrument_name, xconn_name):
+        """
+            Resolves the user's connector and the instrument by name in one joined query, instead of fetching every
+            instrument of the exchange and scanning them. Returns the instrument (with the connector id as `xconn_id`)
+            or 0. Uses the (investor_id, title) and (exchange_id, name) indexes.
+        """
+        rows = self.EXECUTESQL(self.ENV, (
+            "SELECT i.id, i.name, i.exchange_id, c.id AS xconn_id "
+            "FROM `exchange_connectors` c JOIN `exchange_instruments` i ON i.exchange_id = c.exchange_id "
+            "WHERE c.investor_id = %s AND c.title = %s AND i.name = %s LIMIT 1"
+        ), (self.UID, xconn_name, xinstrument_name), call="findXInstrument")
+        return rows[0] if rows else 0
+
+    def botAPI(self):
+        # one pooled client, with its circuit breaker, per environment's API
+        return HTTPClient.forBaseURL(URL_CONFIG[self.ENV.value])
 
     def makeBot(self, title, xconn_id, xinstrument_id):
-        response = requests.post(url=URL_CONFIG[self.ENV.value]+URL_ADD_BOT, data={
-            'title': title,
-            'type': '0',
-            'exchangeConnector': xconn_id,
-            'symbol': xinstrument_id,
-            'section': '0',
-            'user_id': self.UID,
-            'static_auth': SECRET_PASS_PHRASE
-        })
-        json_obj = json.loads(response.text)
+        # a retried add-bot request could create the bot twice, unless the API deduplicates it by the key
+        headers = {IDEMPOTENCY_KEY_HEADER: str(uuid.uuid4())} if MAKE_BOT_IDEMPOTENCY_SUPPORTED else None
+        with timed_call("api", "makeBot"):
+            response = self.botAPI().post(URL_ADD_BOT, headers=headers, idempotent=MAKE_BOT_IDEMPOTENCY_SUPPORTED, data={
+                'title': title,
+                'type': '0',
+                'exchangeConnector': xconn_id,
+                'symbol': xinstrument_id,
+                'section': '0',
+                'user_id': self.UID,
+                'static_auth': SECRET_PASS_PHRASE
+            })
+            json_obj = json.loads(response.text)
         if json_obj[FIELD_COMMUNICATION_CODE] == API_SUCCESS_CODE and json_obj["id"] > 0:
+            # the user's data changed, the next form run reads it fresh
+            XCONN_CACHE.invalidate((self.ENV, str(self.UID)))
             return json_obj["id"]
         else:
             raise RuntimeError("Failed to create bot. Error code: " + json_obj[FIELD_COMMUNICATION_CODE])
          
     def startBot(self, bot_id):
-        response = requests.post(url=URL_CONFIG[self.ENV.value]+URL_CONTROL_BOT, data={    
-            'bot_id': bot_id,
-            'action': 'start',
-            'user_id': self.UID,
-            'static_auth': SECRET_PASS_PHRASE
-        })
-        json_obj = json.loads(response.text)
+        # starting an already started bot is harmless, so this one is retried
+        with timed_call("api", "startBot"):
+            response = self.botAPI().post(URL_CONTROL_BOT, idempotent=True, data={
+                'bot_id': bot_id,
+                'action': 'start',
+                'user_id': self.UID,
+                'static_auth': SECRET_PASS_PHRASE
+            })
+            json_obj = json.loads(response.text)
         if json_obj[FIELD_COMMUNICATION_CODE] != API_SUCCESS_CODE:
             raise RuntimeError(json_obj[FIELD_LAST_CRASH_TEXT] if FIELD_LAST_CRASH_TEXT in json_obj else "Unknown error")
 
@@ -142,6 +439,10 @@ class Helper:
                     break
         return buttons
 
+    @staticmethod
+    def mapXInstrumentSuggestionsToButtons(xinstruments):
+        return [{"title": entry.get('name'), "payload": entry.get('name')} for entry in xinstruments]
+
     @staticmethod
     def convertEnv(env):
         if env in [0, "0"]:
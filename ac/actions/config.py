@@ -0,0 +1,96 @@
+from collections import namedtuple
+from types import MappingProxyType
+import hashlib
+import os
+import threading
+
+CONFIG_PATH = os.path.join(os.path.dirname(__file__), 'conf.txt')
+PROMPT_TEMPLATE_PATH = os.path.join(os.path.dirname(__file__), 'prompt_template.txt')
+
+
+class Config(namedtuple("Config", ["values", "prompt_template", "prompt_template_version"])):
+    """
+        `conf.txt` and `prompt_template.txt`, parsed once into a read-only object. `values` maps every `KEY = value`
+        line to its raw string; the getters convert it, falling back to the given default when the key is missing, so
+        every module keeps its own defaults.
+    """
+    __slots__ = ()
+
+    def get_str(self, key, default):
+        return self.values.get(key, default)
+
+    def get_bool(self, key, default):
+        value = self.values.get(key)
+        return default if value is None else value.lower() == 'true'
+
+    def get_int(self, key, default):
+        value = self.values.get(key)
+        return default if value is None else int(value)
+
+    def get_float(self, key, default):
+        value = self.values.get(key)
+        return default if value is None else float(value)
+
+    def get_list(self, key, default):
+        value = self.values.get(key)
+        if value is None:
+            return default
+        return [item.strip().lower() for item in value.split(',') if item.strip()]
+
+
+def read_config(config_path=CONFIG_PATH, prompt_template_path=PROMPT_TEMPLATE_PATH):
+    values = {}
+    with open(config_path, 'r') as file:
+        for line in file:
+            if '=' not in line or line.lstrip().startswith('#'):
+                continue
+            key, value = line.split('=', 1)
+            values[key.strip()] = value.strip()
+    with open(prompt_template_path, 'r') as file:
+        prompt_template = file.read()
+    prompt_template_version = hashlib.sha256(prompt_template.encode()).hexdigest()[:16]
+    return Config(MappingProxyType(values), prompt_template, prompt_template_version)
+
+
+_config = None
+_config_lock = threading.Lock()
+# called with the new Config whenever the files change, see reload_config
+_listeners = []
+
+
+def get_config():
+    """
+        The config of the process, read from disk on the first call only.
+    """
+    global _config
+    with _config_lock:
+        if _config is None:
+            _config = read_config()
+        return _config
+
+
+def add_config_listener(listener):
+    _listeners.append(listener)
+
+
+def reload_config():
+    """
+        Reads the files again; when they changed, the new config replaces the old one and is passed to every listener
+        (each module's `apply_config`). When the files cannot be read the old config stays in place.
+    """
+    global _config
+    try:
+        config = read_config()
+    except Exception as e:
+        print(f"ERROR: could not reload {CONFIG_PATH}, keeping the current config: {e}")
+        return get_config()
+    with _config_lock:
+        if config == _config:
+            return _config
+        _config = config
+    for listener in _listeners:
+        try:
+            listener(config)
+        except Exception as e:
+            print(f"ERROR: could not apply the new config in {listener.__module__}: {e}")
+    return config
@@ -0,0 +1,105 @@
+from collections import Counter
+import math
+
+from .bm25 import tokenize
+
+START_INDEX_FIELD = "start_index"
+SOURCE_FIELD = "source"
+
+
+class TokenCounter:
+    """
+        Counts tokens with tiktoken's `encoding_name` encoding (llama3 uses a tiktoken-style BPE close to cl100k_base).
+        Without tiktoken installed it falls back to the usual 4 characters per token estimate.
+    """
+
+    def __init__(self, encoding_name="cl100k_base"):
+        try:
+            import tiktoken
+            self._encoding = tiktoken.get_encoding(encoding_name)
+        except Exception as e:
+            print(f"ERROR: tiktoken encoding {encoding_name} is not available, token counts are estimated: {e}")
+            self._encoding = None
+
+    def count(self, text):
+        if self._encoding is None:
+            return math.ceil(len(text) / 4)
+        return len(self._encoding.encode(text, disallowed_special=()))
+
+
+def _bag_of_words(text):
+    counts = Counter(tokenize(text))
+    norm = math.sqrt(sum(count * count for count in counts.values()))
+    return counts, norm
+
+
+def _similarity(first, second):
+    (first_counts, first_norm), (second_counts, second_norm) = first, second
+    if not first_norm or not second_norm:
+        return 0.0
+    if len(first_counts) > len(second_counts):
+        first_counts, second_counts = second_counts, first_counts
+    return sum(count * second_counts.get(term, 0) for term, count in first_counts.items()) / (first_norm * second_norm)
+
+
+def mmr_order(results, mmr_lambda):
+    """
+        Orders the candidates by maximal marginal relevance: relevance is the rank in `results` (scores of fused results
+        are not comparable to similarities), redundancy the bag-of-words cosine to the chunks already picked.
+    """
+    if not results:
+        return []
+    relevance = [1 - rank / len(results) for rank in range(len(results))]
+    vectors = [_bag_of_words(doc.page_content) for doc, _score in results]
+    remaining = list(range(len(results)))
+    picked = []
+    while remaining:
+        best = max(remaining, key=lambda i: mmr_lambda * relevance[i] - (1 - mmr_lambda) * max(
+            (_similarity(vectors[i], vectors[j]) for j in picked), default=0.0))
+        picked.append(best)
+        remaining.remove(best)
+    return [results[i] for i in picked]
+
+
+def merge_overlapping(docs, separator):
+    """
+        Joins the chunks into one context. Chunks of the same source whose `start_index` ranges overlap (the splitter
+        overlaps neighbours by up to `chunk_overlap` characters) are merged, so the shared text is only sent once.
+        Sources keep the order in which they first appear in `docs`.
+    """
+    groups = {}
+    for position, doc in enumerate(docs):
+        source = doc.metadata.get(SOURCE_FIELD)
+        start = doc.metadata.get(START_INDEX_FIELD)
+        key = source if source is not None and start is not None else (None, position)
+        groups.setdefault(key, []).append((start, doc.page_content))
+
+    texts = []
+    for spans in groups.values():
+        merged = []
+        for start, text in sorted(spans, key=lambda span: span[0] or 0):
+            if merged and start is not None and start <= merged[-1][0] + len(merged[-1][1]):
+                overlap = merged[-1][0] + len(merged[-1][1]) - start
+                if overlap < len(text):
+                    merged[-1][1] += text[overlap:]
+            else:
+                merged.append([start, text])
+        texts.extend(text for _start, text in merged)
+    return separator.join(texts)
+
+
+def assemble_context(results, token_counter, token_budget, mmr_lambda, separator):
+    """
+        Context for the prompt: candidates in MMR order, packed while the merged context stays within `token_budget`.
+        Returns the context and its token count.
+    """
+    picked = []
+    context, tokens = "", 0
+    for doc, _score in mmr_order(results, mmr_lambda):
+        candidate_context = merge_overlapping([*picked, doc], separator)
+        candidate_tokens = token_counter.count(candidate_context)
+        if candidate_tokens > token_budget:
+            continue
+        picked.append(doc)
+        context, tokens = candidate_context, candidate_tokens
+    return context, tokens
@@ -0,0 +1,65 @@
+from .telemetry import RAG_DIRECT_ANSWER_SECONDS_SAVED
+import re
+import threading
+
+QUESTION_PREFIX = re.compile(r"^\s*(?:\*\*)?\s*(?:Q|Question)\s*[:.)]\s*(?:\*\*)?\s*", re.IGNORECASE)
+ANSWER_PREFIX = re.compile(r"^\s*(?:\*\*)?\s*(?:A|Answer)\s*[:.)]\s*(?:\*\*)?\s*", re.IGNORECASE)
+HEADING = re.compile(r"^\s*#{1,6}\s+(.*?)\s*#*\s*$")
+
+
+def extract_faq_pairs(text):
+    """
+        Question/answer pairs of an FAQ markdown file. Two layouts are recognised:
+
+        - a heading ending with "?" followed by the answer text, up to the next heading;
+        - "Q:" / "Question:" lines followed by "A:" / "Answer:" lines.
+    """
+    pairs = []
+    question, answer_lines = None, []
+
+    def close():
+        answer = "\n".join(answer_lines).strip()
+        if question and answer:
+            pairs.append((question, answer))
+
+    for line in text.splitlines():
+        heading = HEADING.match(line)
+        if heading or QUESTION_PREFIX.match(line):
+            close()
+            title = heading.group(1) if heading else QUESTION_PREFIX.sub("", line).strip()
+            question = title if title.endswith("?") or not heading else None
+            answer_lines = []
+        elif question is not None:
+            if not answer_lines and ANSWER_PREFIX.match(line):
+                line = ANSWER_PREFIX.sub("", line)
+            answer_lines.append(line)
+    close()
+    return pairs
+
+
+class DirectAnswerStats:
+    """
+        Hit rate of the direct answers and the LLM time they saved, estimated from the average duration of the LLM calls
+        that did happen. The saved time is exported on `/metrics`, next to `rag_answers_total{source="direct"}`, to tune
+        `DIRECT_ANSWER_THRESHOLD`.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.questions = 0
+        self.hits = 0
+        self.llm_calls = 0
+        self.llm_seconds = 0.0
+
+    def record_llm_call(self, seconds):
+        with self._lock:
+            self.questions += 1
+            self.llm_calls += 1
+            self.llm_seconds += seconds
+
+    def record_hit(self):
+        with self._lock:
+            self.questions += 1
+            self.hits += 1
+            average_llm_seconds = self.llm_seconds / self.llm_calls if self.llm_calls else 0.0
+        RAG_DIRECT_ANSWER_SECONDS_SAVED.inc(amount=average_llm_seconds)
@@ -0,0 +1,42 @@
+import threading
+
+
+class FileWatcher:
+    """
+        Polls cheap fingerprints (a pointer file's content, file sizes and modification times) every `interval_seconds`
+        in a daemon thread, and calls the matching callback in that thread when one changes, so the work of a reload
+        never runs on a request. A failed callback is retried on the next poll.
+    """
+
+    def __init__(self, name, interval_seconds):
+        self.name = name
+        self.interval_seconds = interval_seconds
+        self._watches = []
+        self._stop = threading.Event()
+        self._thread = None
+
+    def watch(self, fingerprint, on_change):
+        self._watches.append([fingerprint, fingerprint(), on_change])
+
+    def check(self):
+        for watch in self._watches:
+            fingerprint, last, on_change = watch
+            try:
+                current = fingerprint()
+                if current != last:
+                    on_change()
+                    watch[1] = current
+            except Exception as e:
+                print(f"ERROR: {self.name} reload failed, retrying in {self.interval_seconds}s: {e}")
+
+    def _run(self):
+        while not self._stop.wait(self.interval_seconds):
+            self.check()
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name=f"watch-{self.name}", daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        self._stop.set()
@@ -0,0 +1,124 @@
+from requests.adapters import HTTPAdapter
+import random
+import requests
+import threading
+import time
+
+HTTP_POOL_SIZE = 10
+HTTP_CONNECT_TIMEOUT = 3.05
+HTTP_READ_TIMEOUT = 30
+HTTP_MAX_RETRIES = 3
+HTTP_BACKOFF_BASE = 0.5
+HTTP_BACKOFF_MAX = 8
+CIRCUIT_FAILURE_THRESHOLD = 5
+CIRCUIT_RESET_TIMEOUT = 30
+IDEMPOTENCY_KEY_HEADER = "Idempotency-Key"
+
+
+class CircuitOpenError(requests.ConnectionError):
+    """
+        Raised without calling the upstream while its circuit breaker is open.
+    """
+
+
+class CircuitBreaker:
+    """
+        Fails fast once an upstream is clearly down: after `failure_threshold` consecutive failures every call is
+        refused for `reset_timeout` seconds, then a single trial call decides whether the circuit closes again. A trial that
+        never reports back (e.g. a cancelled call) is replaced by a new one after another `reset_timeout`.
+    """
+
+    def __init__(self, name, failure_threshold=CIRCUIT_FAILURE_THRESHOLD, reset_timeout=CIRCUIT_RESET_TIMEOUT):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self._lock = threading.Lock()
+        self._failures = 0
+        self._opened_at = None
+        self._trial_started_at = None
+
+    def before_call(self):
+        with self._lock:
+            if self._opened_at is None:
+                return
+            now = time.monotonic()
+            trial_running = self._trial_started_at is not None and now - self._trial_started_at < self.reset_timeout
+            if now - self._opened_at < self.reset_timeout or trial_running:
+                raise CircuitOpenError(f"{self.name} is unavailable, not calling it for now")
+            # half open, this call is the trial
+            self._trial_started_at = now
+
+    def record_success(self):
+        with self._lock:
+            self._failures = 0
+            self._opened_at = None
+            self._trial_started_at = None
+
+    def record_failure(self):
+        with self._lock:
+            self._failures += 1
+            if self._trial_started_at is not None or (self._opened_at is None and self._failures >= self.failure_threshold):
+                print(f"ERROR: circuit of {self.name} opened after {self._failures} consecutive failures")
+                self._opened_at = time.monotonic()
+            self._trial_started_at = None
+
+
+def backoff_delay(attempt, base=HTTP_BACKOFF_BASE, maximum=HTTP_BACKOFF_MAX):
+    # "full jitter": a random delay up to the exponential backoff, so retrying workers do not hit the upstream in waves
+    return random.uniform(0, min(maximum, base * 2 ** attempt))
+
+
+class HTTPClient:
+    """
+        Outbound HTTP to one base URL: a keep-alive connection pool shared by all action-server threads, connect/read
+        timeouts on every call, bounded retries with jittered backoff and a circuit breaker.
+
+        Only calls marked `idempotent` are retried, a request that may already have been processed upstream is not sent
+        twice. Connection errors, timeouts and 5xx responses count as failures of the upstream.
+    """
+
+    _clients = {}
+    _clients_lock = threading.Lock()
+
+    def __init__(self, base_url, pool_size=HTTP_POOL_SIZE, connect_timeout=HTTP_CONNECT_TIMEOUT,
+                 read_timeout=HTTP_READ_TIMEOUT, max_retries=HTTP_MAX_RETRIES):
+        self.base_url = base_url
+        self.timeout = (connect_timeout, read_timeout)
+        self.max_retries = max_retries
+        self.circuit = CircuitBreaker(base_url or "bot API")
+        self.session = requests.Session()
+        # retries are done here, where it is known whether the call is idempotent
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size, max_retries=0)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+
+    @classmethod
+    def forBaseURL(cls, base_url):
+        with cls._clients_lock:
+            client = cls._clients.get(base_url)
+            if client is None:
+                client = cls._clients[base_url] = cls(base_url)
+            return client
+
+    def post(self, path, data=None, headers=None, idempotent=False):
+        attempts = 1 + (self.max_retries if idempotent else 0)
+        for attempt in range(attempts):
+            self.circuit.before_call()
+            try:
+                response = self.session.post(self.base_url + path, data=data, headers=headers, timeout=self.timeout)
+            except (requests.ConnectionError, requests.Timeout) as e:
+                self.circuit.record_failure()
+                if attempt + 1 == attempts:
+                    raise
+                error = e
+            else:
+                if response.status_code < 500:
+                    self.circuit.record_success()
+                    return response
+                self.circuit.record_failure()
+                if attempt + 1 == attempts:
+                    response.raise_for_status()
+                error = f"HTTP {response.status_code}"
+            delay = backoff_delay(attempt)
+            print(f"ERROR: POST {path} failed ({error}), retry {attempt + 1}/{attempts - 1} in {delay:.2f}s")
+            time.sleep(delay)
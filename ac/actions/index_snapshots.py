@@ -0,0 +1,91 @@
+from collections import namedtuple
+import os
+import shutil
+import time
+import uuid
+
+CURRENT_POINTER = "CURRENT"
+# the published snapshot, the previous one, which the action server may still be draining queries from, and the one
+# before it, which a server that missed a hot reload (two builds published within its interval) may still be on
+SNAPSHOTS_KEPT = 3
+
+IndexPaths = namedtuple("IndexPaths", ["version", "chroma_path", "numpy_index_path", "bm25_index_path", "faq_index_path"])
+
+
+def snapshot_paths(snapshots_path, version):
+    root = os.path.join(snapshots_path, version)
+    return IndexPaths(
+        version,
+        os.path.join(root, "chroma"),
+        os.path.join(root, "numpy_index"),
+        os.path.join(root, "bm25_index.pkl"),
+        os.path.join(root, "faq_index"),
+    )
+
+
+def new_snapshot_version():
+    # sorts in build order, the suffix keeps two builds started in the same second apart
+    return time.strftime("%Y%m%d-%H%M%S") + "-" + uuid.uuid4().hex[:6]
+
+
+def current_pointer_path(snapshots_path):
+    return os.path.join(snapshots_path, CURRENT_POINTER)
+
+
+def read_current_version(snapshots_path):
+    try:
+        with open(current_pointer_path(snapshots_path), "r") as file:
+            return file.read().strip() or None
+    except FileNotFoundError:
+        return None
+
+
+def current_snapshot(snapshots_path):
+    """
+        Paths of the published snapshot, None when no snapshot was published yet.
+    """
+    version = read_current_version(snapshots_path)
+    return snapshot_paths(snapshots_path, version) if version is not None else None
+
+
+def publish_snapshot(snapshots_path, version):
+    """
+        Points `CURRENT` to `version`. The pointer is written to a temporary file and renamed over the old one, so a
+        reader sees either the previous version or the new one, never a partial write.
+    """
+    tmp_path = os.path.join(snapshots_path, f".{CURRENT_POINTER}.{os.getpid()}.tmp")
+    with open(tmp_path, "w") as file:
+        file.write(version + "\n")
+        file.flush()
+        os.fsync(file.fileno())
+    os.replace(tmp_path, current_pointer_path(snapshots_path))
+    directory = os.open(snapshots_path, os.O_RDONLY)
+    try:
+        os.fsync(directory)
+    finally:
+        os.close(directory)
+
+
+def list_snapshots(snapshots_path):
+    if not os.path.isdir(snapshots_path):
+        return []
+    return sorted(
+        name for name in os.listdir(snapshots_path)
+        if not name.startswith(".") and os.path.isdir(os.path.join(snapshots_path, name))
+    )
+
+
+def prune_snapshots(snapshots_path, keep=SNAPSHOTS_KEPT):
+    """
+        Deletes all but the `keep` newest snapshots (including unfinished builds). The published one is never deleted.
+        Returns the deleted versions.
+    """
+    current = read_current_version(snapshots_path)
+    versions = list_snapshots(snapshots_path)
+    deleted = []
+    for version in versions[:max(0, len(versions) - keep)]:
+        if version == current:
+            continue
+        shutil.rmtree(os.path.join(snapshots_path, version), ignore_errors=True)
+        deleted.append(version)
+    return deleted
@@ -0,0 +1,91 @@
+import bisect
+import heapq
+import re
+
+import numpy as np
+
+NON_ALPHANUMERIC_PATTERN = re.compile(r"[^a-z0-9]+")
+NAME_FIELD = "name"
+
+
+def normalize_key(name):
+    # "BTC-PERPETUAL", "btc perpetual" and "BTC_Perpetual" all become "btcperpetual"
+    return NON_ALPHANUMERIC_PATTERN.sub("", str(name).lower())
+
+
+def trigrams(key):
+    padded = f"  {key} "
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+class InstrumentSearchIndex:
+    """
+        Search index over the instrument list of one exchange, for names typed by the user.
+
+        Names are compared by their normalized key (lowercase, without punctuation or spaces). The keys are kept sorted,
+        a flat prefix trie where the instruments starting with a prefix are one bisected range, which resolves exact and
+        unambiguous prefix matches ("btc perp" -> "BTC-PERPETUAL"). Trigram postings rank the closest instruments for
+        typos, counted with one `bincount` over the postings of the query's trigrams. A lookup never scans the whole list in
+        Python, which keeps it well under a millisecond for tens of thousands of symbols.
+    """
+
+    def __init__(self, instruments):
+        self.instruments = list(instruments)
+        keyed = sorted((normalize_key(entry.get(NAME_FIELD, "")), row) for row, entry in enumerate(self.instruments))
+        self.sorted_keys = [key for key, _row in keyed]
+        self.sorted_rows = [row for _key, row in keyed]
+        self.key_lengths = np.zeros(len(self.instruments), dtype=np.int32)
+        postings = {}
+        for key, row in keyed:
+            self.key_lengths[row] = len(key)
+            for trigram in trigrams(key):
+                postings.setdefault(trigram, []).append(row)
+        self.postings = {trigram: np.asarray(rows, dtype=np.int32) for trigram, rows in postings.items()}
+
+    def _prefix_range(self, key):
+        start = bisect.bisect_left(self.sorted_keys, key)
+        end = bisect.bisect_left(self.sorted_keys, key + "\uffff", start)
+        return start, end
+
+    def resolve(self, name):
+        """
+            Instrument for `name` if it is unambiguous: the only instrument with that normalized key or, failing that,
+            the only one starting with it. None otherwise.
+        """
+        key = normalize_key(name)
+        if not key:
+            return None
+        start, end = self._prefix_range(key)
+        exact_end = bisect.bisect_right(self.sorted_keys, key, start, end)
+        if exact_end > start:
+            end = exact_end
+        return self.instruments[self.sorted_rows[start]] if end - start == 1 else None
+
+    def suggest(self, name, limit):
+        """
+            Up to `limit` instruments closest to `name`: those starting with it (shortest first), then the best trigram
+            similarities.
+        """
+        key = normalize_key(name)
+        if not key or limit <= 0:
+            return []
+        start, end = self._prefix_range(key)
+        picked = heapq.nsmallest(limit, self.sorted_rows[start:end], key=lambda row: self.key_lengths[row])
+
+        if len(picked) >= limit:
+            return [self.instruments[row] for row in picked]
+
+        query_trigrams = trigrams(key)
+        rows = [self.postings[trigram] for trigram in query_trigrams if trigram in self.postings]
+        if rows:
+            shared = np.bincount(np.concatenate(rows), minlength=len(self.instruments))
+            # Dice coefficient of the trigram sets, a key of n characters has n + 1 padded trigrams
+            scores = 2 * shared / (len(query_trigrams) + self.key_lengths + 1)
+            count = min(limit + len(picked), len(scores))
+            best = np.argpartition(-scores, count - 1)[:count]
+            for row in best[np.argsort(-scores[best])]:
+                if len(picked) >= limit or scores[row] == 0:
+                    break
+                if row not in picked:
+                    picked.append(int(row))
+        return [self.instruments[row] for row in picked]
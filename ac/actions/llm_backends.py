@@ -0,0 +1,429 @@
+from .http_client import CircuitBreaker, CircuitOpenError
+from .telemetry import LLM_BACKEND_SECONDS, LLM_BACKEND_CALLS, LLM_BACKEND_HEDGES
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait as wait_futures
+import asyncio
+import hashlib
+import json
+import threading
+import time
+
+import httpx
+
+GROQ_BACKEND = "groq"
+LOCAL_BACKEND = "local"
+MOCK_BACKEND = "mock"
+LLM_CONNECT_TIMEOUT = 3.05
+LLM_READ_TIMEOUT = 60
+LLM_MAX_RETRIES = 2
+# latencies kept per backend for the percentiles and the hedging deadline
+LATENCY_WINDOW = 1000
+# threads of the sync calls that may be hedged, the others run on the caller's thread
+HEDGE_WORKERS = 32
+
+
+def build_messages(query_text):
+    return [
+        {
+            "role": "user",
+            "content": query_text,
+        }
+    ]
+
+
+class BackendStats:
+    """
+        Calls, errors and the latencies of the most recent successful calls of one backend. Everything recorded is also
+        exported on `/metrics`, labelled with the backend name.
+    """
+
+    def __init__(self, name=None):
+        self.name = name
+        self._lock = threading.Lock()
+        self.latencies = deque(maxlen=LATENCY_WINDOW)
+        self.calls = 0
+        self.errors = 0
+        self.hedges = 0
+
+    def record(self, seconds=None, error=False):
+        with self._lock:
+            self.calls += 1
+            if error:
+                self.errors += 1
+            elif seconds is not None:
+                self.latencies.append(seconds)
+        LLM_BACKEND_CALLS.inc(self.name, "error" if error else "ok")
+        if not error and seconds is not None:
+            LLM_BACKEND_SECONDS.observe(seconds, self.name)
+
+    def record_hedge(self):
+        with self._lock:
+            self.hedges += 1
+        LLM_BACKEND_HEDGES.inc(self.name)
+
+    def percentile(self, percentile):
+        with self._lock:
+            latencies = sorted(self.latencies)
+        if not latencies:
+            return None
+        return latencies[min(len(latencies) - 1, int(len(latencies) * percentile / 100))]
+
+    def summary(self):
+        p50, p95 = self.percentile(50), self.percentile(95)
+        return {
+            "calls": self.calls,
+            "errors": self.errors,
+            "hedges": self.hedges,
+            "p50_seconds": p50,
+            "p95_seconds": p95,
+        }
+
+
+class LLMBackend:
+    """
+        One LLM provider. Subclasses implement `_complete`, `_complete_async`, `_stream` and `_stream_async`; the
+        public methods add the circuit breaker and the stats, so the router can tell healthy backends from failing ones.
+    """
+
+    name = None
+
+    def __init__(self):
+        self.stats = BackendStats(self.name)
+        self.circuit = CircuitBreaker(f"LLM backend {self.name}")
+
+    def is_upstream_failure(self, error):
+        return True
+
+    def _record_failure(self, error):
+        self.stats.record(error=True)
+        if self.is_upstream_failure(error):
+            self.circuit.record_failure()
+
+    def _record_success(self, seconds):
+        self.stats.record(seconds)
+        self.circuit.record_success()
+
+    def complete(self, prompt):
+        self.circuit.before_call()
+        start = time.perf_counter()
+        try:
+            answer = self._complete(prompt)
+        except Exception as e:
+            self._record_failure(e)
+            raise
+        self._record_success(time.perf_counter() - start)
+        return answer
+
+    async def complete_async(self, prompt):
+        self.circuit.before_call()
+        start = time.perf_counter()
+        try:
+            answer = await self._complete_async(prompt)
+        except asyncio.CancelledError:
+            # a hedge that lost, or a call over its time budget: not a latency sample
+            raise
+        except Exception as e:
+            self._record_failure(e)
+            raise
+        self._record_success(time.perf_counter() - start)
+        return answer
+
+    async def stream_async(self, prompt):
+        self.circuit.before_call()
+        start = time.perf_counter()
+        try:
+            async for token in self._stream_async(prompt):
+                yield token
+        except Exception as e:
+            self._record_failure(e)
+            raise
+        self._record_success(time.perf_counter() - start)
+
+    def stream(self, prompt):
+        self.circuit.before_call()
+        start = time.perf_counter()
+        try:
+            yield from self._stream(prompt)
+        except Exception as e:
+            self._record_failure(e)
+            raise
+        self._record_success(time.perf_counter() - start)
+
+
+class GroqBackend(LLMBackend):
+    name = GROQ_BACKEND
+
+    def __init__(self, model, api_key=""):
+        super().__init__()
+        from groq import Groq, AsyncGroq, APIConnectionError, APIStatusError
+
+        self.model = model
+        self._failure_types = (APIConnectionError, APIStatusError)
+        timeout = httpx.Timeout(LLM_READ_TIMEOUT, connect=LLM_CONNECT_TIMEOUT)
+        # each client keeps a keep-alive connection pool and retries connection errors, 429 and 5xx with jittered backoff
+        self.client = Groq(api_key=api_key, timeout=timeout, max_retries=LLM_MAX_RETRIES)
+        self.async_client = AsyncGroq(api_key=api_key, timeout=timeout, max_retries=LLM_MAX_RETRIES)
+
+    def is_upstream_failure(self, error):
+        connection_error, status_error = self._failure_types
+        return isinstance(error, connection_error) or (isinstance(error, status_error) and error.status_code >= 500)
+
+    def _complete(self, prompt):
+        chat_completion = self.client.chat.completions.create(messages=build_messages(prompt), model=self.model)
+        return chat_completion.choices[0].message.content
+
+    async def _complete_async(self, prompt):
+        # cancelling the awaiting task (e.g. on a timeout) also aborts the underlying HTTP request
+        chat_completion = await self.async_client.chat.completions.create(messages=build_messages(prompt), model=self.model)
+        return chat_completion.choices[0].message.content
+
+    def _stream(self, prompt):
+        stream = self.client.chat.completions.create(messages=build_messages(prompt), model=self.model, stream=True)
+        for chunk in stream:
+            token = chunk.choices[0].delta.content
+            if token:
+                yield token
+
+    async def _stream_async(self, prompt):
+        stream = await self.async_client.chat.completions.create(
+            messages=build_messages(prompt), model=self.model, stream=True)
+        async for chunk in stream:
+            token = chunk.choices[0].delta.content
+            if token:
+                yield token
+
+
+class OpenAICompatibleBackend(LLMBackend):
+    """
+        Any server implementing the OpenAI chat completions API, e.g. llama.cpp's `llama-server` or vLLM, at `base_url`
+        (".../v1").
+    """
+
+    name = LOCAL_BACKEND
+
+    def __init__(self, base_url, model, api_key=""):
+        super().__init__()
+        self.url = base_url.rstrip("/") + "/chat/completions"
+        self.model = model
+        headers = {"Authorization": f"Bearer {api_key}"} if api_key else None
+        timeout = httpx.Timeout(LLM_READ_TIMEOUT, connect=LLM_CONNECT_TIMEOUT)
+        self.client = httpx.Client(timeout=timeout, headers=headers)
+        self.async_client = httpx.AsyncClient(timeout=timeout, headers=headers)
+
+    def is_upstream_failure(self, error):
+        return isinstance(error, httpx.TransportError) or (
+            isinstance(error, httpx.HTTPStatusError) and error.response.status_code >= 500)
+
+    def _body(self, prompt, stream=False):
+        return {"model": self.model, "messages": build_messages(prompt), "stream": stream}
+
+    def _complete(self, prompt):
+        response = self.client.post(self.url, json=self._body(prompt))
+        response.raise_for_status()
+        return response.json()["choices"][0]["message"]["content"]
+
+    async def _complete_async(self, prompt):
+        response = await self.async_client.post(self.url, json=self._body(prompt))
+        response.raise_for_status()
+        return response.json()["choices"][0]["message"]["content"]
+
+    @staticmethod
+    def _token(line):
+        # server-sent events, one "data: {json}" line per chunk and "data: [DONE]" at the end
+        if not line.startswith("data:"):
+            return None
+        data = line[len("data:"):].strip()
+        if data == "[DONE]":
+            return None
+        return json.loads(data)["choices"][0]["delta"].get("content")
+
+    def _stream(self, prompt):
+        with self.client.stream("POST", self.url, json=self._body(prompt, stream=True)) as response:
+            response.raise_for_status()
+            for line in response.iter_lines():
+                token = self._token(line)
+                if token:
+                    yield token
+
+    async def _stream_async(self, prompt):
+        async with self.async_client.stream("POST", self.url, json=self._body(prompt, stream=True)) as response:
+            response.raise_for_status()
+            async for line in response.aiter_lines():
+                token = self._token(line)
+                if token:
+                    yield token
+
+
+class MockBackend(LLMBackend):
+    """
+        Deterministic in-process stand-in for offline runs and load tests: the same prompt always gets the same answer,
+        after `latency_seconds`.
+    """
+
+    name = MOCK_BACKEND
+
+    def __init__(self, latency_seconds=0.0):
+        super().__init__()
+        self.latency_seconds = latency_seconds
+
+    @staticmethod
+    def answer_for(prompt):
+        digest = hashlib.sha256(prompt.encode()).hexdigest()[:12]
+        return f"Mock answer {digest}. Please rate this response from 1 (bad) to 5 (great)."
+
+    def _complete(self, prompt):
+        time.sleep(self.latency_seconds)
+        return self.answer_for(prompt)
+
+    async def _complete_async(self, prompt):
+        await asyncio.sleep(self.latency_seconds)
+        return self.answer_for(prompt)
+
+    def _stream(self, prompt):
+        time.sleep(self.latency_seconds)
+        for word in self.answer_for(prompt).split(" "):
+            yield word + " "
+
+    async def _stream_async(self, prompt):
+        await asyncio.sleep(self.latency_seconds)
+        for word in self.answer_for(prompt).split(" "):
+            yield word + " "
+
+
+class LLMRouter:
+    """
+        Sends the prompts to the first available backend of `backends` (in priority order), failing over to the next
+        one when a backend errors or its circuit breaker is open.
+
+        With hedging, a completion that takes longer than the p95 latency of its backend (once `hedge_min_samples`
+        latencies are known) is also sent to the next backend, and the first answer wins. Streams fail over only until
+        their first token, they are not hedged.
+    """
+
+    def __init__(self, backends, hedging_enabled=False, hedge_percentile=95, hedge_min_samples=20):
+        if not backends:
+            raise ValueError("At least one LLM backend is needed")
+        self.backends = backends
+        self.hedging_enabled = hedging_enabled
+        self.hedge_percentile = hedge_percentile
+        self.hedge_min_samples = hedge_min_samples
+        # sync calls that may be hedged run here; a losing call cannot be interrupted and finishes in the background
+        self._executor = ThreadPoolExecutor(max_workers=HEDGE_WORKERS, thread_name_prefix="llm")
+
+    def hedge_delay(self, backend):
+        if not self.hedging_enabled or len(backend.stats.latencies) < self.hedge_min_samples:
+            return None
+        return backend.stats.percentile(self.hedge_percentile)
+
+    def _candidates(self):
+        return list(self.backends)
+
+    def complete(self, prompt):
+        candidates = self._candidates()
+        error = None
+        while candidates:
+            backend = candidates.pop(0)
+            if candidates and self.hedge_delay(backend) is not None:
+                return self._complete_hedged(prompt, backend, candidates)
+            try:
+                return backend.complete(prompt)
+            except CircuitOpenError as e:
+                error = e
+            except Exception as e:
+                print(f"ERROR: LLM backend {backend.name} failed: {e}")
+                error = e
+        raise error
+
+    def _complete_hedged(self, prompt, backend, candidates):
+        error = None
+        pending = {self._executor.submit(backend.complete, prompt): backend}
+        while candidates or pending:
+            if candidates and not pending:
+                backend = candidates.pop(0)
+                pending[self._executor.submit(backend.complete, prompt)] = backend
+            delay = self.hedge_delay(pending[next(iter(pending))]) if len(pending) == 1 and candidates else None
+            done, _ = wait_futures(list(pending), timeout=delay, return_when=FIRST_COMPLETED)
+            if not done:
+                # the backend is slower than usual, hedge with the next one
+                backend = candidates.pop(0)
+                backend.stats.record_hedge()
+                pending[self._executor.submit(backend.complete, prompt)] = backend
+                continue
+            for future in done:
+                backend = pending.pop(future)
+                try:
+                    return future.result()
+                except CircuitOpenError as e:
+                    error = e
+                except Exception as e:
+                    print(f"ERROR: LLM backend {backend.name} failed: {e}")
+                    error = e
+        raise error
+
+    async def complete_async(self, prompt):
+        candidates = self._candidates()
+        error = None
+        pending = {}
+        try:
+            while candidates or pending:
+                if candidates and not pending:
+                    backend = candidates.pop(0)
+                    pending[asyncio.ensure_future(backend.complete_async(prompt))] = backend
+                delay = self.hedge_delay(pending[next(iter(pending))]) if len(pending) == 1 and candidates else None
+                done, _ = await asyncio.wait(list(pending), timeout=delay, return_when=asyncio.FIRST_COMPLETED)
+                if not done:
+                    backend = candidates.pop(0)
+                    backend.stats.record_hedge()
+                    pending[asyncio.ensure_future(backend.complete_async(prompt))] = backend
+                    continue
+                for task in done:
+                    backend = pending.pop(task)
+                    try:
+                        return task.result()
+                    except CircuitOpenError as e:
+                        error = e
+                    except Exception as e:
+                        print(f"ERROR: LLM backend {backend.name} failed: {e}")
+                        error = e
+            raise error
+        finally:
+            # the losing hedge, or every call when the caller is cancelled
+            for task in pending:
+                task.cancel()
+
+    def stream(self, prompt):
+        error = None
+        for backend in self._candidates():
+            started = False
+            try:
+                for token in backend.stream(prompt):
+                    started = True
+                    yield token
+                return
+            except Exception as e:
+                if started:
+                    raise
+                if not isinstance(e, CircuitOpenError):
+                    print(f"ERROR: LLM backend {backend.name} failed: {e}")
+                error = e
+        raise error
+
+    async def stream_async(self, prompt):
+        error = None
+        for backend in self._candidates():
+            started = False
+            try:
+                async for token in backend.stream_async(prompt):
+                    started = True
+                    yield token
+                return
+            except Exception as e:
+                if started:
+                    raise
+                if not isinstance(e, CircuitOpenError):
+                    print(f"ERROR: LLM backend {backend.name} failed: {e}")
+                error = e
+        raise error
+
+    def stats(self):
+        return {backend.name: backend.stats.summary() for backend in self.backends}
@@ -0,0 +1,129 @@
+from .config import get_config, add_config_listener
+from .telemetry import MAKE_BOT_PREFETCHES
+from collections import OrderedDict
+from concurrent.futures import CancelledError, ThreadPoolExecutor
+import threading
+import time
+
+PREFETCH_ENABLED = True
+# a form left unfinished for longer is read fresh when it resumes
+PREFETCH_TTL_SECONDS = 300
+PREFETCH_MAX_CONVERSATIONS = 1000
+PREFETCH_WORKERS = 2
+# how long an action waits for a prefetch still running before fetching by itself
+PREFETCH_WAIT_SECONDS = 10.0
+
+def load_config(config):
+    global PREFETCH_ENABLED, PREFETCH_TTL_SECONDS, PREFETCH_MAX_CONVERSATIONS, PREFETCH_WORKERS, PREFETCH_WAIT_SECONDS
+    PREFETCH_ENABLED = config.get_bool('PREFETCH_ENABLED', PREFETCH_ENABLED)
+    PREFETCH_TTL_SECONDS = config.get_float('PREFETCH_TTL_SECONDS', PREFETCH_TTL_SECONDS)
+    PREFETCH_MAX_CONVERSATIONS = config.get_int('PREFETCH_MAX_CONVERSATIONS', PREFETCH_MAX_CONVERSATIONS)
+    PREFETCH_WORKERS = config.get_int('PREFETCH_WORKERS', PREFETCH_WORKERS)
+    PREFETCH_WAIT_SECONDS = config.get_float('PREFETCH_WAIT_SECONDS', PREFETCH_WAIT_SECONDS)
+
+load_config(get_config())
+
+
+class _Prefetch:
+    __slots__ = ("future", "used")
+
+    def __init__(self, future):
+        self.future = future
+        self.used = False
+
+
+class PrefetchStore:
+    """
+        Short-lived results of speculative fetches, per conversation. `start` runs a fetch in the background under a key
+        (a tuple whose first item is the kind reported in `make_bot_prefetches_total`); `get` returns its result, waiting
+        for it when it is still running, or None when nothing was prefetched or the fetch failed, and the caller fetches
+        by itself.
+
+        A conversation's prefetches are dropped by `cancel` (the form was aborted or finished), after `ttl` seconds, or
+        when more than `max_conversations` conversations have some. Fetches not started yet are cancelled then; every
+        prefetch dropped without being used is counted as "unused".
+
+        The fetches run in the store's own `workers` threads, outside the slots of `admission.ADMISSION`: they are
+        bounded by `workers` on top of `ADMISSION_MAX_CONCURRENCY`, and never wait behind the FAQ answers.
+    """
+
+    def __init__(self, ttl=PREFETCH_TTL_SECONDS, max_conversations=PREFETCH_MAX_CONVERSATIONS, workers=PREFETCH_WORKERS, enabled=PREFETCH_ENABLED):
+        self.ttl = ttl
+        self.max_conversations = max_conversations
+        self.enabled = enabled
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="prefetch")
+        self._lock = threading.Lock()
+        # conversation id -> (created, {key: _Prefetch}), oldest first
+        self._conversations = OrderedDict()
+
+    def _drop(self, prefetches):
+        for key, prefetch in prefetches.items():
+            prefetch.future.cancel()
+            if not prefetch.used:
+                MAKE_BOT_PREFETCHES.inc(key[0], "unused")
+
+    def _expired(self, record, now):
+        return now - record[0] > self.ttl
+
+    def _prefetches(self, conversation_id, create=False):
+        now = time.monotonic()
+        while self._conversations:
+            oldest_id, oldest = next(iter(self._conversations.items()))
+            if not self._expired(oldest, now):
+                break
+            del self._conversations[oldest_id]
+            self._drop(oldest[1])
+        record = self._conversations.get(conversation_id)
+        if record is None and create:
+            record = self._conversations[conversation_id] = (now, {})
+            while len(self._conversations) > self.max_conversations:
+                self._drop(self._conversations.popitem(last=False)[1][1])
+        return record[1] if record is not None else None
+
+    def start(self, conversation_id, key, function, *args):
+        if not self.enabled:
+            return
+        with self._lock:
+            prefetches = self._prefetches(conversation_id, create=True)
+            if key not in prefetches:
+                prefetches[key] = _Prefetch(self._executor.submit(function, *args))
+
+    def get(self, conversation_id, key, timeout=None):
+        if not self.enabled:
+            return None
+        with self._lock:
+            prefetches = self._prefetches(conversation_id)
+            prefetch = prefetches.get(key) if prefetches is not None else None
+        if prefetch is None:
+            MAKE_BOT_PREFETCHES.inc(key[0], "miss")
+            return None
+        # "late": the fetch was still running, the action waited for it instead of starting another one
+        result = "hit" if prefetch.future.done() else "late"
+        prefetch.used = True
+        try:
+            value = prefetch.future.result(timeout=PREFETCH_WAIT_SECONDS if timeout is None else timeout)
+        except (Exception, CancelledError) as e:
+            print(f"ERROR: prefetch of {key} failed: {e!r}")
+            MAKE_BOT_PREFETCHES.inc(key[0], "miss")
+            return None
+        MAKE_BOT_PREFETCHES.inc(key[0], result)
+        return value
+
+    def cancel(self, conversation_id):
+        with self._lock:
+            record = self._conversations.pop(conversation_id, None)
+            if record is not None:
+                self._drop(record[1])
+
+
+PREFETCH_STORE = PrefetchStore()
+
+
+def apply_config(config):
+    # the number of workers needs a restart
+    load_config(config)
+    PREFETCH_STORE.enabled = PREFETCH_ENABLED
+    PREFETCH_STORE.ttl = PREFETCH_TTL_SECONDS
+    PREFETCH_STORE.max_conversations = PREFETCH_MAX_CONVERSATIONS
+
+add_config_listener(apply_config)
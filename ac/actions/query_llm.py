@@ -1,16 +1,97 @@
-from groq import Groq
+from .llm_backends import (
+    LLMRouter, GroqBackend, OpenAICompatibleBackend, MockBackend, GROQ_BACKEND, LOCAL_BACKEND, MOCK_BACKEND,
+)
+from .config import get_config, add_config_listener
+from .telemetry import LLM_TIME_TO_FIRST_TOKEN_SECONDS
+import time
 
-client = Groq(api_key="")
+LLM_MODEL = "llama3-8b-8192"
+# backends in priority order, the next one is used when the previous one fails (or hedges it)
+LLM_BACKENDS = [GROQ_BACKEND]
+LOCAL_LLM_URL = "http://localhost:8080/v1"
+LOCAL_LLM_MODEL = "llama3-8b"
+MOCK_LLM_LATENCY_SECONDS = 0.0
+LLM_HEDGING_ENABLED = False
+LLM_HEDGE_PERCENTILE = 95
+LLM_HEDGE_MIN_SAMPLES = 20
 
-def query_llm(query_text):
-    chat_completion = client.chat.completions.create(
-        messages=[
-            {
-                "role": "user",
-                "content": query_text,
-            }
-        ],
-        model="llama3-8b-8192",
+def load_config(config):
+    global LLM_MODEL, LLM_BACKENDS, LOCAL_LLM_URL, LOCAL_LLM_MODEL, MOCK_LLM_LATENCY_SECONDS
+    global LLM_HEDGING_ENABLED, LLM_HEDGE_PERCENTILE, LLM_HEDGE_MIN_SAMPLES
+    LLM_MODEL = config.get_str('LLM_MODEL', LLM_MODEL)
+    LLM_BACKENDS = config.get_list('LLM_BACKENDS', LLM_BACKENDS)
+    LOCAL_LLM_URL = config.get_str('LOCAL_LLM_URL', LOCAL_LLM_URL)
+    LOCAL_LLM_MODEL = config.get_str('LOCAL_LLM_MODEL', LOCAL_LLM_MODEL)
+    MOCK_LLM_LATENCY_SECONDS = config.get_float('MOCK_LLM_LATENCY_SECONDS', MOCK_LLM_LATENCY_SECONDS)
+    LLM_HEDGING_ENABLED = config.get_bool('LLM_HEDGING_ENABLED', LLM_HEDGING_ENABLED)
+    LLM_HEDGE_PERCENTILE = config.get_float('LLM_HEDGE_PERCENTILE', LLM_HEDGE_PERCENTILE)
+    LLM_HEDGE_MIN_SAMPLES = config.get_int('LLM_HEDGE_MIN_SAMPLES', LLM_HEDGE_MIN_SAMPLES)
+
+def create_backend(name):
+    if name == GROQ_BACKEND:
+        return GroqBackend(LLM_MODEL, api_key="")
+    elif name == LOCAL_BACKEND:
+        return OpenAICompatibleBackend(LOCAL_LLM_URL, LOCAL_LLM_MODEL)
+    elif name == MOCK_BACKEND:
+        return MockBackend(MOCK_LLM_LATENCY_SECONDS)
+    else:
+        raise ValueError(f"Invalid LLM backend: {name}")
+
+def create_router():
+    return LLMRouter(
+        [create_backend(name) for name in LLM_BACKENDS],
+        hedging_enabled=LLM_HEDGING_ENABLED,
+        hedge_percentile=LLM_HEDGE_PERCENTILE,
+        hedge_min_samples=LLM_HEDGE_MIN_SAMPLES,
     )
 
-    return (chat_completion.choices[0].message.content)
\ No newline at end of file
+def llm_settings():
+    return (LLM_MODEL, LLM_BACKENDS, LOCAL_LLM_URL, LOCAL_LLM_MODEL, MOCK_LLM_LATENCY_SECONDS,
+            LLM_HEDGING_ENABLED, LLM_HEDGE_PERCENTILE, LLM_HEDGE_MIN_SAMPLES)
+
+def apply_config(config):
+    # a new router (with new backends and fresh stats) only when one of its settings changed
+    global LLM_ROUTER
+    settings = llm_settings()
+    load_config(config)
+    if llm_settings() != settings:
+        LLM_ROUTER = create_router()
+
+load_config(get_config())
+add_config_listener(apply_config)
+
+LLM_ROUTER = create_router()
+
+def record_time_to_first_token(seconds):
+    LLM_TIME_TO_FIRST_TOKEN_SECONDS.observe(seconds)
+
+def query_llm(query_text):
+    return LLM_ROUTER.complete(query_text)
+
+async def query_llm_async(query_text):
+    # cancelling the awaiting task (e.g. on a timeout) also aborts the underlying HTTP requests
+    return await LLM_ROUTER.complete_async(query_text)
+
+def query_llm_stream(query_text):
+    """
+        Yields the completion token by token, as the provider streams it.
+    """
+    start = time.perf_counter()
+    first_token = True
+    for token in LLM_ROUTER.stream(query_text):
+        if first_token:
+            record_time_to_first_token(time.perf_counter() - start)
+            first_token = False
+        yield token
+
+async def query_llm_stream_async(query_text):
+    """
+        Async version of `query_llm_stream`.
+    """
+    start = time.perf_counter()
+    first_token = True
+    async for token in LLM_ROUTER.stream_async(query_text):
+        if first_token:
+            record_time_to_first_token(time.perf_counter() - start)
+            first_token = False
+        yield token
@@ -1,53 +1,454 @@
 import argparse
-from langchain_community.vectorstores import Chroma
-from langchain_community.embeddings import FastEmbedEmbeddings
-from langchain.prompts import ChatPromptTemplate
-from .query_llm import query_llm
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+from .config import get_config, add_config_listener, reload_config, CONFIG_PATH, PROMPT_TEMPLATE_PATH
+from .query_llm import query_llm, query_llm_async, query_llm_stream_async
+from .retrieval_engine import get_engine
+from .index_snapshots import IndexPaths, current_snapshot, current_pointer_path, read_current_version
+from .hot_reload import FileWatcher
+from .semantic_cache import SemanticCache, files_fingerprint
+from .bm25 import reciprocal_rank_fusion
+from .faq_index import DirectAnswerStats
+from .context_assembly import TokenCounter, assemble_context
+from .single_flight import SingleFlight, normalize_question
+from .telemetry import Trace, RAG_TOKENS, RAG_ANSWERS, RAG_CACHE_LOOKUPS
+from .admission import ADMISSION, PRIORITY_FAQ, AdmissionRejected
 import os
-import sys
-__import__('pysqlite3')
-sys.modules['sqlite3'] = sys.modules.pop('pysqlite3')
+import time
 
 PRINT_PROMPT_DEBUG = False
 CONTEXT_K_FACTOR = 2
+SEMANTIC_CACHE_ENABLED = True
+SEMANTIC_CACHE_THRESHOLD = 0.95
+SEMANTIC_CACHE_MAX_ENTRIES = 500
+SEMANTIC_CACHE_TTL_SECONDS = 86400
+SEMANTIC_CACHE_FLUSH_INTERVAL_SECONDS = 30.0
+RAG_THREAD_POOL_SIZE = 4
+EMBEDDING_TIMEOUT_SECONDS = 5.0
+SEARCH_TIMEOUT_SECONDS = 5.0
+LLM_TIMEOUT_SECONDS = 30.0
+LLM_STREAMING_ENABLED = False
+STREAMING_MESSAGE_QUEUE_URL = ""
+STREAMING_BOT_MESSAGE_EVT = "bot_uttered"
+STREAMING_MIN_CHUNK_CHARS = 80
+VECTOR_STORE_BACKEND = "chroma"
+HYBRID_SEARCH_ENABLED = True
+DENSE_CANDIDATES = 10
+LEXICAL_CANDIDATES = 10
+DENSE_WEIGHT = 1.0
+LEXICAL_WEIGHT = 1.0
+RRF_K = 60
+DIRECT_ANSWER_ENABLED = True
+DIRECT_ANSWER_THRESHOLD = 0.9
+CONTEXT_ASSEMBLY_ENABLED = True
+CONTEXT_CANDIDATES = 8
+CONTEXT_TOKEN_BUDGET = 1500
+MMR_LAMBDA = 0.7
+CONTEXT_TOKENIZER = "cl100k_base"
+SINGLE_FLIGHT_ENABLED = True
+HOT_RELOAD_ENABLED = True
+HOT_RELOAD_INTERVAL_SECONDS = 5.0
+# versioned index snapshots published by the db-setup script; the paths below are used until the first one exists
+INDEX_SNAPSHOTS_PATH = os.path.join(os.path.dirname(__file__), 'index_snapshots')
 CHROMA_PATH = os.path.join(os.path.dirname(__file__), 'chroma')
-PROMPT_TEMPLATE_PATH = os.path.join(os.path.dirname(__file__), 'prompt_template.txt')
-CONFIG_PATH = os.path.join(os.path.dirname(__file__), 'conf.txt')
+NUMPY_INDEX_PATH = os.path.join(os.path.dirname(__file__), 'numpy_index')
+BM25_INDEX_PATH = os.path.join(os.path.dirname(__file__), 'bm25_index.pkl')
+FAQ_INDEX_PATH = os.path.join(os.path.dirname(__file__), 'faq_index')
+SEMANTIC_CACHE_PATH = os.path.join(os.path.dirname(__file__), 'semantic_cache.pkl')
 
-def load_prompt_template(file_path):
-    with open(file_path, 'r') as file:
-        return file.read()
-
-def load_config(config_path):
+def load_config(config):
     global PRINT_PROMPT_DEBUG, CONTEXT_K_FACTOR
-    with open(config_path, 'r') as file:
-        for line in file:
-            if line.startswith('PRINT_PROMPT_DEBUG'):
-                PRINT_PROMPT_DEBUG = line.split('=')[1].strip().lower() == 'true'
-            elif line.startswith('CONTEXT_K_FACTOR'):
-                CONTEXT_K_FACTOR = int(line.split('=')[1].strip())
-
-PROMPT_TEMPLATE = load_prompt_template(PROMPT_TEMPLATE_PATH)
+    global SEMANTIC_CACHE_ENABLED, SEMANTIC_CACHE_THRESHOLD, SEMANTIC_CACHE_MAX_ENTRIES, SEMANTIC_CACHE_TTL_SECONDS
+    global SEMANTIC_CACHE_FLUSH_INTERVAL_SECONDS
+    global RAG_THREAD_POOL_SIZE, EMBEDDING_TIMEOUT_SECONDS, SEARCH_TIMEOUT_SECONDS, LLM_TIMEOUT_SECONDS
+    global LLM_STREAMING_ENABLED, STREAMING_MESSAGE_QUEUE_URL, STREAMING_BOT_MESSAGE_EVT, STREAMING_MIN_CHUNK_CHARS
+    global VECTOR_STORE_BACKEND
+    global HYBRID_SEARCH_ENABLED, DENSE_CANDIDATES, LEXICAL_CANDIDATES, DENSE_WEIGHT, LEXICAL_WEIGHT, RRF_K
+    global DIRECT_ANSWER_ENABLED, DIRECT_ANSWER_THRESHOLD
+    global CONTEXT_ASSEMBLY_ENABLED, CONTEXT_CANDIDATES, CONTEXT_TOKEN_BUDGET, MMR_LAMBDA, CONTEXT_TOKENIZER
+    global SINGLE_FLIGHT_ENABLED, HOT_RELOAD_ENABLED, HOT_RELOAD_INTERVAL_SECONDS
+    PRINT_PROMPT_DEBUG = config.get_bool('PRINT_PROMPT_DEBUG', PRINT_PROMPT_DEBUG)
+    CONTEXT_K_FACTOR = config.get_int('CONTEXT_K_FACTOR', CONTEXT_K_FACTOR)
+    SEMANTIC_CACHE_ENABLED = config.get_bool('SEMANTIC_CACHE_ENABLED', SEMANTIC_CACHE_ENABLED)
+    SEMANTIC_CACHE_THRESHOLD = config.get_float('SEMANTIC_CACHE_THRESHOLD', SEMANTIC_CACHE_THRESHOLD)
+    SEMANTIC_CACHE_MAX_ENTRIES = config.get_int('SEMANTIC_CACHE_MAX_ENTRIES', SEMANTIC_CACHE_MAX_ENTRIES)
+    SEMANTIC_CACHE_TTL_SECONDS = config.get_int('SEMANTIC_CACHE_TTL_SECONDS', SEMANTIC_CACHE_TTL_SECONDS)
+    SEMANTIC_CACHE_FLUSH_INTERVAL_SECONDS = config.get_float('SEMANTIC_CACHE_FLUSH_INTERVAL_SECONDS', SEMANTIC_CACHE_FLUSH_INTERVAL_SECONDS)
+    RAG_THREAD_POOL_SIZE = config.get_int('RAG_THREAD_POOL_SIZE', RAG_THREAD_POOL_SIZE)
+    EMBEDDING_TIMEOUT_SECONDS = config.get_float('EMBEDDING_TIMEOUT_SECONDS', EMBEDDING_TIMEOUT_SECONDS)
+    SEARCH_TIMEOUT_SECONDS = config.get_float('SEARCH_TIMEOUT_SECONDS', SEARCH_TIMEOUT_SECONDS)
+    LLM_TIMEOUT_SECONDS = config.get_float('LLM_TIMEOUT_SECONDS', LLM_TIMEOUT_SECONDS)
+    LLM_STREAMING_ENABLED = config.get_bool('LLM_STREAMING_ENABLED', LLM_STREAMING_ENABLED)
+    STREAMING_MESSAGE_QUEUE_URL = config.get_str('STREAMING_MESSAGE_QUEUE_URL', STREAMING_MESSAGE_QUEUE_URL)
+    STREAMING_BOT_MESSAGE_EVT = config.get_str('STREAMING_BOT_MESSAGE_EVT', STREAMING_BOT_MESSAGE_EVT)
+    STREAMING_MIN_CHUNK_CHARS = config.get_int('STREAMING_MIN_CHUNK_CHARS', STREAMING_MIN_CHUNK_CHARS)
+    VECTOR_STORE_BACKEND = config.get_str('VECTOR_STORE_BACKEND', VECTOR_STORE_BACKEND).lower()
+    HYBRID_SEARCH_ENABLED = config.get_bool('HYBRID_SEARCH_ENABLED', HYBRID_SEARCH_ENABLED)
+    DENSE_CANDIDATES = config.get_int('DENSE_CANDIDATES', DENSE_CANDIDATES)
+    LEXICAL_CANDIDATES = config.get_int('LEXICAL_CANDIDATES', LEXICAL_CANDIDATES)
+    DENSE_WEIGHT = config.get_float('DENSE_WEIGHT', DENSE_WEIGHT)
+    LEXICAL_WEIGHT = config.get_float('LEXICAL_WEIGHT', LEXICAL_WEIGHT)
+    RRF_K = config.get_int('RRF_K', RRF_K)
+    DIRECT_ANSWER_ENABLED = config.get_bool('DIRECT_ANSWER_ENABLED', DIRECT_ANSWER_ENABLED)
+    DIRECT_ANSWER_THRESHOLD = config.get_float('DIRECT_ANSWER_THRESHOLD', DIRECT_ANSWER_THRESHOLD)
+    CONTEXT_ASSEMBLY_ENABLED = config.get_bool('CONTEXT_ASSEMBLY_ENABLED', CONTEXT_ASSEMBLY_ENABLED)
+    CONTEXT_CANDIDATES = config.get_int('CONTEXT_CANDIDATES', CONTEXT_CANDIDATES)
+    CONTEXT_TOKEN_BUDGET = config.get_int('CONTEXT_TOKEN_BUDGET', CONTEXT_TOKEN_BUDGET)
+    MMR_LAMBDA = config.get_float('MMR_LAMBDA', MMR_LAMBDA)
+    CONTEXT_TOKENIZER = config.get_str('CONTEXT_TOKENIZER', CONTEXT_TOKENIZER)
+    SINGLE_FLIGHT_ENABLED = config.get_bool('SINGLE_FLIGHT_ENABLED', SINGLE_FLIGHT_ENABLED)
+    HOT_RELOAD_ENABLED = config.get_bool('HOT_RELOAD_ENABLED', HOT_RELOAD_ENABLED)
+    HOT_RELOAD_INTERVAL_SECONDS = config.get_float('HOT_RELOAD_INTERVAL_SECONDS', HOT_RELOAD_INTERVAL_SECONDS)
+
 CHUNK_SEPARATOR_WITHIN_CONTEXT = "\n---\n"
-load_config(CONFIG_PATH)
+# same request the prompt template makes the LLM append to its answers
+RATING_REQUEST_SUFFIX = "\n\nPlease rate this response from 1 (bad) to 5 (great)."
+CONFIG = get_config()
+load_config(CONFIG)
+PROMPT_TEMPLATE = CONFIG.prompt_template
+PROMPT_TEMPLATE_VERSION = CONFIG.prompt_template_version
+
+SEMANTIC_CACHE = SemanticCache(
+    SEMANTIC_CACHE_PATH,
+    watched_paths=[current_pointer_path(INDEX_SNAPSHOTS_PATH), CHROMA_PATH, NUMPY_INDEX_PATH, BM25_INDEX_PATH, FAQ_INDEX_PATH, PROMPT_TEMPLATE_PATH],
+    threshold=SEMANTIC_CACHE_THRESHOLD,
+    max_entries=SEMANTIC_CACHE_MAX_ENTRIES,
+    ttl_seconds=SEMANTIC_CACHE_TTL_SECONDS,
+)
+
+DIRECT_ANSWER_STATS = DirectAnswerStats()
+# identical questions asked while the first one is still being answered share its answer
+RAG_SINGLE_FLIGHT = SingleFlight("RAG")
+# budgets the context and counts the prompt and completion tokens of every LLM call
+TOKEN_COUNTER = TokenCounter(CONTEXT_TOKENIZER)
+
+# embedding and chroma search are CPU bound and blocking, async callers run them here instead of on the event loop
+RAG_EXECUTOR = ThreadPoolExecutor(max_workers=RAG_THREAD_POOL_SIZE, thread_name_prefix="rag")
+
+
+def current_index_paths():
+    return current_snapshot(INDEX_SNAPSHOTS_PATH) or IndexPaths(None, CHROMA_PATH, NUMPY_INDEX_PATH, BM25_INDEX_PATH, FAQ_INDEX_PATH)
+
+
+def get_retrieval_engine():
+    return get_engine(VECTOR_STORE_BACKEND, current_index_paths)
+
+
+def warm_up_retrieval_engine():
+    try:
+        get_retrieval_engine().warm_up()
+        get_chat_prompt_template()
+        SEMANTIC_CACHE.start(SEMANTIC_CACHE_FLUSH_INTERVAL_SECONDS)
+    except Exception as e:
+        # not fatal, the engine is loaded again on the first question
+        print(f"ERROR: retrieval engine warm-up failed: {e}")
+
+
+def apply_config(config):
+    """
+        Hot reload of conf.txt and prompt_template.txt: settings read per question apply from the next one, the prompt
+        template, the tokenizer, the semantic cache limits and the vector store backend are replaced when they changed.
+        `RAG_THREAD_POOL_SIZE` and `SEMANTIC_CACHE_FLUSH_INTERVAL_SECONDS` still need a restart.
+    """
+    global CONFIG, PROMPT_TEMPLATE, PROMPT_TEMPLATE_VERSION, _chat_prompt_template, TOKEN_COUNTER
+    tokenizer, backend = CONTEXT_TOKENIZER, VECTOR_STORE_BACKEND
+    load_config(config)
+    CONFIG = config
+    if config.prompt_template_version != PROMPT_TEMPLATE_VERSION:
+        PROMPT_TEMPLATE, PROMPT_TEMPLATE_VERSION = config.prompt_template, config.prompt_template_version
+        _chat_prompt_template = None
+        SEMANTIC_CACHE.check_version()
+    if CONTEXT_TOKENIZER != tokenizer:
+        TOKEN_COUNTER = TokenCounter(CONTEXT_TOKENIZER)
+    SEMANTIC_CACHE.threshold = SEMANTIC_CACHE_THRESHOLD
+    SEMANTIC_CACHE.max_entries = SEMANTIC_CACHE_MAX_ENTRIES
+    SEMANTIC_CACHE.ttl_seconds = SEMANTIC_CACHE_TTL_SECONDS
+    if VECTOR_STORE_BACKEND != backend:
+        get_retrieval_engine().reload(backend=VECTOR_STORE_BACKEND)
+    print(f"Applied the new config (prompt template {PROMPT_TEMPLATE_VERSION})")
+
+
+add_config_listener(apply_config)
+
+
+def switch_index_snapshot():
+    paths = current_index_paths()
+    engine = get_retrieval_engine()
+    if paths != engine.paths:
+        engine.reload(paths)
+        # answers of the previous snapshot are not served from here on
+        SEMANTIC_CACHE.check_version()
+        print(f"Switched to index snapshot {paths.version}")
+
+
+_hot_reload_watcher = None
+
+
+def start_hot_reload():
+    """
+        Watches the `CURRENT` pointer of the index snapshots and the config files every `HOT_RELOAD_INTERVAL_SECONDS`. A
+        newly published snapshot is loaded and warmed up in the watcher thread and swapped in between two searches; the
+        previous one is released once the questions still using it are answered.
+    """
+    global _hot_reload_watcher
+    if not HOT_RELOAD_ENABLED or _hot_reload_watcher is not None:
+        return
+    _hot_reload_watcher = FileWatcher("index and config", HOT_RELOAD_INTERVAL_SECONDS)
+    _hot_reload_watcher.watch(lambda: read_current_version(INDEX_SNAPSHOTS_PATH), switch_index_snapshot)
+    _hot_reload_watcher.watch(lambda: files_fingerprint([CONFIG_PATH, PROMPT_TEMPLATE_PATH]), reload_config)
+    _hot_reload_watcher.start()
+
+
+def direct_answer(engine, query_embedding):
+    """
+        Stored answer of the closest FAQ question when it clears `DIRECT_ANSWER_THRESHOLD`. The prompt tells the LLM to
+        answer exactly as in the context, so for such a close match the LLM call would only copy it.
+    """
+    if not DIRECT_ANSWER_ENABLED:
+        return None
+    match = engine.faq_match(query_embedding)
+    if match is None or match[1] < DIRECT_ANSWER_THRESHOLD:
+        return None
+    DIRECT_ANSWER_STATS.record_hit()
+    return match[0].page_content + RATING_REQUEST_SUFFIX
+
+
+def retrieve(engine, query_text, query_embedding):
+    """
+        Chunks for the question: the top `CONTEXT_K_FACTOR`, or `CONTEXT_CANDIDATES` candidates for the context assembly.
+        With hybrid search, a larger pool of dense and BM25 candidates is fused by reciprocal rank, so chunks sharing
+        exact terms with the question (tickers, instrument names) make it into a small k.
+    """
+    return retrieve_batch(engine, [query_text], [query_embedding])[0]
+
+
+def retrieve_batch(engine, query_texts, query_embeddings):
+    """
+        `retrieve` for several questions at once, with one bulk dense search for all of them (used by the batch mode
+        of other-scripts/query.py).
+    """
+    k = max(CONTEXT_CANDIDATES, CONTEXT_K_FACTOR) if CONTEXT_ASSEMBLY_ENABLED else CONTEXT_K_FACTOR
+    if not HYBRID_SEARCH_ENABLED:
+        return engine.search_by_vectors(query_embeddings, k=k)
+
+    dense_results = engine.search_by_vectors(query_embeddings, k=max(DENSE_CANDIDATES, k))
+    fused = []
+    for query_text, query_dense_results in zip(query_texts, dense_results):
+        lexical_results = engine.lexical_search(query_text, k=LEXICAL_CANDIDATES)
+        fused.append(reciprocal_rank_fusion([query_dense_results, lexical_results], [DENSE_WEIGHT, LEXICAL_WEIGHT], rrf_k=RRF_K)[:k])
+    return fused
+
+
+def build_context(results, trace=None):
+    """
+        Without context assembly, the top `CONTEXT_K_FACTOR` chunks joined verbatim. With it, overlapping chunks of the
+        same source are merged and the candidates are packed in MMR order into `CONTEXT_TOKEN_BUDGET` tokens; the token
+        counts go to `trace`.
+    """
+    fixed_k_results = results[:CONTEXT_K_FACTOR]
+    if not CONTEXT_ASSEMBLY_ENABLED:
+        return CHUNK_SEPARATOR_WITHIN_CONTEXT.join([doc.page_content for doc, _score in fixed_k_results])
+
+    context_text, context_tokens = assemble_context(
+        results, TOKEN_COUNTER, CONTEXT_TOKEN_BUDGET, MMR_LAMBDA, CHUNK_SEPARATOR_WITHIN_CONTEXT)
+    if trace is not None:
+        trace.set(context_tokens=context_tokens)
+        if trace.sampled:
+            # what the top CONTEXT_K_FACTOR chunks would have cost, only counted for the traces that are logged
+            fixed_k_context = CHUNK_SEPARATOR_WITHIN_CONTEXT.join([doc.page_content for doc, _score in fixed_k_results])
+            trace.set(fixed_k_context_tokens=TOKEN_COUNTER.count(fixed_k_context))
+    return context_text
+
+
+_chat_prompt_template = None
+
+
+def get_chat_prompt_template():
+    # langchain is only imported, and the template only parsed, when the first prompt is built
+    global _chat_prompt_template
+    if _chat_prompt_template is None:
+        from langchain.prompts import ChatPromptTemplate
+        _chat_prompt_template = ChatPromptTemplate.from_template(PROMPT_TEMPLATE)
+    return _chat_prompt_template
+
+
+def build_prompt(query_text, results, trace=None):
+    context_text = build_context(results, trace)
+    return get_chat_prompt_template().format(context=context_text, question=query_text)
+
+
+def finalize_answer(query_text, query_embedding, prompt, answer):
+    if SEMANTIC_CACHE_ENABLED:
+        SEMANTIC_CACHE.store(query_text, query_embedding, answer)
+    return answer
+
+
+def lookup_cached_answer(trace, query_embedding):
+    if not SEMANTIC_CACHE_ENABLED:
+        return None
+    with trace.span("cache_lookup"):
+        cached_answer = SEMANTIC_CACHE.lookup(query_embedding)
+    return record_cache_lookup(trace, cached_answer)
+
+
+def record_cache_lookup(trace, cached_answer):
+    result = "miss" if cached_answer is None else "hit"
+    RAG_CACHE_LOOKUPS.inc(result)
+    trace.set(cache=result)
+    if cached_answer is not None:
+        RAG_ANSWERS.inc("cache")
+    return cached_answer
+
+
+def record_retrieval(trace, results):
+    trace.set(chunks=[{"id": doc.metadata.get("id"), "score": round(float(score), 4)} for doc, score in results])
+
+
+def record_llm_call(trace, prompt, answer):
+    prompt_tokens, completion_tokens = TOKEN_COUNTER.count(prompt), TOKEN_COUNTER.count(answer)
+    RAG_TOKENS.observe(prompt_tokens, "prompt")
+    RAG_TOKENS.observe(completion_tokens, "completion")
+    RAG_ANSWERS.inc("llm")
+    trace.set(prompt_tokens=prompt_tokens, completion_tokens=completion_tokens)
+    if trace.debug:
+        # PRINT_PROMPT_DEBUG: the full prompt goes to the trace log, never to the user
+        trace.set(prompt=prompt, answer=answer)
+
+
+def request_key(query_text):
+    return normalize_question(query_text), get_retrieval_engine().generation, PROMPT_TEMPLATE_VERSION
 
 
 def query_rag(query_text):
-    embedding_function = FastEmbedEmbeddings()
-    db = Chroma(persist_directory=CHROMA_PATH, embedding_function=embedding_function)
+    if not SINGLE_FLIGHT_ENABLED:
+        return compute_rag_answer(query_text)
+    return RAG_SINGLE_FLIGHT.do(request_key(query_text), compute_rag_answer, query_text)
+
+
+def compute_rag_answer(query_text):
+    trace = Trace("rag_answer", debug=PRINT_PROMPT_DEBUG)
+    try:
+        answer = answer_question(trace, query_text)
+    except BaseException as e:
+        trace.finish(e)
+        raise
+    trace.finish()
+    return answer
+
+
+def answer_question(trace, query_text):
+    engine = get_retrieval_engine()
+    with trace.span("embedding"):
+        query_embedding = engine.embed_query(query_text)
+
+    cached_answer = lookup_cached_answer(trace, query_embedding)
+    if cached_answer is not None:
+        return cached_answer
+
+    with trace.span("direct_answer"):
+        answer = direct_answer(engine, query_embedding)
+    if answer is not None:
+        RAG_ANSWERS.inc("direct")
+        return answer
+
+    with trace.span("retrieval"):
+        results = retrieve(engine, query_text, query_embedding)
+    record_retrieval(trace, results)
+    with trace.span("prompt"):
+        prompt = build_prompt(query_text, results, trace)
+
+    start = time.perf_counter()
+    with trace.span("llm"):
+        answer = query_llm(prompt)
+    DIRECT_ANSWER_STATS.record_llm_call(time.perf_counter() - start)
+    record_llm_call(trace, prompt, answer)
+
+    with trace.span("cache_store"):
+        return finalize_answer(query_text, query_embedding, prompt, answer)
+
+
+async def run_in_rag_executor(timeout, function, *args):
+    loop = asyncio.get_running_loop()
+    return await asyncio.wait_for(loop.run_in_executor(RAG_EXECUTOR, function, *args), timeout=timeout)
+
+
+async def stream_llm_answer(prompt, on_token):
+    tokens = []
+    async for token in query_llm_stream_async(prompt):
+        tokens.append(token)
+        await on_token(token)
+    return "".join(tokens)
+
+
+async def query_rag_async(query_text, on_token=None):
+    """
+        Same as `query_rag`, without blocking the event loop. Every stage has its own time budget and raises
+        `asyncio.TimeoutError` when it is exceeded; an LLM call over budget is cancelled.
+
+        When `on_token` is given, the completion is streamed and every token is awaited through it as it arrives.
+        Answers served from the semantic cache or as direct FAQ answers, and answers shared with an identical question
+        already in flight, are returned whole, without going through `on_token`.
+
+        Questions going to retrieval and the LLM wait for a slot of `admission.ADMISSION` behind the make-bot form, and
+        raise `AdmissionRejected` when the queue is full or the wait is too long. Cache hits and direct answers are
+        served without a slot.
+    """
+    if not SINGLE_FLIGHT_ENABLED:
+        return await compute_rag_answer_async(query_text, on_token)
+    return await RAG_SINGLE_FLIGHT.do_async(request_key(query_text), compute_rag_answer_async, query_text, on_token)
 
 
-    results = db.similarity_search_with_relevance_scores(query_text, k=CONTEXT_K_FACTOR)
+async def compute_rag_answer_async(query_text, on_token=None):
+    trace = Trace("rag_answer", debug=PRINT_PROMPT_DEBUG)
+    try:
+        answer = await answer_question_async(trace, query_text, on_token)
+    except AdmissionRejected as e:
+        # shed under load, already counted in admission_rejections_total
+        trace.set(shed=e.reason)
+        trace.finish()
+        raise
+    except BaseException as e:
+        trace.finish(e)
+        raise
+    trace.finish()
+    return answer
 
 
+async def answer_question_async(trace, query_text, on_token):
+    engine = get_retrieval_engine()
+    with trace.span("embedding"):
+        query_embedding = await run_in_rag_executor(EMBEDDING_TIMEOUT_SECONDS, engine.embed_query, query_text)
 
-    context_text = CHUNK_SEPARATOR_WITHIN_CONTEXT.join([doc.page_content for doc, _score in results])
-    prompt_template = ChatPromptTemplate.from_template(PROMPT_TEMPLATE)
-    prompt = prompt_template.format(context=context_text, question=query_text)
+    if SEMANTIC_CACHE_ENABLED:
+        # the similarity scan waits for the cache lock, off the event loop like the search
+        with trace.span("cache_lookup"):
+            cached_answer = await run_in_rag_executor(SEARCH_TIMEOUT_SECONDS, SEMANTIC_CACHE.lookup, query_embedding)
+        if record_cache_lookup(trace, cached_answer) is not None:
+            return cached_answer
 
+    with trace.span("direct_answer"):
+        answer = await run_in_rag_executor(SEARCH_TIMEOUT_SECONDS, direct_answer, engine, query_embedding)
+    if answer is not None:
+        RAG_ANSWERS.inc("direct")
+        return answer
 
+    # one slot per question going to retrieval and the LLM, questions coalesced with it do not queue; raises
+    # AdmissionRejected when shed
+    async with ADMISSION.slot(PRIORITY_FAQ):
+        with trace.span("retrieval"):
+            results = await run_in_rag_executor(SEARCH_TIMEOUT_SECONDS, retrieve, engine, query_text, query_embedding)
+        record_retrieval(trace, results)
+        # context assembly and the token counts tokenize the whole prompt, off the event loop too
+        with trace.span("prompt"):
+            prompt = await run_in_rag_executor(None, build_prompt, query_text, results, trace)
+        start = time.perf_counter()
+        with trace.span("llm"):
+            if on_token is None:
+                answer = await asyncio.wait_for(query_llm_async(prompt), timeout=LLM_TIMEOUT_SECONDS)
+            else:
+                answer = await asyncio.wait_for(stream_llm_answer(prompt, on_token), timeout=LLM_TIMEOUT_SECONDS)
+        DIRECT_ANSWER_STATS.record_llm_call(time.perf_counter() - start)
+        await run_in_rag_executor(None, record_llm_call, trace, prompt, answer)
 
-    if PRINT_PROMPT_DEBUG:
-        return "\n --- \nPROMPT START: \n --- \n" +  prompt + "\n --- \nEND OF PROMPT \n --- \n" + query_llm(prompt)
-    else:
-        return query_llm(prompt)
+    with trace.span("cache_store"):
+        return await run_in_rag_executor(None, finalize_answer, query_text, query_embedding, prompt, answer)
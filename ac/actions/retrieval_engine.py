@@ -0,0 +1,170 @@
+from .vector_store import open_vector_store, NumpyVectorStore
+from .bm25 import BM25Index
+from collections import namedtuple
+from contextlib import contextmanager
+import os
+import threading
+
+WARM_UP_QUERY = "warm up"
+
+RetrievalHandles = namedtuple("RetrievalHandles", ["paths", "embeddings", "store", "lexical_index", "faq_index"])
+
+
+def embed_query_batch(embeddings, query_texts):
+    """
+        Query embeddings of `query_texts` in one call of the FastEmbed model, the same vectors `embed_query` returns one
+        text at a time (`embed_documents` takes the passage path, which differs for asymmetric models).
+    """
+    model = getattr(embeddings, "_model", None)
+    if model is None or not hasattr(model, "query_embed"):
+        return [embeddings.embed_query(query_text) for query_text in query_texts]
+    return [vector.tolist() for vector in model.query_embed(list(query_texts))]
+
+
+class RetrievalEngine:
+    """
+        Process-wide holder of the embedding model, the vector store (chroma or the numpy index), the BM25 index and the
+        FAQ question index of one index snapshot (`paths`, an `IndexPaths`).
+
+        Everything is loaded once and shared by every request. Searches only hold the lock long enough to lease the
+        current handles, so concurrent requests do not serialize on each other, while `reload()` and `close()` swap the
+        handles atomically. Handles that were swapped out are released once the last search leasing them returns.
+    """
+
+    def __init__(self, backend, paths):
+        self.backend = backend
+        self.paths = paths
+        self._lock = threading.RLock()
+        self._current = None
+        # searches in flight per handles, by id; swapped out handles are released when theirs drops to zero
+        self._leases = {}
+        # bumped whenever the handles are swapped, answers computed before and after a reload differ
+        self.generation = 0
+
+    def _open(self, backend, paths, embeddings=None):
+        if embeddings is None:
+            # onnxruntime and the model are only loaded here, on the first search or the warm-up, not on import
+            from langchain_community.embeddings import FastEmbedEmbeddings
+            embeddings = FastEmbedEmbeddings()
+        store = open_vector_store(backend, paths.chroma_path, paths.numpy_index_path, embeddings)
+        lexical_index = None
+        if os.path.exists(paths.bm25_index_path):
+            lexical_index = BM25Index.load(paths.bm25_index_path)
+        else:
+            print(f"ERROR: no BM25 index in {paths.bm25_index_path}, lexical search is disabled")
+        faq_index = None
+        if os.path.exists(paths.faq_index_path):
+            faq_index = NumpyVectorStore(paths.faq_index_path)
+        else:
+            print(f"ERROR: no FAQ index in {paths.faq_index_path}, direct answers are disabled")
+        return RetrievalHandles(paths, embeddings, store, lexical_index, faq_index)
+
+    @contextmanager
+    def _lease(self):
+        with self._lock:
+            if self._current is None:
+                self._current = self._open(self.backend, self.paths)
+            handles = self._current
+            self._leases[id(handles)] = self._leases.get(id(handles), 0) + 1
+        try:
+            yield handles
+        finally:
+            with self._lock:
+                remaining = self._leases.pop(id(handles)) - 1
+                if remaining:
+                    self._leases[id(handles)] = remaining
+                drained = remaining == 0 and handles is not self._current
+            if drained:
+                self._release(handles)
+
+    def _release(self, handles):
+        for index in (handles.store, handles.faq_index):
+            if hasattr(index, "close"):
+                index.close()
+        print(f"Released index snapshot {handles.paths.version or handles.paths.chroma_path}")
+
+    def warm_up(self):
+        # a dummy embed and search, so the first user does not pay for the ONNX session and the index pages
+        self.search(WARM_UP_QUERY, k=1)
+
+    def embed_query(self, query_text):
+        with self._lease() as handles:
+            return handles.embeddings.embed_query(query_text)
+
+    def embed_queries(self, query_texts):
+        with self._lease() as handles:
+            return embed_query_batch(handles.embeddings, query_texts)
+
+    def search_by_vector(self, embedding, k):
+        with self._lease() as handles:
+            return handles.store.search_by_vector(embedding, k)
+
+    def search_by_vectors(self, embeddings, k):
+        with self._lease() as handles:
+            return handles.store.search_by_vectors(embeddings, k)
+
+    def lexical_search(self, query_text, k):
+        with self._lease() as handles:
+            if handles.lexical_index is None:
+                return []
+            return handles.lexical_index.search(query_text, k)
+
+    def faq_match(self, embedding):
+        """
+            Closest FAQ question as (document, cosine similarity), the stored answer being the document; None without
+            an FAQ index.
+        """
+        with self._lease() as handles:
+            if handles.faq_index is None:
+                return None
+            results = handles.faq_index.search_by_vector(embedding, 1)
+            return results[0] if results else None
+
+    def search(self, query_text, k):
+        return self.search_by_vector(self.embed_query(query_text), k)
+
+    def reload(self, paths=None, backend=None):
+        """
+            Opens the indexes of `paths` (by default the current ones again, e.g. with another `backend`) and swaps them
+            in. They are opened and warmed up outside the lock, reusing the loaded embedding model, so requests keep
+            being served from the old handles meanwhile; those are released once the searches using them are done.
+        """
+        with self._lock:
+            current = self._current
+            paths = paths or self.paths
+            backend = backend or self.backend
+        handles = self._open(backend, paths, current.embeddings if current is not None else None)
+        handles.store.search_by_vector(handles.embeddings.embed_query(WARM_UP_QUERY), 1)
+        with self._lock:
+            old = self._current
+            self._current = handles
+            self.paths = paths
+            self.backend = backend
+            self.generation += 1
+            drained = old is not None and id(old) not in self._leases
+        if drained:
+            self._release(old)
+
+    def close(self):
+        with self._lock:
+            old = self._current
+            self._current = None
+            self.generation += 1
+            drained = old is not None and id(old) not in self._leases
+        if drained:
+            self._release(old)
+
+
+_engine = None
+_engine_lock = threading.Lock()
+
+
+def get_engine(backend, paths_factory):
+    """
+        The process-wide engine, created with the `IndexPaths` returned by `paths_factory` (only called then).
+    """
+    global _engine
+    with _engine_lock:
+        if _engine is None:
+            _engine = RetrievalEngine(backend, paths_factory())
+        return _engine
@@ -0,0 +1,166 @@
+from collections import OrderedDict
+import atexit
+import hashlib
+import os
+import pickle
+import threading
+import time
+
+import numpy as np
+
+
+def files_fingerprint(paths):
+    """
+        Cheap fingerprint of files and directory trees (path, size and modification time of every file). Changes whenever
+        the chroma index is rebuilt or the prompt template is edited.
+    """
+    digest = hashlib.sha256()
+    for path in paths:
+        if os.path.isdir(path):
+            for root, dirs, files in os.walk(path):
+                dirs.sort()
+                for file_name in sorted(files):
+                    file_path = os.path.join(root, file_name)
+                    stat = os.stat(file_path)
+                    digest.update(f"{os.path.relpath(file_path, path)}:{stat.st_size}:{stat.st_mtime_ns};".encode())
+        elif os.path.exists(path):
+            stat = os.stat(path)
+            digest.update(f"{path}:{stat.st_size}:{stat.st_mtime_ns};".encode())
+        else:
+            digest.update(f"{path}:missing;".encode())
+    return digest.hexdigest()
+
+
+class SemanticCache:
+    """
+        Answers of previously asked questions, looked up by cosine similarity of the question embeddings.
+
+        Entries are evicted least-recently-used first once `max_entries` is reached, and expire after `ttl_seconds`.
+        The cache is persisted to `path` so it survives restarts, and it is dropped as a whole whenever the fingerprint
+        of `watched_paths` (the chroma index and the prompt template) changes. Neither is done on a question: `start`
+        runs a daemon thread that checks the fingerprint and writes the changed entries every `interval_seconds`, and
+        the entries are written once more at exit.
+    """
+
+    def __init__(self, path, watched_paths, threshold=0.95, max_entries=500, ttl_seconds=86400):
+        self.path = path
+        self.watched_paths = watched_paths
+        self.threshold = threshold
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+        self._next_key = 0
+        self._dirty = False
+        self._version = files_fingerprint(self.watched_paths)
+        self._stop = threading.Event()
+        self._thread = None
+        self._load()
+        atexit.register(self.flush)
+
+    def _load(self):
+        if not os.path.exists(self.path):
+            return
+        try:
+            with open(self.path, 'rb') as file:
+                stored = pickle.load(file)
+        except Exception as e:
+            print(f"ERROR: could not load the semantic cache: {e}")
+            return
+        if stored.get('version') != self._version:
+            # the index or the prompt changed while the server was down
+            return
+        self._entries = OrderedDict(stored['entries'])
+        self._next_key = max(self._entries, default=-1) + 1
+
+    def _save(self, version, entries):
+        tmp_path = self.path + '.tmp'
+        with open(tmp_path, 'wb') as file:
+            pickle.dump({'version': version, 'entries': entries}, file)
+        os.replace(tmp_path, self.path)
+
+    def check_version(self):
+        """
+            Drops every entry when the fingerprint of `watched_paths` changed. Walks the index directories, so it is
+            called from the maintenance thread and the hot reload, never on a question.
+        """
+        version = files_fingerprint(self.watched_paths)
+        with self._lock:
+            if version != self._version:
+                self._version = version
+                self._entries.clear()
+                self._dirty = True
+
+    def flush(self):
+        with self._lock:
+            if not self._dirty:
+                return
+            version, entries = self._version, list(self._entries.items())
+            self._dirty = False
+        try:
+            self._save(version, entries)
+        except Exception as e:
+            print(f"ERROR: could not persist the semantic cache: {e}")
+            with self._lock:
+                self._dirty = True
+
+    def _run(self, interval_seconds):
+        while not self._stop.wait(interval_seconds):
+            try:
+                self.check_version()
+            except Exception as e:
+                print(f"ERROR: semantic cache version check failed: {e}")
+            self.flush()
+
+    def start(self, interval_seconds):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, args=(interval_seconds,), name="semantic-cache", daemon=True)
+            self._thread.start()
+
+    def _evict_expired(self, now):
+        expired = [key for key, entry in self._entries.items() if now - entry['created'] > self.ttl_seconds]
+        for key in expired:
+            del self._entries[key]
+
+    @staticmethod
+    def _normalize(embedding):
+        vector = np.asarray(embedding, dtype=np.float32)
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm else vector
+
+    def lookup(self, embedding):
+        """
+            Returns the stored answer of the most similar question if it clears the threshold, otherwise None.
+        """
+        vector = self._normalize(embedding)
+        with self._lock:
+            self._evict_expired(time.time())
+            if not self._entries:
+                return None
+            keys = list(self._entries)
+            similarities = np.stack([self._entries[key]['embedding'] for key in keys]) @ vector
+            best = int(np.argmax(similarities))
+            if similarities[best] < self.threshold:
+                return None
+            self._entries.move_to_end(keys[best])
+            return self._entries[keys[best]]['answer']
+
+    def store(self, question, embedding, answer):
+        with self._lock:
+            self._entries[self._next_key] = {
+                'question': question,
+                'embedding': self._normalize(embedding),
+                'answer': answer,
+                'created': time.time(),
+            }
+            self._next_key += 1
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+            self._dirty = True
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._dirty = False
+            if os.path.exists(self.path):
+                os.remove(self.path)
@@ -0,0 +1,85 @@
+from .telemetry import SINGLE_FLIGHT_CALLS
+import asyncio
+import re
+import threading
+
+WHITESPACE_PATTERN = re.compile(r"\s+")
+
+
+def normalize_question(text):
+    # "  What is a Bot? " and "what is a bot?" are the same question
+    return WHITESPACE_PATTERN.sub(" ", text).strip().lower()
+
+
+class SingleFlight:
+    """
+        Registry of the computations in flight: a caller asking for a key that is already being computed waits for that
+        computation and gets its result, or its exception, instead of starting its own. The entry is dropped as soon as
+        the computation finishes, so nothing is cached afterwards.
+
+        `do` is for threads, `do_async` for coroutines on one event loop; the two do not share their registries.
+    """
+
+    class _Call:
+        def __init__(self):
+            self.event = threading.Event()
+            self.value = None
+            self.error = None
+
+    def __init__(self, name):
+        self.name = name
+        self._lock = threading.Lock()
+        self._calls = {}
+        self._tasks = {}
+        self.executed = 0
+        self.coalesced = 0
+
+    def _record(self, coalesced):
+        with self._lock:
+            if coalesced:
+                self.coalesced += 1
+            else:
+                self.executed += 1
+        SINGLE_FLIGHT_CALLS.inc(self.name, "coalesced" if coalesced else "executed")
+
+    def do(self, key, function, *args):
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = self._Call()
+        self._record(not leader)
+
+        if not leader:
+            call.event.wait()
+            if call.error is not None:
+                raise call.error
+            return call.value
+
+        try:
+            call.value = function(*args)
+            return call.value
+        except Exception as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.event.set()
+
+    async def do_async(self, key, coroutine_function, *args):
+        task = self._tasks.get(key)
+        leader = task is None
+        if leader:
+            # a task of its own, so a caller that gives up (e.g. cancelled on a timeout) does not cancel it for the others
+            task = self._tasks[key] = asyncio.ensure_future(coroutine_function(*args))
+            task.add_done_callback(lambda done: self._finished(key, done))
+        self._record(not leader)
+        return await asyncio.shield(task)
+
+    def _finished(self, key, task):
+        if self._tasks.get(key) is task:
+            del self._tasks[key]
+        # marks the exception as retrieved when every caller has already given up
+        if not task.cancelled():
+            task.exception()
@@ -0,0 +1,116 @@
+from concurrent.futures import Future
+from contextlib import contextmanager
+from .telemetry import log_json
+import asyncio
+import sys
+import threading
+import time
+
+# close enough to the start of the action server: the action modules import this module before anything else
+PROCESS_STARTED = time.perf_counter()
+
+
+class StartupProfile:
+    """
+        Durations of the startup phases of the action server (imports of the action modules, background warm-ups),
+        with how many modules each one imported. Every phase is logged as a JSON line when it ends.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.phases = []
+
+    @contextmanager
+    def phase(self, name):
+        start = time.perf_counter()
+        modules_before = len(sys.modules)
+        error = None
+        try:
+            yield
+        except BaseException as e:
+            error = e
+            raise
+        finally:
+            end = time.perf_counter()
+            entry = {
+                "phase": name,
+                "ms": round((end - start) * 1000, 3),
+                "ready_after_ms": round((end - PROCESS_STARTED) * 1000, 3),
+                "modules_imported": len(sys.modules) - modules_before,
+                "thread": threading.current_thread().name,
+            }
+            if error is not None:
+                entry["error"] = repr(error)
+            self._record(entry)
+
+    def mark(self, name):
+        # a module done importing: ready that long after the start, with everything imported so far
+        self._record({
+            "phase": name,
+            "ready_after_ms": round((time.perf_counter() - PROCESS_STARTED) * 1000, 3),
+            "modules_imported": len(sys.modules),
+            "thread": threading.current_thread().name,
+        })
+
+    def _record(self, entry):
+        with self._lock:
+            self.phases.append(entry)
+        log_json("startup_phase", **entry)
+
+    def report(self):
+        with self._lock:
+            return list(self.phases)
+
+
+STARTUP_PROFILE = StartupProfile()
+
+
+class BackgroundLoader:
+    """
+        Runs `loader` once in a daemon thread, as the startup phase `name`, and keeps its result. `get()` and
+        `get_async()` wait for it (starting it if needed) without blocking the event loop in the async case. A failed
+        load is retried by the next caller instead of failing every later request.
+    """
+
+    def __init__(self, name, loader):
+        self.name = name
+        self._loader = loader
+        self._lock = threading.Lock()
+        self._future = None
+
+    def start(self):
+        with self._lock:
+            if self._future is None or (self._future.done() and self._future.exception() is not None):
+                self._future = Future()
+                # running already, so a waiter giving up (cancelling its wrapper) cannot cancel the load itself
+                self._future.set_running_or_notify_cancel()
+                threading.Thread(target=self._run, args=(self._future,), name=f"load-{self.name}", daemon=True).start()
+            return self._future
+
+    def _run(self, future):
+        try:
+            with STARTUP_PROFILE.phase(self.name):
+                result = self._loader()
+        except BaseException as e:
+            print(f"ERROR: loading {self.name} failed, it is retried on the next request: {e}")
+            future.set_exception(e)
+        else:
+            future.set_result(result)
+
+    def ready(self):
+        future = self._future
+        return future is not None and future.done() and future.exception() is None
+
+    def get(self, timeout=None):
+        return self.start().result(timeout)
+
+    async def get_async(self, timeout=None):
+        loading = asyncio.wrap_future(self.start())
+        loading.add_done_callback(_retrieve_exception)
+        return await asyncio.wait_for(asyncio.shield(loading), timeout)
+
+
+def _retrieve_exception(future):
+    # marks the exception as retrieved when the waiter has already given up
+    if not future.cancelled():
+        future.exception()
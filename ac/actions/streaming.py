@@ -0,0 +1,64 @@
+SENTENCE_ENDINGS = (".", "!", "?", ":", "\n")
+
+
+def create_socketio_emitter(message_queue_url):
+    """
+        Write-only socket.io emitter attached to the message queue of the socket.io server the chat widget is connected
+        to. Returns None when streaming is not configured or python-socketio is not installed.
+    """
+    if not message_queue_url:
+        return None
+    try:
+        import socketio
+    except ImportError:
+        print("ERROR: python-socketio is not installed, answers will not be streamed")
+        return None
+    return socketio.AsyncRedisManager(message_queue_url, write_only=True)
+
+
+class SocketIOChunkSink:
+    """
+        Forwards a streamed answer to the chat widget over socket.io.
+
+        Tokens are buffered and sent as separate bot messages at sentence boundaries (once at least `min_chars` have been
+        collected), so the widget shows the answer sentence by sentence instead of one bubble per token. `emitted_chars`
+        is the length of the prefix of the answer the widget received; after a failed emit the rest is not streamed.
+    """
+
+    def __init__(self, emitter, bot_message_evt, room, min_chars=80):
+        self.emitter = emitter
+        self.bot_message_evt = bot_message_evt
+        self.room = room
+        self.min_chars = min_chars
+        self.emitted = False
+        self.failed = False
+        self.emitted_chars = 0
+        self._buffer = []
+        self._buffered_chars = 0
+
+    async def push(self, token):
+        if self.failed:
+            return
+        self._buffer.append(token)
+        self._buffered_chars += len(token)
+        if self._buffered_chars >= self.min_chars and token.rstrip(" ").endswith(SENTENCE_ENDINGS):
+            await self.flush()
+
+    async def flush(self):
+        raw_text = "".join(self._buffer)
+        text = raw_text.strip()
+        self._buffer = []
+        self._buffered_chars = 0
+        if self.failed:
+            return
+        if not text:
+            self.emitted_chars += len(raw_text)
+            return
+        try:
+            await self.emitter.emit(self.bot_message_evt, {"text": text}, room=self.room)
+            self.emitted = True
+            self.emitted_chars += len(raw_text)
+        except Exception as e:
+            # stop streaming, the caller sends what the widget did not receive
+            print(f"ERROR: could not stream the answer: {e}")
+            self.failed = True
@@ -0,0 +1,242 @@
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from .config import get_config, add_config_listener
+import bisect
+import json
+import random
+import threading
+import time
+import uuid
+
+METRICS_ENABLED = True
+# loopback only, the scraper runs on the same host (or set the host of a private interface)
+METRICS_HOST = "127.0.0.1"
+# next to the action server's 5055, clear of the 9100 of node_exporter
+METRICS_PORT = 5056
+TRACE_SAMPLE_RATE = 0.1
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+TOKEN_BUCKETS = (16, 32, 64, 128, 256, 512, 1024, 2048, 4096, 8192)
+
+def load_config(config):
+    global METRICS_ENABLED, METRICS_HOST, METRICS_PORT, TRACE_SAMPLE_RATE
+    METRICS_ENABLED = config.get_bool('METRICS_ENABLED', METRICS_ENABLED)
+    METRICS_HOST = config.get_str('METRICS_HOST', METRICS_HOST)
+    METRICS_PORT = config.get_int('METRICS_PORT', METRICS_PORT)
+    TRACE_SAMPLE_RATE = config.get_float('TRACE_SAMPLE_RATE', TRACE_SAMPLE_RATE)
+
+load_config(get_config())
+# the sample rate follows conf.txt edits, the metrics server keeps its host and port until a restart
+add_config_listener(load_config)
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _format_labels(labelnames, values, extra=()):
+    pairs = [*zip(labelnames, values), *extra]
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{name}="{_escape(value)}"' for name, value in pairs) + "}"
+
+
+class Counter:
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+        self._values = {}
+
+    def inc(self, *labels, amount=1):
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            for labels, value in sorted(self._values.items()):
+                lines.append(f"{self.name}{_format_labels(self.labelnames, labels)} {value}")
+        return lines
+
+
+class Histogram:
+    def __init__(self, name, documentation, labelnames=(), buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(buckets)
+        self._lock = threading.Lock()
+        # per label values: count per bucket (the last one is +Inf), sum
+        self._values = {}
+
+    def observe(self, value, *labels):
+        with self._lock:
+            counts, total = self._values.get(labels, ([0] * (len(self.buckets) + 1), 0.0))
+            counts[bisect.bisect_left(self.buckets, value)] += 1
+            self._values[labels] = (counts, total + value)
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            for labels, (counts, total) in sorted(self._values.items()):
+                cumulative = 0
+                for bound, count in zip([*self.buckets, "+Inf"], counts):
+                    cumulative += count
+                    lines.append(f"{self.name}_bucket{_format_labels(self.labelnames, labels, [('le', bound)])} {cumulative}")
+                lines.append(f"{self.name}_sum{_format_labels(self.labelnames, labels)} {total}")
+                lines.append(f"{self.name}_count{_format_labels(self.labelnames, labels)} {cumulative}")
+        return lines
+
+
+class Gauge:
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+        self._values = {}
+
+    def set(self, value, *labels):
+        with self._lock:
+            self._values[labels] = value
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} gauge"]
+        with self._lock:
+            for labels, value in sorted(self._values.items()):
+                lines.append(f"{self.name}{_format_labels(self.labelnames, labels)} {value}")
+        return lines
+
+
+RAG_STAGE_SECONDS = Histogram("rag_stage_seconds", "Duration of the stages of a RAG answer.", ["stage"])
+RAG_TOKENS = Histogram("rag_tokens", "Prompt and completion tokens of the LLM calls.", ["kind"], buckets=TOKEN_BUCKETS)
+RAG_ANSWERS = Counter("rag_answers_total", "RAG answers by where they came from.", ["source"])
+RAG_CACHE_LOOKUPS = Counter("rag_semantic_cache_lookups_total", "Semantic cache lookups.", ["result"])
+RAG_DIRECT_ANSWER_SECONDS_SAVED = Counter("rag_direct_answer_llm_seconds_saved_total", "LLM time saved by the direct FAQ answers, estimated from the average LLM call.")
+RAZGAR_CALL_SECONDS = Histogram("razgar_call_seconds", "Duration of the database and bot API calls of RazgaRUI.", ["kind", "call", "outcome"])
+MAKE_BOT_PREFETCHES = Counter("make_bot_prefetches_total", "Prefetched make-bot data by whether the form used it.", ["kind", "result"])
+ADMISSION_WAIT_SECONDS = Histogram("admission_wait_seconds", "Time spent waiting for a slot of the admission controller.", ["priority"])
+ADMISSION_REJECTIONS = Counter("admission_rejections_total", "Requests shed by admission control or the per-user rate limit.", ["reason"])
+ADMISSION_ACTIVE = Gauge("admission_active", "Units of work holding a slot of the admission controller.")
+ADMISSION_QUEUE_DEPTH = Gauge("admission_queue_depth", "Units of work waiting for a slot of the admission controller.")
+DB_POOL_IN_USE = Gauge("db_pool_connections_in_use", "Database connections checked out of the pool.", ["env"])
+DB_POOL_OPEN = Gauge("db_pool_connections_open", "Database connections opened by the pool (idle and in use).", ["env"])
+DB_POOL_CONNECTS = Counter("db_pool_connects_total", "New database connections made by the pool.", ["env"])
+DB_POOL_WAIT_SECONDS = Histogram("db_pool_checkout_wait_seconds", "Time spent checking a connection out of the pool.", ["env"])
+LLM_BACKEND_SECONDS = Histogram("llm_backend_seconds", "Duration of the successful completions of each LLM backend.", ["backend"])
+LLM_BACKEND_CALLS = Counter("llm_backend_calls_total", "Calls of each LLM backend by outcome.", ["backend", "outcome"])
+LLM_BACKEND_HEDGES = Counter("llm_backend_hedges_total", "Completions of a slow LLM backend hedged with the next one.", ["backend"])
+LLM_TIME_TO_FIRST_TOKEN_SECONDS = Histogram("llm_time_to_first_token_seconds", "Time to the first token of the streamed completions.")
+SINGLE_FLIGHT_CALLS = Counter("single_flight_calls_total", "Calls of a single-flight registry that ran the computation or joined one in flight.", ["name", "result"])
+METRICS = [
+    RAG_STAGE_SECONDS, RAG_TOKENS, RAG_ANSWERS, RAG_CACHE_LOOKUPS, RAG_DIRECT_ANSWER_SECONDS_SAVED, RAZGAR_CALL_SECONDS, MAKE_BOT_PREFETCHES,
+    ADMISSION_WAIT_SECONDS, ADMISSION_REJECTIONS, ADMISSION_ACTIVE, ADMISSION_QUEUE_DEPTH,
+    DB_POOL_IN_USE, DB_POOL_OPEN, DB_POOL_CONNECTS, DB_POOL_WAIT_SECONDS,
+    LLM_BACKEND_SECONDS, LLM_BACKEND_CALLS, LLM_BACKEND_HEDGES, LLM_TIME_TO_FIRST_TOKEN_SECONDS, SINGLE_FLIGHT_CALLS,
+]
+
+
+def render_metrics():
+    return "\n".join(line for metric in METRICS for line in metric.render()) + "\n"
+
+
+def log_json(event, **fields):
+    print(json.dumps({"event": event, "time": time.time(), **fields}, default=str))
+
+
+class Trace:
+    """
+        Timing spans and attributes of one request. Every span is observed in `RAG_STAGE_SECONDS`; the trace itself is
+        written as one JSON log line when it is sampled (`TRACE_SAMPLE_RATE`), failed, or is a debug trace.
+    """
+
+    def __init__(self, name, debug=False):
+        self.name = name
+        self.trace_id = uuid.uuid4().hex
+        self.debug = debug
+        self.sampled = debug or random.random() < TRACE_SAMPLE_RATE
+        self.start = time.perf_counter()
+        self.spans = []
+        self.attributes = {}
+
+    @contextmanager
+    def span(self, stage):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            seconds = time.perf_counter() - start
+            RAG_STAGE_SECONDS.observe(seconds, stage)
+            self.spans.append({"stage": stage, "ms": round(seconds * 1000, 3)})
+
+    def set(self, **attributes):
+        self.attributes.update(attributes)
+
+    def finish(self, error=None):
+        seconds = time.perf_counter() - self.start
+        RAG_STAGE_SECONDS.observe(seconds, "total")
+        if error is not None:
+            self.attributes["error"] = repr(error)
+        if self.sampled or error is not None:
+            log_json(self.name, trace_id=self.trace_id, ms=round(seconds * 1000, 3), spans=self.spans, **self.attributes)
+
+
+@contextmanager
+def timed_call(kind, call):
+    """
+        Times a database query or a bot API call of RazgaRUI into `RAZGAR_CALL_SECONDS`; failed calls, and a sample of
+        the others, are logged as JSON.
+    """
+    start = time.perf_counter()
+    outcome = "ok"
+    try:
+        yield
+    except Exception as e:
+        outcome = "error"
+        log_json("razgar_call", kind=kind, call=call, ms=round((time.perf_counter() - start) * 1000, 3), error=repr(e))
+        raise
+    finally:
+        seconds = time.perf_counter() - start
+        RAZGAR_CALL_SECONDS.observe(seconds, kind, call, outcome)
+        if outcome == "ok" and random.random() < TRACE_SAMPLE_RATE:
+            log_json("razgar_call", kind=kind, call=call, ms=round(seconds * 1000, 3))
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.split("?")[0] != "/metrics":
+            self.send_error(404)
+            return
+        body = render_metrics().encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        # scrapes are not worth a log line each
+        pass
+
+
+_metrics_server = None
+_metrics_server_lock = threading.Lock()
+
+
+def start_metrics_server():
+    """
+        Serves `/metrics` in the Prometheus text format on `METRICS_HOST`:`METRICS_PORT`, next to the action server. Only
+        done once per process. The metrics are per process: with several worker processes only the first one binds the
+        port, the others log that their metrics are not served and keep answering.
+    """
+    global _metrics_server
+    with _metrics_server_lock:
+        if not METRICS_ENABLED or _metrics_server is not None:
+            return
+        try:
+            _metrics_server = ThreadingHTTPServer((METRICS_HOST, METRICS_PORT), _MetricsHandler)
+        except OSError as e:
+            print(f"ERROR: could not serve metrics on {METRICS_HOST}:{METRICS_PORT}, the metrics of this process are not served: {e}")
+            return
+        threading.Thread(target=_metrics_server.serve_forever, name="metrics", daemon=True).start()
@@ -0,0 +1,188 @@
+from langchain.schema import Document
+import json
+import os
+import shutil
+import sys
+
+import numpy as np
+
+CHROMA_BACKEND = "chroma"
+NUMPY_BACKEND = "numpy"
+NUMPY_VECTORS_FILE = "vectors.npy"
+NUMPY_SCALES_FILE = "scales.npy"
+NUMPY_METADATA_FILE = "metadata.jsonl"
+NUMPY_INFO_FILE = "info.json"
+NUMPY_DTYPES = ("float32", "float16", "int8")
+# rows scored per matrix product, bounds the temporary memory of a search over a large index
+SEARCH_BLOCK_ROWS = 65536
+
+
+def swap_in_pysqlite3():
+    # chroma needs a newer sqlite than the system one, only done once and only when chroma is actually used
+    if getattr(sys.modules.get('sqlite3'), '__name__', None) != 'pysqlite3':
+        __import__('pysqlite3')
+        sys.modules['sqlite3'] = sys.modules.pop('pysqlite3')
+
+
+class ChromaVectorStore:
+    """
+        The chroma collection built by the db-setup script.
+    """
+
+    def __init__(self, persist_directory, embeddings):
+        swap_in_pysqlite3()
+        from langchain_community.vectorstores import Chroma
+
+        self.db = Chroma(persist_directory=persist_directory, embedding_function=embeddings)
+        self._relevance_fn = self.db._select_relevance_score_fn()
+
+    def search_by_vectors(self, embeddings, k):
+        # one query for the whole batch, straight on the collection so the chunk ids come back as well
+        results = self.db._collection.query(
+            query_embeddings=np.asarray(embeddings, dtype=np.float32).tolist(),
+            n_results=k,
+            include=["documents", "metadatas", "distances"],
+        )
+        return [
+            [
+                (Document(page_content=document, metadata=dict(metadata or {}, id=chunk_id)), self._relevance_fn(distance))
+                for chunk_id, document, metadata, distance in zip(ids, documents, metadatas, distances)
+            ]
+            for ids, documents, metadatas, distances in zip(
+                results["ids"], results["documents"], results["metadatas"], results["distances"])
+        ]
+
+    def search_by_vector(self, embedding, k):
+        return self.search_by_vectors([embedding], k)[0]
+
+    def close(self):
+        # drops the collection, and with it the sqlite connection, once no search uses this snapshot anymore
+        self.db = None
+
+
+class NumpyVectorStore:
+    """
+        Exact brute-force index over a memory-mapped matrix of normalized embeddings (float32, float16 or int8 with a
+        scale per row), with the chunk texts and metadata in a sidecar file.
+
+        The matrix is opened with `mmap_mode='r'`, so every worker process maps the same pages of the page cache instead of
+        holding its own copy. Scores are cosine similarities.
+    """
+
+    def __init__(self, index_path):
+        with open(os.path.join(index_path, NUMPY_INFO_FILE), 'r') as file:
+            self.info = json.load(file)
+        self.vectors = np.load(os.path.join(index_path, NUMPY_VECTORS_FILE), mmap_mode='r')
+        self.scales = None
+        if self.info["dtype"] == "int8":
+            self.scales = np.load(os.path.join(index_path, NUMPY_SCALES_FILE), mmap_mode='r')
+        self.documents = []
+        with open(os.path.join(index_path, NUMPY_METADATA_FILE), 'r') as file:
+            for line in file:
+                row = json.loads(line)
+                self.documents.append(Document(page_content=row["document"], metadata=dict(row["metadata"], id=row["id"])))
+
+    def _scores(self, queries, start, end):
+        block = self.vectors[start:end]
+        scores = queries @ block.T.astype(np.float32, copy=False)
+        if self.scales is not None:
+            scores *= self.scales[start:end]
+        return scores
+
+    def search_by_vectors(self, embeddings, k):
+        """
+            Top-k for a batch of query embeddings with one matrix product per block of rows.
+        """
+        queries = np.asarray(embeddings, dtype=np.float32)
+        queries = queries / np.maximum(np.linalg.norm(queries, axis=1, keepdims=True), 1e-12)
+        total = len(self.documents)
+        k = min(k, total)
+        if k == 0:
+            return [[] for _query in queries]
+
+        best_scores = np.full((len(queries), 0), -np.inf, dtype=np.float32)
+        best_rows = np.zeros((len(queries), 0), dtype=np.int64)
+        for start in range(0, total, SEARCH_BLOCK_ROWS):
+            end = min(start + SEARCH_BLOCK_ROWS, total)
+            scores = np.concatenate([best_scores, self._scores(queries, start, end)], axis=1)
+            rows = np.concatenate([best_rows, np.broadcast_to(np.arange(start, end), (len(queries), end - start))], axis=1)
+            top = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+            best_scores = np.take_along_axis(scores, top, axis=1)
+            best_rows = np.take_along_axis(rows, top, axis=1)
+
+        order = np.argsort(-best_scores, axis=1)
+        best_scores = np.take_along_axis(best_scores, order, axis=1)
+        best_rows = np.take_along_axis(best_rows, order, axis=1)
+        return [
+            [(self.documents[row], float(score)) for row, score in zip(rows, scores)]
+            for rows, scores in zip(best_rows, best_scores)
+        ]
+
+    def search_by_vector(self, embedding, k):
+        return self.search_by_vectors([embedding], k)[0]
+
+    def close(self):
+        # unmaps the matrix of a snapshot that is no longer searched
+        self.vectors = self.scales = None
+        self.documents = []
+
+
+class NumpyIndexWriter:
+    """
+        Builds a numpy index row by row into a temporary directory, then swaps it in place of the previous one, so the
+        whole matrix never has to be held in memory.
+    """
+
+    def __init__(self, index_path, rows, dimensions, dtype="float32"):
+        if dtype not in NUMPY_DTYPES:
+            raise ValueError(f"Invalid numpy index dtype: {dtype}")
+        self.index_path = index_path
+        self.tmp_path = index_path + ".tmp"
+        self.dtype = dtype
+        self.rows = rows
+        self.dimensions = dimensions
+        self.written = 0
+        if os.path.exists(self.tmp_path):
+            shutil.rmtree(self.tmp_path)
+        os.makedirs(self.tmp_path)
+        self.vectors = np.lib.format.open_memmap(
+            os.path.join(self.tmp_path, NUMPY_VECTORS_FILE), mode='w+', dtype=dtype, shape=(rows, dimensions))
+        self.scales = None
+        if dtype == "int8":
+            self.scales = np.lib.format.open_memmap(
+                os.path.join(self.tmp_path, NUMPY_SCALES_FILE), mode='w+', dtype=np.float32, shape=(rows,))
+        self.metadata_file = open(os.path.join(self.tmp_path, NUMPY_METADATA_FILE), 'w')
+
+    def add(self, ids, embeddings, documents, metadatas):
+        vectors = np.asarray(embeddings, dtype=np.float32)
+        vectors = vectors / np.maximum(np.linalg.norm(vectors, axis=1, keepdims=True), 1e-12)
+        start, end = self.written, self.written + len(vectors)
+        if self.dtype == "int8":
+            scales = np.maximum(np.abs(vectors).max(axis=1), 1e-12) / 127
+            self.vectors[start:end] = np.round(vectors / scales[:, None]).astype(np.int8)
+            self.scales[start:end] = scales
+        else:
+            self.vectors[start:end] = vectors.astype(self.dtype)
+        for chunk_id, document, metadata in zip(ids, documents, metadatas):
+            self.metadata_file.write(json.dumps({"id": chunk_id, "document": document, "metadata": metadata}) + "\n")
+        self.written = end
+
+    def close(self):
+        self.vectors.flush()
+        if self.scales is not None:
+            self.scales.flush()
+        self.metadata_file.close()
+        with open(os.path.join(self.tmp_path, NUMPY_INFO_FILE), 'w') as file:
+            json.dump({"dtype": self.dtype, "rows": self.written, "dimensions": self.dimensions}, file)
+        if os.path.exists(self.index_path):
+            shutil.rmtree(self.index_path)
+        os.rename(self.tmp_path, self.index_path)
+
+
+def open_vector_store(backend, chroma_path, numpy_index_path, embeddings):
+    if backend == CHROMA_BACKEND:
+        return ChromaVectorStore(chroma_path, embeddings)
+    elif backend == NUMPY_BACKEND:
+        return NumpyVectorStore(numpy_index_path)
+    else:
+        raise ValueError(f"Invalid vector store backend: {backend}")
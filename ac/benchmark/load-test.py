@@ -0,0 +1,446 @@
+import argparse
+import importlib.util
+import json
+import os
+import random
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+
+BENCHMARK_DIR = os.path.dirname(os.path.abspath(__file__))
+AC_DIR = os.path.join(BENCHMARK_DIR, "..")
+RAG_BENCHMARK_PATH = os.path.join(BENCHMARK_DIR, "rag-benchmark.py")
+sys.path.insert(0, AC_DIR)
+sys.path.insert(0, BENCHMARK_DIR)
+from synthetic_corpus import generate_corpus
+from load_test_standins import (
+    ADD_BOT_PATH, CONTROL_BOT_PATH, FakeBotAPI, SQLiteConnector, connector_title, seed_database,
+)
+from actions.admission import ERROR_BUSY, ERROR_RATE_LIMITED
+
+PERCENTILES = (50, 95, 99)
+FORM_NAME = "FRM_make_new_bot"
+VALIDATE_FORM_ACTION = "validate_FRM_make_new_bot"
+# the parts of nl/data/domain the actions read
+DOMAIN = {
+    "forms": {FORM_NAME: {"required_slots": [
+        "SL_xconn_name", "SL_bot_name", "SL_xinstrument_name", "SL_start_bot_flag", "SL_abort_make_bot_flag",
+    ]}},
+    "slots": {},
+    "responses": {},
+}
+FALLBACK_QUESTIONS = [
+    "How do I create an exchange connector?",
+    "What is a grid bot?",
+    "How do I stop a running bot?",
+    "Which exchanges are supported?",
+]
+# outcomes of a call: a 200 with one of the replies of admission control is not a served answer
+OUTCOME_OK = "ok"
+OUTCOME_ERROR = "error"
+OUTCOME_SHED = "shed"
+OUTCOME_RATE_LIMITED = "rate_limited"
+OUTCOMES = (OUTCOME_OK, OUTCOME_ERROR, OUTCOME_SHED, OUTCOME_RATE_LIMITED)
+REPLY_OUTCOMES = {ERROR_BUSY: OUTCOME_SHED, ERROR_RATE_LIMITED: OUTCOME_RATE_LIMITED}
+# server side counters compared before and after every concurrency level
+SERVER_COUNTERS = ("admission_rejections_total", "rag_answers_total", "rag_semantic_cache_lookups_total")
+
+
+def serve(args):
+    """
+        The action server with its stand-ins, run in its own process by `main` so the load generator does not share
+        its CPU: MySQL replaced by the seeded SQLite file, the bot API by the `FakeBotAPI` of the parent, the LLM by
+        `MockBackend`, the semantic cache by one next to the database in the workspace.
+    """
+    os.environ.setdefault("HF_HUB_OFFLINE", "1")
+    os.chdir(AC_DIR)
+    from actions import classes, query_llm, query_rag, admission, telemetry
+    from actions.llm_backends import LLMRouter, MockBackend
+    from actions.semantic_cache import SemanticCache
+
+    classes.connector = SQLiteConnector(args.db_path, args.db_latency)
+    classes.URL_CONFIG = [args.bot_api_url] * len(classes.URL_CONFIG)
+    classes.URL_ADD_BOT, classes.URL_CONTROL_BOT = ADD_BOT_PATH, CONTROL_BOT_PATH
+    query_llm.LLM_ROUTER = LLMRouter([MockBackend(args.llm_latency)])
+    # a conf.txt edit during the run would rebuild the router from conf.txt
+    query_rag.HOT_RELOAD_ENABLED = False
+    query_rag.SEMANTIC_CACHE_ENABLED = not args.no_semantic_cache
+    if args.index_snapshots:
+        query_rag.INDEX_SNAPSHOTS_PATH = args.index_snapshots
+    # the mock answers go to a cache of the workspace, versioned by the snapshot under test, never to the server's
+    query_rag.SEMANTIC_CACHE = SemanticCache(
+        os.path.join(os.path.dirname(os.path.abspath(args.db_path)), "semantic_cache.pkl"),
+        watched_paths=[query_rag.current_pointer_path(query_rag.INDEX_SNAPSHOTS_PATH), query_rag.PROMPT_TEMPLATE_PATH],
+        threshold=query_rag.SEMANTIC_CACHE_THRESHOLD,
+        max_entries=query_rag.SEMANTIC_CACHE_MAX_ENTRIES,
+        ttl_seconds=query_rag.SEMANTIC_CACHE_TTL_SECONDS,
+    )
+    if not args.rate_limit:
+        # a few hundred simulated users asking back to back would measure the limit, not the server
+        admission.USER_RATE_LIMITER.configure(0, 1, 1)
+    telemetry.METRICS_PORT = args.metrics_port
+
+    from rasa_sdk.endpoint import run
+    run("actions", port=args.port)
+
+
+def build_faq_index(workspace, args):
+    """
+        Synthetic corpus and index snapshot of rag-benchmark.py; returns the snapshots directory and its questions.
+    """
+    spec = importlib.util.spec_from_file_location("rag_benchmark", RAG_BENCHMARK_PATH)
+    rag_benchmark = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(rag_benchmark)
+    db_script = rag_benchmark.load_db_script(workspace)
+    questions = generate_corpus(db_script.DATA_PATH, args.documents, 6, 3, args.faq_entries, args.seed)
+    db_script.build_snapshot(argparse.Namespace(
+        rebuild=True, keep_snapshots=2, workers=os.cpu_count() or 1, embed_batch_size=256, write_batch_size=1024,
+        queue_size=8, numpy_dtype="float32"))
+    return db_script.INDEX_SNAPSHOTS_PATH, [question["question"] for question in questions]
+
+
+class Conversation:
+    """
+        Tracker state of one replayed conversation, sent with every action call the way Rasa sends it to /webhook.
+    """
+
+    def __init__(self, session, url, user_id, sender_id, record):
+        self.session = session
+        self.url = url
+        self.sender_id = sender_id
+        self.slots = {"user_id": str(user_id), "env": "0", "SL_abort_make_bot_flag": False}
+        self.record = record
+        self.form_active = False
+        self.latest_message = {}
+
+    def user_says(self, text, intent):
+        self.latest_message = {"text": text, "intent": {"name": intent, "confidence": 1.0}, "entities": []}
+
+    def call(self, action, slot_events=()):
+        """
+            Calls `action`; `slot_events` are the slots Rasa extracted from the user's message (the ones a form
+            validation validates). Returns the events of the response, None when the call failed.
+        """
+        events = [{"event": "user", "text": self.latest_message.get("text"), "parse_data": self.latest_message,
+                   "input_channel": "rest"}]
+        for name, value in slot_events:
+            self.slots[name] = value
+            events.append({"event": "slot", "name": name, "value": value})
+        payload = {
+            "next_action": action,
+            "sender_id": self.sender_id,
+            "tracker": {
+                "sender_id": self.sender_id,
+                "slots": dict(self.slots),
+                "latest_message": self.latest_message,
+                "events": events,
+                "paused": False,
+                "followup_action": None,
+                "active_loop": {"name": FORM_NAME} if self.form_active else {},
+                "latest_action_name": "action_listen",
+            },
+            "domain": DOMAIN,
+        }
+        start = time.perf_counter()
+        outcome, result = OUTCOME_ERROR, None
+        try:
+            response = self.session.post(self.url, json=payload, timeout=120)
+            if response.status_code == 200:
+                body = response.json()
+                result = body.get("events", [])
+                outcome = reply_outcome(body.get("responses", []))
+        except (requests.RequestException, ValueError):
+            pass
+        # the form validation is reported per validated slot, their costs differ by orders of magnitude
+        self.record(f"{action} {slot_events[0][0]}" if slot_events else action, time.perf_counter() - start, outcome)
+        for event in result or ():
+            if event.get("event") == "slot":
+                self.slots[event["name"]] = event.get("value")
+        return result
+
+
+def reply_outcome(responses):
+    # the dispatcher's messages come back as "responses", next to the events
+    for message in responses:
+        outcome = REPLY_OUTCOMES.get(message.get("text"))
+        if outcome is not None:
+            return outcome
+    return OUTCOME_OK
+
+
+def stopped_form(events, slot=None):
+    # the actions stop the form by setting requested_slot to None, a rejected slot value is set back to None
+    for event in events:
+        if event.get("event") == "slot" and event.get("value") is None and event["name"] in ("requested_slot", slot):
+            return True
+    return False
+
+
+def replay_faq(conversation, rng, questions, turns):
+    for _ in range(turns):
+        conversation.user_says(rng.choice(questions), "INT_faq")
+        if conversation.call("answer_with_llm") is None:
+            return False
+    return True
+
+
+def replay_make_bot(conversation, rng, instruments, connectors_per_user, exchanges):
+    """
+        A complete make-bot form run: connector, bot name, instrument (creates the bot), start the bot, clean up.
+    """
+    connector = rng.randrange(connectors_per_user)
+    instrument = rng.choice(instruments[connector % exchanges + 1])
+    conversation.user_says("create a new bot", "INT_wants_new_bot")
+    conversation.form_active = True
+    steps = [
+        (VALIDATE_FORM_ACTION, ()),
+        ("action_ask_SL_xconn_name", ()),
+        (VALIDATE_FORM_ACTION, [("SL_xconn_name", connector_title(connector))]),
+        (VALIDATE_FORM_ACTION, [("SL_bot_name", f"load test {conversation.sender_id}")]),
+        ("action_ask_SL_xinstrument_name", ()),
+        # typed the way users do, resolved by the instrument search index
+        (VALIDATE_FORM_ACTION, [("SL_xinstrument_name", instrument.lower().replace("-", " "))]),
+        ("action_ask_SL_start_bot_flag", ()),
+        (VALIDATE_FORM_ACTION, [("SL_start_bot_flag", True)]),
+    ]
+    for action, slot_events in steps:
+        if slot_events:
+            name, value = slot_events[0]
+            conversation.user_says(str(value), "affirm" if value is True else "inform")
+        events = conversation.call(action, slot_events)
+        if events is None or stopped_form(events, slot_events[0][0] if slot_events else None):
+            return False
+    conversation.form_active = False
+    return conversation.call("action_clean_make_bot_slots") is not None
+
+
+class Recorder:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.calls = {}
+        self.conversations = {}
+
+    def record(self, action, seconds, outcome):
+        with self._lock:
+            self.calls.setdefault(action, []).append((seconds, outcome))
+
+    def conversation(self, kind, ok):
+        with self._lock:
+            counts = self.conversations.setdefault(kind, {"completed": 0, "failed": 0})
+            counts["completed" if ok else "failed"] += 1
+
+
+def percentiles_ms(seconds):
+    ordered = sorted(seconds)
+    if not ordered:
+        return {}
+    return {
+        f"p{percentile}": round(ordered[min(len(ordered) - 1, int(len(ordered) * percentile / 100))] * 1000, 3)
+        for percentile in PERCENTILES
+    }
+
+
+def scrape_counters(metrics_url):
+    try:
+        text = requests.get(metrics_url, timeout=5).text
+    except requests.RequestException:
+        return {}
+    counters = {}
+    for line in text.splitlines():
+        if line.startswith(SERVER_COUNTERS):
+            name, value = line.rsplit(" ", 1)
+            counters[name] = float(value)
+    return counters
+
+
+def run_level(args, concurrency, webhook_url, questions, instruments, seed):
+    recorder = Recorder()
+    deadline = time.perf_counter() + args.duration
+    sender_ids = iter(range(10 ** 9))
+    sender_lock = threading.Lock()
+
+    def worker(worker_id):
+        rng = random.Random(seed * 100003 + worker_id)
+        session = requests.Session()
+        while time.perf_counter() < deadline:
+            with sender_lock:
+                sender_id = f"load-{concurrency}-{next(sender_ids)}"
+            conversation = Conversation(session, webhook_url, rng.randint(1, args.users), sender_id, recorder.record)
+            if rng.random() < args.faq_ratio:
+                recorder.conversation("faq", replay_faq(conversation, rng, questions, args.faq_turns))
+            else:
+                recorder.conversation("make_bot", replay_make_bot(
+                    conversation, rng, instruments, args.connectors_per_user, args.exchanges))
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        list(pool.map(worker, range(concurrency)))
+    seconds = time.perf_counter() - start
+
+    actions = {}
+    for action, calls in sorted(recorder.calls.items()):
+        counts = {outcome: sum(1 for _seconds, call_outcome in calls if call_outcome == outcome) for outcome in OUTCOMES}
+        actions[action] = {
+            "calls": len(calls),
+            "served": counts[OUTCOME_OK],
+            "errors": counts[OUTCOME_ERROR],
+            "shed": counts[OUTCOME_SHED],
+            "rate_limited": counts[OUTCOME_RATE_LIMITED],
+            "error_rate": round(counts[OUTCOME_ERROR] / len(calls), 4),
+            "shed_rate": round((counts[OUTCOME_SHED] + counts[OUTCOME_RATE_LIMITED]) / len(calls), 4),
+            # of the served calls only, a shed answer returns right away
+            "latency_ms": percentiles_ms([call_seconds for call_seconds, outcome in calls if outcome == OUTCOME_OK]),
+        }
+    calls = sum(len(action_calls) for action_calls in recorder.calls.values())
+    served = sum(stats["served"] for stats in actions.values())
+    conversations = sum(counts["completed"] + counts["failed"] for counts in recorder.conversations.values())
+    return {
+        "concurrency": concurrency,
+        "seconds": round(seconds, 3),
+        "calls": calls,
+        "calls_per_second": round(calls / seconds, 2),
+        "served_per_second": round(served / seconds, 2),
+        "conversations": recorder.conversations,
+        "conversations_per_second": round(conversations / seconds, 2),
+        "actions": actions,
+    }
+
+
+def wait_until_ready(health_url, process, timeout):
+    deadline = time.perf_counter() + timeout
+    while time.perf_counter() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f"the action server exited with code {process.returncode}")
+        try:
+            if requests.get(health_url, timeout=1).status_code == 200:
+                return
+        except requests.RequestException:
+            pass
+        time.sleep(0.5)
+    raise RuntimeError(f"the action server was not ready after {timeout}s")
+
+
+def print_level(level):
+    print(f"\nconcurrency {level['concurrency']}: {level['served_per_second']} served calls/s "
+          f"({level['calls_per_second']} calls/s), {level['conversations_per_second']} conversations/s, {level['conversations']}")
+    print(f"  {'action':<52}{'calls':>8}{'errors':>8}{'shed':>8}{'limited':>8}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}")
+    for action, stats in level["actions"].items():
+        latency = stats["latency_ms"]
+        print(f"  {action:<52}{stats['calls']:>8}{stats['errors']:>8}{stats['shed']:>8}{stats['rate_limited']:>8}"
+              f"{latency.get('p50', 0):>10}{latency.get('p95', 0):>10}{latency.get('p99', 0):>10}")
+    if level.get("server_counters"):
+        print(f"  server: {level['server_counters']}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Load test of the action server's /webhook with local stand-ins for MySQL, the bot API and the LLM.")
+    parser.add_argument("--concurrency", type=str, default="1,2,4,8,16,32", help="Comma-separated levels of concurrent conversations, run in order.")
+    parser.add_argument("--duration", type=float, default=30, help="Seconds per concurrency level.")
+    parser.add_argument("--faq-ratio", type=float, default=0.8, help="Share of FAQ conversations, the others are make-bot form runs.")
+    parser.add_argument("--faq-turns", type=int, default=3, help="Questions per FAQ conversation.")
+    parser.add_argument("--users", type=int, default=200)
+    parser.add_argument("--connectors-per-user", type=int, default=2)
+    parser.add_argument("--exchanges", type=int, default=3)
+    parser.add_argument("--instruments-per-exchange", type=int, default=2000)
+    parser.add_argument("--db-latency", type=float, default=0.002, help="Seconds added to every database query.")
+    parser.add_argument("--api-latency", type=float, default=0.05, help="Seconds the fake bot API takes per call.")
+    parser.add_argument("--llm-latency", type=float, default=1.0, help="Seconds the mock LLM takes per answer.")
+    parser.add_argument("--index-snapshots", type=str, default=None, help="Index snapshots to answer from; a synthetic corpus is built otherwise.")
+    parser.add_argument("--questions", type=str, default=None, help="File with one FAQ question per line.")
+    parser.add_argument("--documents", type=int, default=20, help="Documents of the synthetic corpus.")
+    parser.add_argument("--faq-entries", type=int, default=30, help="FAQ entries of the synthetic corpus.")
+    parser.add_argument("--no-semantic-cache", action="store_true", help="Every question goes through retrieval and the LLM.")
+    parser.add_argument("--rate-limit", action="store_true", help="Keeps the per-user rate limit of admission.py, off by default.")
+    parser.add_argument("--port", type=int, default=5155)
+    parser.add_argument("--metrics-port", type=int, default=9155)
+    parser.add_argument("--startup-timeout", type=float, default=300)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--workspace", type=str, default=None, help="Directory for the database and indexes (kept), a temporary one otherwise.")
+    parser.add_argument("--output", type=str, default="load-test.json", help="JSON file the results are written to.")
+    args = parser.parse_args()
+
+    workspace = args.workspace or tempfile.mkdtemp(prefix="load-test-")
+    bot_api = FakeBotAPI(args.api_latency).start()
+    server = None
+    try:
+        db_path = os.path.join(workspace, "razgar.sqlite")
+        instruments = seed_database(db_path, args.users, args.connectors_per_user, args.exchanges,
+                                    args.instruments_per_exchange, args.seed)
+        index_snapshots, questions = args.index_snapshots, FALLBACK_QUESTIONS
+        if index_snapshots is None and args.faq_ratio > 0:
+            index_snapshots, questions = build_faq_index(workspace, args)
+        if args.questions:
+            with open(args.questions, "r") as file:
+                questions = [line.strip() for line in file if line.strip()]
+
+        command = [sys.executable, os.path.abspath(__file__), "serve", "--db-path", db_path,
+                   "--db-latency", str(args.db_latency), "--bot-api-url", bot_api.url,
+                   "--llm-latency", str(args.llm_latency), "--port", str(args.port),
+                   "--metrics-port", str(args.metrics_port)]
+        if index_snapshots:
+            command += ["--index-snapshots", index_snapshots]
+        command += [flag for flag, enabled in (("--no-semantic-cache", args.no_semantic_cache),
+                                               ("--rate-limit", args.rate_limit)) if enabled]
+        server = subprocess.Popen(command)
+        base_url = f"http://127.0.0.1:{args.port}"
+        wait_until_ready(base_url + "/health", server, args.startup_timeout)
+        metrics_url = f"http://127.0.0.1:{args.metrics_port}/metrics"
+
+        # one conversation of each kind first, so the RAG stack is loaded and the caches are warm
+        warm_up = Conversation(requests.Session(), base_url + "/webhook", 1, "load-warm-up", lambda *_: None)
+        replay_faq(warm_up, random.Random(args.seed), questions, 1)
+        replay_make_bot(warm_up, random.Random(args.seed), instruments, args.connectors_per_user, args.exchanges)
+
+        levels = []
+        for concurrency in [int(level) for level in args.concurrency.split(",")]:
+            before = scrape_counters(metrics_url)
+            level = run_level(args, concurrency, base_url + "/webhook", questions, instruments, args.seed)
+            after = scrape_counters(metrics_url)
+            level["server_counters"] = {name: value - before.get(name, 0) for name, value in after.items()
+                                        if value != before.get(name, 0)}
+            print_level(level)
+            levels.append(level)
+        results = {
+            "time": time.time(),
+            "config": vars(args),
+            "bot_api_requests": bot_api.requests,
+            "levels": levels,
+        }
+    finally:
+        if server is not None:
+            server.terminate()
+            server.wait()
+        bot_api.stop()
+        if args.workspace is None:
+            shutil.rmtree(workspace, ignore_errors=True)
+
+    with open(args.output, "w") as file:
+        json.dump(results, file, indent=2)
+    print(f"\nresults written to {args.output}")
+
+
+def serve_main():
+    parser = argparse.ArgumentParser(description="Action server with the load test stand-ins, started by the load test.")
+    parser.add_argument("--db-path", type=str, required=True)
+    parser.add_argument("--db-latency", type=float, default=0.0)
+    parser.add_argument("--bot-api-url", type=str, required=True)
+    parser.add_argument("--llm-latency", type=float, default=0.0)
+    parser.add_argument("--index-snapshots", type=str, default=None)
+    parser.add_argument("--no-semantic-cache", action="store_true")
+    parser.add_argument("--rate-limit", action="store_true")
+    parser.add_argument("--port", type=int, default=5155)
+    parser.add_argument("--metrics-port", type=int, default=9155)
+    serve(parser.parse_args(sys.argv[2:]))
+
+
+if __name__ == "__main__":
+    if sys.argv[1:2] == ["serve"]:
+        serve_main()
+    else:
+        main()
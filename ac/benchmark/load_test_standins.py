@@ -0,0 +1,165 @@
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from types import SimpleNamespace
+import itertools
+import json
+import random
+import sqlite3
+import threading
+import time
+
+ADD_BOT_PATH = "add_bot"
+CONTROL_BOT_PATH = "control_bot"
+# offered first by Helper.mapXInstrumentsListToButtons, the rest of an exchange's instruments are generated
+MAJOR_INSTRUMENTS = ["BTC-PERPETUAL", "ETH-PERPETUAL", "SOL-PERPETUAL"]
+
+
+def connector_title(index):
+    return f"Connector {index}"
+
+
+def seed_database(path, users=100, connectors_per_user=2, exchanges=3, instruments_per_exchange=500, seed=0):
+    """
+        Creates the two tables the make-bot form reads, with the columns classes.py selects, in an SQLite file: every
+        user (ids 1 to `users`) gets `connectors_per_user` connectors titled "Connector <n>" spread over the exchanges,
+        and every exchange gets the major instruments plus generated ones. Returns the instrument names per exchange id.
+    """
+    rng = random.Random(seed)
+    conn = sqlite3.connect(path)
+    try:
+        conn.executescript("""
+            DROP TABLE IF EXISTS exchange_connectors;
+            DROP TABLE IF EXISTS exchange_instruments;
+            CREATE TABLE exchange_connectors (id INTEGER PRIMARY KEY, investor_id TEXT, title TEXT, exchange_id INTEGER);
+            CREATE TABLE exchange_instruments (id INTEGER PRIMARY KEY, exchange_id INTEGER, name TEXT);
+            CREATE INDEX connectors_by_investor ON exchange_connectors (investor_id, title);
+            CREATE INDEX instruments_by_exchange ON exchange_instruments (exchange_id, name);
+        """)
+        conn.executemany(
+            "INSERT INTO exchange_connectors (investor_id, title, exchange_id) VALUES (?, ?, ?)",
+            [(str(user), connector_title(index), index % exchanges + 1)
+             for user in range(1, users + 1) for index in range(connectors_per_user)])
+        instruments = {}
+        for exchange_id in range(1, exchanges + 1):
+            names = set(MAJOR_INSTRUMENTS)
+            while len(names) < max(instruments_per_exchange, len(MAJOR_INSTRUMENTS)):
+                base = "".join(rng.choices("ABCDEFGHIJKLMNOPQRSTUVWXYZ", k=rng.randint(3, 5)))
+                names.add(f"{base}-{rng.choice(['PERPETUAL', 'USDT', 'USD'])}")
+            instruments[exchange_id] = sorted(names)
+            conn.executemany("INSERT INTO exchange_instruments (exchange_id, name) VALUES (?, ?)",
+                             [(exchange_id, name) for name in instruments[exchange_id]])
+        conn.commit()
+        return instruments
+    finally:
+        conn.close()
+
+
+class _Cursor:
+    def __init__(self, conn, latency, dictionary):
+        self._conn = conn
+        self._latency = latency
+        self._dictionary = dictionary
+        self._rows = []
+
+    def execute(self, query, params=None):
+        if query.lstrip().upper().startswith("SET "):
+            # MySQL session settings (MAX_EXECUTION_TIME) have no SQLite equivalent
+            self._rows = []
+            return
+        if self._latency:
+            time.sleep(self._latency)
+        cursor = self._conn.execute(query.replace("%s", "?"), tuple(params or ()))
+        columns = [column[0] for column in cursor.description or ()]
+        rows = cursor.fetchall()
+        self._rows = [dict(zip(columns, row)) for row in rows] if self._dictionary else rows
+
+    def fetchall(self):
+        return self._rows
+
+    def close(self):
+        pass
+
+
+class _Connection:
+    def __init__(self, conn, latency):
+        self._conn = conn
+        self._latency = latency
+
+    def is_connected(self):
+        return True
+
+    def ping(self, reconnect=False):
+        pass
+
+    def cursor(self, dictionary=False):
+        return _Cursor(self._conn, self._latency, dictionary)
+
+    def close(self):
+        self._conn.close()
+
+
+class SQLiteConnector:
+    """
+        Stand-in for the `mysql.connector` module of classes.py, backed by the SQLite file of `seed_database`. Only the
+        calls `DBConnectionPool` and `RazgaRUI.EXECUTESQL` make are implemented; every query sleeps `latency` seconds to
+        simulate the network round trip.
+    """
+
+    errors = SimpleNamespace(OperationalError=sqlite3.OperationalError)
+
+    def __init__(self, path, latency=0.0):
+        self.path = path
+        self.latency = latency
+
+    def connect(self, **_db_conf):
+        return _Connection(sqlite3.connect(self.path, check_same_thread=False), self.latency)
+
+
+class FakeBotAPI:
+    """
+        Local bot-control API answering `URL_ADD_BOT` (a new bot id) and `URL_CONTROL_BOT` (success) after `latency`
+        seconds, on a free port of 127.0.0.1. `requests` counts the calls per path.
+    """
+
+    def __init__(self, latency=0.0):
+        self.latency = latency
+        self.requests = {}
+        self._lock = threading.Lock()
+        self._bot_ids = itertools.count(1)
+        api = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_POST(self):
+                self.rfile.read(int(self.headers.get("Content-Length", 0)))
+                path = self.path.strip("/")
+                with api._lock:
+                    api.requests[path] = api.requests.get(path, 0) + 1
+                if api.latency:
+                    time.sleep(api.latency)
+                if path == ADD_BOT_PATH:
+                    body = {"communicationCode": 1, "id": next(api._bot_ids)}
+                elif path == CONTROL_BOT_PATH:
+                    body = {"communicationCode": 1}
+                else:
+                    self.send_error(404)
+                    return
+                payload = json.dumps(body).encode()
+                self.send_response(200)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(payload)))
+                self.end_headers()
+                self.wfile.write(payload)
+
+            def log_message(self, format, *args):
+                pass
+
+        self._server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self._server.daemon_threads = True
+        self.url = f"http://127.0.0.1:{self._server.server_address[1]}/"
+
+    def start(self):
+        threading.Thread(target=self._server.serve_forever, name="fake-bot-api", daemon=True).start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
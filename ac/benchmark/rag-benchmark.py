@@ -0,0 +1,212 @@
+import argparse
+import importlib.util
+import json
+import os
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+# the embedding model (and tiktoken's encoding) must already be in the local cache, nothing is downloaded
+os.environ.setdefault("HF_HUB_OFFLINE", "1")
+
+BENCHMARK_DIR = os.path.dirname(os.path.abspath(__file__))
+AC_DIR = os.path.join(BENCHMARK_DIR, "..")
+DB_SCRIPT_PATH = os.path.join(AC_DIR, "other-scripts", "db-setup-and-creation-script.py")
+sys.path.insert(0, AC_DIR)
+sys.path.insert(0, BENCHMARK_DIR)
+from synthetic_corpus import generate_corpus
+
+RECALL_KS = (1, 3, 5, 10)
+PERCENTILES = (50, 95, 99)
+
+
+def load_db_script(workspace):
+    # the db-setup script is a standalone file with a hyphenated name, its paths are pointed to the workspace
+    spec = importlib.util.spec_from_file_location("db_setup", DB_SCRIPT_PATH)
+    db_script = importlib.util.module_from_spec(spec)
+    # registered, so the split workers can unpickle its functions
+    sys.modules[spec.name] = db_script
+    spec.loader.exec_module(db_script)
+    db_script.INDEX_SNAPSHOTS_PATH = os.path.join(workspace, "index_snapshots")
+    db_script.DATA_PATH = os.path.join(workspace, "documents")
+    db_script.LEGACY_CHROMA_PATH = os.path.join(workspace, "chroma")
+    return db_script
+
+
+def disk_size_mb(path):
+    if os.path.isfile(path):
+        return os.path.getsize(path) / 2 ** 20
+    total = 0
+    for root, _dirs, files in os.walk(path):
+        total += sum(os.path.getsize(os.path.join(root, file_name)) for file_name in files)
+    return total / 2 ** 20
+
+
+def peak_rss_mb():
+    # ru_maxrss is in kilobytes on linux; the split workers are child processes
+    self_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    children_rss = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss
+    return max(self_rss, children_rss) / 1024
+
+
+def percentiles_ms(seconds):
+    ordered = sorted(seconds)
+    if not ordered:
+        return {}
+    return {
+        f"p{percentile}": round(ordered[min(len(ordered) - 1, int(len(ordered) * percentile / 100))] * 1000, 3)
+        for percentile in PERCENTILES
+    } | {"mean": round(sum(ordered) / len(ordered) * 1000, 3)}
+
+
+def benchmark_ingestion(db_script, args, documents):
+    start = time.perf_counter()
+    db_script.build_snapshot(argparse.Namespace(
+        rebuild=True, keep_snapshots=2, workers=args.workers, embed_batch_size=args.embed_batch_size,
+        write_batch_size=args.write_batch_size, queue_size=args.queue_size, numpy_dtype=args.numpy_dtype))
+    seconds = time.perf_counter() - start
+    return {
+        "documents": documents,
+        "seconds": round(seconds, 3),
+        "documents_per_second": round(documents / seconds, 2),
+        "peak_rss_mb": round(peak_rss_mb(), 1),
+        "disk_mb": {
+            name: round(disk_size_mb(path), 3)
+            for name, path in (("chroma", db_script.CHROMA_PATH), ("numpy_index", db_script.NUMPY_INDEX_PATH),
+                               ("bm25_index", db_script.BM25_INDEX_PATH), ("faq_index", db_script.FAQ_INDEX_PATH))
+            if os.path.exists(path)
+        },
+    }
+
+
+def configure_query_rag(db_script, args):
+    from actions import query_rag, query_llm, telemetry
+    from actions.llm_backends import LLMRouter, MockBackend
+
+    query_rag.INDEX_SNAPSHOTS_PATH = db_script.INDEX_SNAPSHOTS_PATH
+    query_rag.VECTOR_STORE_BACKEND = args.backend
+    # every question has to go through retrieval, and the same question must not be answered from the cache
+    query_rag.SEMANTIC_CACHE_ENABLED = False
+    query_rag.DIRECT_ANSWER_ENABLED = args.direct_answers
+    if args.context_k_factor is not None:
+        query_rag.CONTEXT_K_FACTOR = args.context_k_factor
+    query_llm.LLM_ROUTER = LLMRouter([MockBackend(args.llm_latency)])
+    telemetry.TRACE_SAMPLE_RATE = 0
+    return query_rag
+
+
+def benchmark_queries(query_rag, questions, repeat):
+    engine = query_rag.get_retrieval_engine()
+    engine.warm_up()
+    retrieval_seconds, answer_seconds = [], []
+    for _ in range(repeat):
+        for question in questions:
+            start = time.perf_counter()
+            embedding = engine.embed_query(question["question"])
+            query_rag.retrieve(engine, question["question"], embedding)
+            retrieval_seconds.append(time.perf_counter() - start)
+
+            start = time.perf_counter()
+            query_rag.query_rag(question["question"])
+            answer_seconds.append(time.perf_counter() - start)
+    return {
+        "queries": len(retrieval_seconds),
+        "retrieval_ms": percentiles_ms(retrieval_seconds),
+        "query_rag_ms": percentiles_ms(answer_seconds),
+    }
+
+
+def benchmark_recall(query_rag, questions):
+    """
+        recall@k: share of the questions for which one of the first k retrieved chunks comes from the labeled file and
+        contains the labeled text (the instrument symbol of the fact).
+    """
+    engine = query_rag.get_retrieval_engine()
+    max_k = max(RECALL_KS)
+    hits = {kind: {k: 0 for k in RECALL_KS} for kind in {question["kind"] for question in questions}}
+    counts = {kind: 0 for kind in hits}
+    saved = query_rag.CONTEXT_ASSEMBLY_ENABLED, query_rag.CONTEXT_CANDIDATES
+    # enough candidates for the largest k, whatever the configured context size is
+    query_rag.CONTEXT_ASSEMBLY_ENABLED, query_rag.CONTEXT_CANDIDATES = True, max_k
+    try:
+        for question in questions:
+            results = query_rag.retrieve(engine, question["question"], engine.embed_query(question["question"]))
+            relevant = [
+                doc.metadata.get("source") == question["source"] and question["expected_text"] in doc.page_content
+                for doc, _score in results
+            ]
+            counts[question["kind"]] += 1
+            for k in RECALL_KS:
+                hits[question["kind"]][k] += any(relevant[:k])
+    finally:
+        query_rag.CONTEXT_ASSEMBLY_ENABLED, query_rag.CONTEXT_CANDIDATES = saved
+    return {
+        kind: {f"recall@{k}": round(hits[kind][k] / counts[kind], 4) for k in RECALL_KS}
+        for kind in hits
+    }
+
+
+def git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "HEAD"], cwd=AC_DIR, capture_output=True, text=True, check=True).stdout.strip()
+    except Exception:
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Offline RAG benchmark on a synthetic corpus, with a stubbed LLM.")
+    parser.add_argument("--documents", type=int, default=50, help="Synthetic markdown documents.")
+    parser.add_argument("--sections", type=int, default=8, help="Sections (and facts) per document.")
+    parser.add_argument("--paragraphs", type=int, default=4, help="Paragraphs per section.")
+    parser.add_argument("--faq-entries", type=int, default=50, help="Question/answer pairs of the FAQ document.")
+    parser.add_argument("--questions", type=int, default=200, help="Labeled questions used for latency and recall.")
+    parser.add_argument("--repeat", type=int, default=1, help="Passes over the questions for the latency percentiles.")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--backend", choices=["chroma", "numpy"], default="chroma", help="Vector store queried.")
+    parser.add_argument("--context-k-factor", type=int, default=None, help="Overrides CONTEXT_K_FACTOR of conf.txt.")
+    parser.add_argument("--direct-answers", action="store_true", help="Let FAQ questions be answered without the LLM.")
+    parser.add_argument("--llm-latency", type=float, default=0.0, help="Seconds the stubbed LLM takes per answer.")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1)
+    parser.add_argument("--embed-batch-size", type=int, default=256)
+    parser.add_argument("--write-batch-size", type=int, default=1024)
+    parser.add_argument("--queue-size", type=int, default=8)
+    parser.add_argument("--numpy-dtype", choices=["float32", "float16", "int8"], default="float32")
+    parser.add_argument("--workspace", type=str, default=None, help="Directory for the corpus and indexes (kept), a temporary one otherwise.")
+    parser.add_argument("--output", type=str, default="rag-benchmark.json", help="JSON file the results are written to.")
+    args = parser.parse_args()
+
+    workspace = args.workspace or tempfile.mkdtemp(prefix="rag-benchmark-")
+    try:
+        db_script = load_db_script(workspace)
+        start = time.perf_counter()
+        questions = generate_corpus(db_script.DATA_PATH, args.documents, args.sections, args.paragraphs,
+                                    args.faq_entries, args.seed)
+        corpus_seconds = time.perf_counter() - start
+        ingestion = benchmark_ingestion(db_script, args, args.documents + 1)
+
+        query_rag = configure_query_rag(db_script, args)
+        # spread the sample over the facts and the FAQ, the same one for a given seed
+        step = max(1, len(questions) // args.questions)
+        sample = questions[::step][:args.questions]
+        results = {
+            "commit": git_commit(),
+            "time": time.time(),
+            "config": {**vars(args), "corpus_seconds": round(corpus_seconds, 3)},
+            "ingestion": ingestion,
+            "latency": benchmark_queries(query_rag, sample, args.repeat),
+            "recall": benchmark_recall(query_rag, sample),
+        }
+    finally:
+        if args.workspace is None:
+            shutil.rmtree(workspace, ignore_errors=True)
+
+    with open(args.output, "w") as file:
+        json.dump(results, file, indent=2)
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main()
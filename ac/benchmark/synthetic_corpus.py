@@ -0,0 +1,80 @@
+import json
+import os
+import random
+import string
+
+TOPICS = [
+    "grid bots", "DCA bots", "exchange connectors", "API keys", "stop loss", "take profit", "trailing orders",
+    "portfolio rebalancing", "backtesting", "paper trading", "order types", "fees", "risk limits", "notifications",
+]
+FILLER_SENTENCES = [
+    "A {topic} setup is configured from the bot profile page and can be changed while the bot is stopped.",
+    "Most users start with the default {topic} parameters and adjust them after a few days of trading.",
+    "The dashboard shows the current state of your {topic} together with the last executed orders.",
+    "Changes to {topic} take effect on the next order the bot places on the exchange.",
+    "When the exchange rejects an order, the {topic} settings are kept and the bot retries later.",
+    "You can export the history of your {topic} as a CSV file from the reports section.",
+    "Support can help you review your {topic} configuration if the results look unexpected.",
+]
+FACT_SENTENCE = "The maximum leverage for {symbol} bots using {topic} is {leverage}x, and the minimum order size is {size} contracts."
+FACT_QUESTION = "What is the maximum leverage for {symbol} bots using {topic}?"
+FAQ_QUESTION = "How do I configure {topic} for {symbol}?"
+FAQ_ANSWER = "Open the bot profile, choose {symbol} as the instrument and set up {topic} in the advanced section."
+
+
+def random_symbol(rng, used):
+    while True:
+        symbol = "".join(rng.choices(string.ascii_uppercase, k=rng.randint(3, 5))) + "-PERPETUAL"
+        if symbol not in used:
+            used.add(symbol)
+            return symbol
+
+
+def generate_corpus(out_dir, documents=50, sections=8, paragraphs=4, faq_entries=50, seed=0):
+    """
+        Writes `documents` markdown files of `sections` sections into `out_dir`, every section holding one unique fact
+        (an instrument symbol with its leverage) among filler paragraphs, plus an FAQ file with `faq_entries` "?"
+        headings. Returns the labeled questions: one per fact, with the file and the symbol a relevant chunk contains,
+        and the FAQ questions.
+    """
+    rng = random.Random(seed)
+    os.makedirs(out_dir, exist_ok=True)
+    used_symbols = set()
+    questions = []
+
+    for document in range(documents):
+        path = os.path.join(out_dir, f"guide-{document:05d}.md")
+        lines = [f"# Guide {document}", ""]
+        for section in range(sections):
+            topic = rng.choice(TOPICS)
+            symbol = random_symbol(rng, used_symbols)
+            lines += [f"## {topic.capitalize()} {section}", ""]
+            fact_paragraph = rng.randrange(paragraphs)
+            for paragraph in range(paragraphs):
+                sentences = [rng.choice(FILLER_SENTENCES).format(topic=topic) for _ in range(rng.randint(3, 6))]
+                if paragraph == fact_paragraph:
+                    sentences.insert(rng.randrange(len(sentences) + 1), FACT_SENTENCE.format(
+                        symbol=symbol, topic=topic, leverage=rng.choice([2, 3, 5, 10, 20]), size=rng.randint(1, 100)))
+                lines += [" ".join(sentences), ""]
+            questions.append({
+                "question": FACT_QUESTION.format(symbol=symbol, topic=topic),
+                "source": path,
+                "expected_text": symbol,
+                "kind": "fact",
+            })
+        with open(path, "w") as file:
+            file.write("\n".join(lines))
+
+    faq_path = os.path.join(out_dir, "faq.md")
+    lines = ["# Frequently asked questions", ""]
+    for _ in range(faq_entries):
+        topic, symbol = rng.choice(TOPICS), random_symbol(rng, used_symbols)
+        question = FAQ_QUESTION.format(topic=topic, symbol=symbol)
+        lines += [f"## {question}", "", FAQ_ANSWER.format(topic=topic, symbol=symbol), ""]
+        questions.append({"question": question, "source": faq_path, "expected_text": symbol, "kind": "faq"})
+    with open(faq_path, "w") as file:
+        file.write("\n".join(lines))
+
+    with open(os.path.join(out_dir, "questions.json"), "w") as file:
+        json.dump(questions, file, indent=1)
+    return questions
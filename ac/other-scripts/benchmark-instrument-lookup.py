@@ -0,0 +1,59 @@
+import argparse
+import os
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from actions.classes import RazgaRUI, Environment
+
+
+def fetch_all_then_scan(razgar_user, xinstrument_name, xconn_name):
+    # the lookup before the targeted queries, without the caches: every connector, then every instrument of the exchange
+    xconns = RazgaRUI.EXECUTESQL(razgar_user.ENV, "SELECT * FROM `exchange_connectors` WHERE investor_id = %s", (razgar_user.UID,))
+    xconn = next((entry for entry in xconns if entry.get('title') == xconn_name), None)
+    if xconn is None:
+        return len(xconns), 0
+    xinstruments = RazgaRUI.EXECUTESQL(razgar_user.ENV, "SELECT * FROM `exchange_instruments` WHERE exchange_id = %s", (xconn["exchange_id"],))
+    xinstrument = next((entry for entry in xinstruments if entry.get('name') == xinstrument_name), 0)
+    return len(xconns) + len(xinstruments), xinstrument
+
+
+def targeted(razgar_user, xinstrument_name, xconn_name):
+    xinstrument = razgar_user.findXInstrument(xinstrument_name, xconn_name)
+    return (1 if xinstrument else 0), xinstrument
+
+
+def measure(name, lookup, razgar_user, xinstrument_name, xconn_name, repeat):
+    latencies = []
+    rows = 0
+    for _ in range(repeat):
+        start = time.perf_counter()
+        rows, xinstrument = lookup(razgar_user, xinstrument_name, xconn_name)
+        latencies.append((time.perf_counter() - start) * 1000)
+    latencies.sort()
+    p95 = latencies[min(len(latencies) - 1, int(len(latencies) * 0.95))]
+    print(f"{name}: found={bool(xinstrument)} rows transferred={rows} "
+          f"median={statistics.median(latencies):.2f} ms p95={p95:.2f} ms")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compares the fetch-all-then-scan instrument lookup with the targeted joined query.")
+    parser.add_argument("user_id", type=str, help="investor_id owning the connector.")
+    parser.add_argument("xconn_name", type=str, help="Title of the exchange connector.")
+    parser.add_argument("xinstrument_name", type=str, help="Name of the instrument.")
+    parser.add_argument("--env", choices=[env.name for env in Environment], default=Environment.DEV.name, help="Database to query.")
+    parser.add_argument("--repeat", type=int, default=50, help="Lookups per method.")
+    args = parser.parse_args()
+
+    razgar_user = RazgaRUI(args.user_id, Environment[args.env])
+    # one lookup each first, so both methods are measured on an open pooled connection
+    fetch_all_then_scan(razgar_user, args.xinstrument_name, args.xconn_name)
+    targeted(razgar_user, args.xinstrument_name, args.xconn_name)
+
+    measure("fetch all then scan", fetch_all_then_scan, razgar_user, args.xinstrument_name, args.xconn_name, args.repeat)
+    measure("targeted query", targeted, razgar_user, args.xinstrument_name, args.xconn_name, args.repeat)
+
+
+if __name__ == "__main__":
+    main()
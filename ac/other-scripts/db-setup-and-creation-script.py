@@ -1,11 +1,20 @@
 # from langchain.document_loaders import DirectoryLoader
-from langchain_community.document_loaders import DirectoryLoader
+from langchain_community.document_loaders import UnstructuredFileLoader
 from langchain.text_splitter import RecursiveCharacterTextSplitter
 from langchain.schema import Document
 from langchain_community.vectorstores import Chroma
 from dotenv import load_dotenv
+from concurrent.futures import ProcessPoolExecutor, FIRST_COMPLETED, wait
+import argparse
+import glob
+import hashlib
+import json
 import os
+import queue
+import resource
 import shutil
+import threading
+import time
 
 
 from langchain_community.embeddings.fastembed import FastEmbedEmbeddings
@@ -14,57 +23,416 @@ __import__('pysqlite3')
 import sys
 sys.modules['sqlite3'] = sys.modules.pop('pysqlite3')
 
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from actions.vector_store import NumpyIndexWriter, NUMPY_DTYPES
+from actions.bm25 import BM25IndexBuilder
+from actions.faq_index import extract_faq_pairs
+from actions.retrieval_engine import embed_query_batch
+from actions.index_snapshots import (
+    SNAPSHOTS_KEPT, current_snapshot, new_snapshot_version, snapshot_paths, publish_snapshot, prune_snapshots,
+)
 
-CHROMA_PATH = "../actions/chroma"
+
+INDEX_SNAPSHOTS_PATH = "../actions/index_snapshots"
 DATA_PATH = "../documents"
+MANIFEST_FILE = "index_manifest.json"
+# the database of the actions folder from before snapshots, the first snapshot is seeded from it
+LEGACY_CHROMA_PATH = "../actions/chroma"
+# where the snapshot being built is written, set by use_snapshot
+CHROMA_PATH = None
+MANIFEST_PATH = None
+NUMPY_INDEX_PATH = None
+BM25_INDEX_PATH = None
+FAQ_INDEX_PATH = None
+
+SPLIT_WORKERS = os.cpu_count() or 1
+EMBED_BATCH_SIZE = 256
+WRITE_BATCH_SIZE = 1024
+QUEUE_SIZE = 8
+END_OF_STREAM = None
 
 
 def main():
-    generate_data_store()
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--rebuild", action="store_true", help="Delete the database and embed every document again.")
+    parser.add_argument("--workers", type=int, default=SPLIT_WORKERS, help="Processes loading and splitting documents.")
+    parser.add_argument("--embed-batch-size", type=int, default=EMBED_BATCH_SIZE, help="Chunks embedded per batch.")
+    parser.add_argument("--write-batch-size", type=int, default=WRITE_BATCH_SIZE, help="Chunks written to the database per batch.")
+    parser.add_argument("--queue-size", type=int, default=QUEUE_SIZE, help="Batches buffered between two pipeline stages.")
+    parser.add_argument("--numpy-dtype", choices=NUMPY_DTYPES, default="float32", help="Precision of the vectors in the numpy index.")
+    parser.add_argument("--keep-snapshots", type=int, default=SNAPSHOTS_KEPT, help="Snapshots kept on disk, the published one included (at least 2).")
+    args = parser.parse_args()
+
+    build_snapshot(args)
 
 
-def generate_data_store():
-    documents = load_documents()
-    chunks = split_text(documents)
-    save_to_chroma(chunks)
+def use_snapshot(paths):
+    global CHROMA_PATH, MANIFEST_PATH, NUMPY_INDEX_PATH, BM25_INDEX_PATH, FAQ_INDEX_PATH
+    CHROMA_PATH = paths.chroma_path
+    MANIFEST_PATH = os.path.join(CHROMA_PATH, MANIFEST_FILE)
+    NUMPY_INDEX_PATH = paths.numpy_index_path
+    BM25_INDEX_PATH = paths.bm25_index_path
+    FAQ_INDEX_PATH = paths.faq_index_path
 
 
-def load_documents():
-    loader = DirectoryLoader(DATA_PATH, glob="*.md")
-    documents = loader.load()
-    return documents
+def build_snapshot(args):
+    """
+        Builds the indexes into a new snapshot directory and publishes it by swapping the `CURRENT` pointer. The
+        snapshot the action server is reading is never written to: its chroma database is copied into the new snapshot
+        first, so indexing stays incremental, and the action server switches over when it sees the new pointer.
+    """
+    os.makedirs(INDEX_SNAPSHOTS_PATH, exist_ok=True)
+    current = current_snapshot(INDEX_SNAPSHOTS_PATH)
+    seed_chroma_path = current.chroma_path if current is not None else LEGACY_CHROMA_PATH
+    paths = snapshot_paths(INDEX_SNAPSHOTS_PATH, new_snapshot_version())
+    use_snapshot(paths)
+    snapshot_root = os.path.dirname(CHROMA_PATH)
 
+    if args.rebuild or not os.path.exists(seed_chroma_path):
+        print(f"Building index snapshot {paths.version} from zero.")
+    elif not os.path.exists(os.path.join(seed_chroma_path, MANIFEST_FILE)):
+        # built before incremental indexing existed, its chunk ids are unknown
+        print("No index manifest found, rebuilding the whole database.")
+    else:
+        print(f"Building index snapshot {paths.version} from {seed_chroma_path}.")
+        shutil.copytree(seed_chroma_path, CHROMA_PATH)
+    os.makedirs(snapshot_root, exist_ok=True)
 
-def split_text(documents: list[Document]):
-    text_splitter = RecursiveCharacterTextSplitter(
+    try:
+        update_data_store(args)
+    except BaseException:
+        shutil.rmtree(snapshot_root, ignore_errors=True)
+        raise
+    publish_snapshot(INDEX_SNAPSHOTS_PATH, paths.version)
+    print(f"Published index snapshot {paths.version}.")
+    deleted = prune_snapshots(INDEX_SNAPSHOTS_PATH, max(2, args.keep_snapshots))
+    if deleted:
+        print(f"  deleted old snapshots: {', '.join(deleted)}")
+
+
+def make_text_splitter():
+    return RecursiveCharacterTextSplitter(
         chunk_size=2000,
         chunk_overlap=500,
         length_function=len,
         add_start_index=True,
     )
-    chunks = text_splitter.split_documents(documents)
-    print(f"Split {len(documents)} documents into {len(chunks)} chunks.")
 
-    document = chunks[10]
-    print(document.page_content)
-    print(document.metadata)
 
-    return chunks
+def load_and_split(path):
+    """
+        Runs in a worker process: loads one document and splits it into chunks with their stable ids and hashes.
+    """
+    chunks = make_text_splitter().split_documents(UnstructuredFileLoader(path).load())
+    return path, [(chunk_id, chunk_hash(chunk), chunk) for chunk_id, chunk in zip(chunk_ids(chunks), chunks)]
 
 
-def save_to_chroma(chunks: list[Document]):
-    # Clear out the database first.
-    if os.path.exists(CHROMA_PATH):
-        shutil.rmtree(CHROMA_PATH)
+def file_hash(path):
+    with open(path, "rb") as file:
+        return hashlib.sha256(file.read()).hexdigest()
 
-    # Create a new DB from the documents.
-    db = Chroma.from_documents(
-        chunks, FastEmbedEmbeddings(), persist_directory=CHROMA_PATH
-    )
+
+def chunk_hash(chunk: Document):
+    payload = chunk.page_content + json.dumps(chunk.metadata, sort_keys=True)
+    return hashlib.sha256(payload.encode()).hexdigest()
+
+
+def chunk_ids(chunks: list[Document]):
+    """
+        Stable chunk ids: source file plus a hash of the chunk text (and an occurrence counter for repeated text).
+        A chunk keeps its id when other parts of its file change, so only new text has to be embedded.
+    """
+    ids = []
+    seen = {}
+    for chunk in chunks:
+        key = (chunk.metadata["source"], hashlib.sha256(chunk.page_content.encode()).hexdigest()[:32])
+        occurrence = seen.get(key, 0)
+        seen[key] = occurrence + 1
+        ids.append(f"{key[0]}:{key[1]}:{occurrence}")
+    return ids
+
+
+def load_manifest():
+    if not os.path.exists(MANIFEST_PATH):
+        return {"sources": {}}
+    with open(MANIFEST_PATH, "r") as file:
+        return json.load(file)
+
+
+def save_manifest(manifest):
+    tmp_path = MANIFEST_PATH + ".tmp"
+    with open(tmp_path, "w") as file:
+        json.dump(manifest, file, indent=1)
+    os.replace(tmp_path, MANIFEST_PATH)
+
+
+def peak_rss_mb(who=resource.RUSAGE_SELF):
+    # ru_maxrss is in kilobytes on linux; it is the peak of the whole process (or of its largest child), not of a stage
+    return resource.getrusage(who).ru_maxrss / 1024
+
+
+def peak_rss_label(who):
+    return "peak RSS of the largest worker" if who == resource.RUSAGE_CHILDREN else "process peak RSS so far"
+
+
+class StageStats:
+    """
+        Chunks and time of one pipeline stage. The embed and write stages are threads of the same process, so their
+        memory cannot be told apart: the RSS reported is the peak of the process when the stage finished (of the largest
+        worker process for the split stage).
+    """
+
+    def __init__(self, name):
+        self.name = name
+        self.chunks = 0
+        self.start = None
+        self.end = None
+        self.peak_rss_mb = 0
+        self.peak_rss_label = peak_rss_label(resource.RUSAGE_SELF)
+
+    def started(self):
+        if self.start is None:
+            self.start = time.perf_counter()
+
+    def finished(self, who=resource.RUSAGE_SELF):
+        self.end = time.perf_counter()
+        self.peak_rss_mb = peak_rss_mb(who)
+        self.peak_rss_label = peak_rss_label(who)
+
+    def report(self):
+        seconds = (self.end - self.start) if self.start is not None and self.end is not None else 0
+        rate = self.chunks / seconds if seconds else 0
+        print(f"  {self.name}: {self.chunks} chunks in {seconds:.2f}s ({rate:.1f} chunks/s), {self.peak_rss_label} {self.peak_rss_mb:.0f} MB")
+
+
+def split_documents(paths, workers, stats):
+    """
+        Loads and splits the documents lazily in a process pool. At most two documents per worker are in flight, so
+        memory does not grow with the size of the corpus. Yields (path, chunks) as documents are done.
+    """
+    paths = iter(paths)
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        pending = set()
+        while True:
+            for path in paths:
+                pending.add(executor.submit(load_and_split, path))
+                if len(pending) >= workers * 2:
+                    break
+            if not pending:
+                break
+            stats.started()
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                path, chunks = future.result()
+                stats.chunks += len(chunks)
+                yield path, chunks
+    stats.finished(resource.RUSAGE_CHILDREN)
+
+
+def embed_stage(embeddings, in_queue, out_queue, stats, errors):
+    try:
+        while True:
+            batch = in_queue.get()
+            if batch is END_OF_STREAM:
+                break
+            stats.started()
+            vectors = embeddings.embed_documents([chunk.page_content for _id, chunk in batch])
+            stats.chunks += len(batch)
+            out_queue.put((batch, vectors))
+    except Exception as e:
+        errors.append(e)
+        # keep draining, so the split stage never blocks on a full queue
+        while in_queue.get() is not END_OF_STREAM:
+            pass
+    finally:
+        stats.finished()
+        out_queue.put(END_OF_STREAM)
+
+
+def write_stage(collection, in_queue, write_batch_size, stats, errors):
+    ids, vectors, documents, metadatas = [], [], [], []
+
+    def flush():
+        collection.upsert(ids=ids, embeddings=vectors, documents=documents, metadatas=metadatas)
+        stats.chunks += len(ids)
+        ids.clear(), vectors.clear(), documents.clear(), metadatas.clear()
+
+    try:
+        while True:
+            item = in_queue.get()
+            if item is END_OF_STREAM:
+                break
+            stats.started()
+            batch, batch_vectors = item
+            for (chunk_id, chunk), vector in zip(batch, batch_vectors):
+                ids.append(chunk_id)
+                vectors.append(vector)
+                documents.append(chunk.page_content)
+                metadatas.append(chunk.metadata)
+                if len(ids) >= write_batch_size:
+                    flush()
+        if ids:
+            flush()
+    except Exception as e:
+        errors.append(e)
+        # keep draining, so the embedding stage never blocks on a full queue
+        while in_queue.get() is not END_OF_STREAM:
+            pass
+    finally:
+        stats.finished()
+
+
+def update_data_store(args):
+    """
+        Incremental indexing: only files whose content hash changed since the last run are split again, only chunks
+        that did not exist before are embedded, and chunks of removed files are deleted. Writes to the snapshot set by
+        `use_snapshot`, which the action server does not read until it is published.
+
+        Changed documents stream through a pipeline: split (process pool) -> embed (batches) -> write (bulk upserts),
+        with bounded queues between the stages so peak memory stays flat regardless of the corpus size.
+    """
+    start = time.perf_counter()
+    manifest = load_manifest()
+    old_sources = manifest["sources"]
+    new_sources = {}
+    changed_paths = []
+    to_update, to_delete = [], []
+    added, skipped = 0, 0
+
+    for path in sorted(glob.glob(os.path.join(DATA_PATH, "*.md"))):
+        current_hash = file_hash(path)
+        old_entry = old_sources.get(path)
+        if old_entry is not None and old_entry["hash"] == current_hash:
+            new_sources[path] = old_entry
+            skipped += len(old_entry["chunks"])
+        else:
+            changed_paths.append((path, current_hash))
+    for path, old_entry in old_sources.items():
+        if not os.path.exists(path):
+            to_delete.extend(old_entry["chunks"])
+    scan_seconds = time.perf_counter() - start
+
+    db = Chroma(persist_directory=CHROMA_PATH, embedding_function=FastEmbedEmbeddings())
+    split_stats, embed_stats, write_stats = StageStats("split"), StageStats("embed"), StageStats("write")
+    embed_queue, write_queue = queue.Queue(maxsize=args.queue_size), queue.Queue(maxsize=args.queue_size)
+    errors = []
+    embedder = threading.Thread(target=embed_stage, args=(db.embeddings, embed_queue, write_queue, embed_stats, errors))
+    writer = threading.Thread(target=write_stage, args=(db._collection, write_queue, args.write_batch_size, write_stats, errors))
+    embedder.start()
+    writer.start()
+
+    current_hashes = dict(changed_paths)
+    batch = []
+    try:
+        for path, chunks in split_documents([path for path, _hash in changed_paths], args.workers, split_stats):
+            old_entry = old_sources.get(path)
+            old_chunks = old_entry["chunks"] if old_entry is not None else {}
+            new_chunks = {}
+            for chunk_id, new_hash, chunk in chunks:
+                new_chunks[chunk_id] = new_hash
+                if chunk_id not in old_chunks:
+                    batch.append((chunk_id, chunk))
+                    added += 1
+                    if len(batch) >= args.embed_batch_size:
+                        embed_queue.put(batch)
+                        batch = []
+                elif old_chunks[chunk_id] != new_hash:
+                    # same text, only the metadata (e.g. start_index) moved
+                    to_update.append((chunk_id, chunk.metadata))
+                else:
+                    skipped += 1
+            to_delete.extend(chunk_id for chunk_id in old_chunks if chunk_id not in new_chunks)
+            new_sources[path] = {"hash": current_hashes[path], "chunks": new_chunks}
+        if batch:
+            embed_queue.put(batch)
+    finally:
+        embed_queue.put(END_OF_STREAM)
+        embedder.join()
+        writer.join()
+    if errors:
+        raise errors[0]
+
+    start = time.perf_counter()
+    if to_update:
+        db._collection.update(ids=[chunk_id for chunk_id, _metadata in to_update], metadatas=[metadata for _id, metadata in to_update])
+    if to_delete:
+        db.delete(ids=to_delete)
     db.persist()
-    print(f"Saved {len(chunks)} chunks to {CHROMA_PATH}.")
+    save_manifest({"sources": new_sources})
+    finish_seconds = time.perf_counter() - start
+
+    print(f"Added {added}, updated {len(to_update)}, deleted {len(to_delete)}, skipped {skipped} chunks in {CHROMA_PATH}.")
+    print(f"  scan: {len(changed_paths)} changed documents in {scan_seconds:.2f}s")
+    for stats in (split_stats, embed_stats, write_stats):
+        stats.report()
+    print(f"  update and delete: {finish_seconds:.2f}s")
+
+    start = time.perf_counter()
+    rows = export_derived_indexes(db._collection, args.numpy_dtype, args.write_batch_size)
+    print(f"  numpy ({args.numpy_dtype}) and BM25 indexes: {rows} rows in {time.perf_counter() - start:.2f}s, "
+          f"{peak_rss_label(resource.RUSAGE_SELF)} {peak_rss_mb():.0f} MB")
+
+    start = time.perf_counter()
+    pairs = build_faq_index(db.embeddings, args.embed_batch_size)
+    print(f"  FAQ index: {pairs} question/answer pairs in {time.perf_counter() - start:.2f}s")
+
+
+def build_faq_index(embeddings, batch_size):
+    """
+        Extracts the question/answer pairs of the FAQ markdown files and indexes the embedded questions, so `query_rag`
+        can return the stored answer directly for a close match.
+    """
+    pairs = []
+    for path in sorted(glob.glob(os.path.join(DATA_PATH, "*.md"))):
+        with open(path, "r") as file:
+            pairs.extend((question, answer, path) for question, answer in extract_faq_pairs(file.read()))
+    if not pairs:
+        if os.path.exists(FAQ_INDEX_PATH):
+            shutil.rmtree(FAQ_INDEX_PATH)
+        return 0
+
+    writer = None
+    for offset in range(0, len(pairs), batch_size):
+        batch = pairs[offset:offset + batch_size]
+        # embedded like the user's question, so the two are compared in the same space; one model call per batch
+        vectors = embed_query_batch(embeddings, [question for question, _answer, _path in batch])
+        if writer is None:
+            writer = NumpyIndexWriter(FAQ_INDEX_PATH, len(pairs), len(vectors[0]), "float32")
+        writer.add(
+            [f"{path}:faq:{offset + i}" for i, (_question, _answer, path) in enumerate(batch)],
+            vectors,
+            [answer for _question, answer, _path in batch],
+            [{"question": question, "source": path} for question, _answer, path in batch],
+        )
+    writer.close()
+    return len(pairs)
+
+
+def export_derived_indexes(collection, dtype, batch_size):
+    """
+        Copies the whole collection, page by page, into the memory-mapped numpy index used by the `numpy` vector store
+        backend and into the BM25 index used by hybrid search.
+
+        The numpy index is written page by page, but the BM25 index is the one step whose memory grows with the corpus:
+        `BM25IndexBuilder` keeps the text and postings of every chunk until it pickles them in one piece, the same
+        index the action server loads whole into memory. The peak RSS printed after this step shows its cost.
+    """
+    total = collection.count()
+    writer = None
+    bm25 = BM25IndexBuilder()
+    for offset in range(0, total, batch_size):
+        page = collection.get(include=["embeddings", "documents", "metadatas"], limit=batch_size, offset=offset)
+        if writer is None:
+            writer = NumpyIndexWriter(NUMPY_INDEX_PATH, total, len(page["embeddings"][0]), dtype)
+        writer.add(page["ids"], page["embeddings"], page["documents"], page["metadatas"])
+        bm25.add(page["ids"], page["documents"], page["metadatas"])
+    bm25.save(BM25_INDEX_PATH)
+    if writer is not None:
+        writer.close()
+    elif os.path.exists(NUMPY_INDEX_PATH):
+        shutil.rmtree(NUMPY_INDEX_PATH)
+    return total
 
 
 if __name__ == "__main__":
     main()
-
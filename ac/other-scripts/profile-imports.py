@@ -0,0 +1,58 @@
+import argparse
+import os
+import re
+import subprocess
+import sys
+
+AC_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+DEFAULT_MODULES = ["actions.actions_make_bot", "actions.query_rag"]
+IMPORT_TIME_LINE = re.compile(r"^import time:\s+(\d+)\s+\|\s+(\d+)\s+\|(\s*)(\S+)")
+
+
+def profile_import(module, python=sys.executable):
+    """
+        Imports `module` in a fresh interpreter with `-X importtime` and returns (total seconds, [(cumulative seconds,
+        self seconds, depth, imported module)]) for every module it pulled in.
+    """
+    result = subprocess.run(
+        [python, "-X", "importtime", "-c", f"import {module}"],
+        cwd=AC_DIR, capture_output=True, text=True,
+    )
+    if result.returncode != 0:
+        print(f"ERROR: importing {module} failed:\n{result.stderr.splitlines()[-1] if result.stderr else ''}")
+        return None, []
+    entries = []
+    for line in result.stderr.splitlines():
+        match = IMPORT_TIME_LINE.match(line)
+        if match:
+            self_us, cumulative_us, indent, name = match.groups()
+            entries.append((int(cumulative_us) / 1e6, int(self_us) / 1e6, (len(indent) - 1) // 2, name))
+    # the interpreter's own startup (site and what it imports) is listed first and is not part of the module
+    site_end = next((i + 1 for i, entry in enumerate(entries) if entry[2:] == (0, "site")), 0)
+    entries = entries[site_end:]
+    total = max((cumulative for cumulative, _self, depth, _name in entries if depth == 0), default=0.0)
+    return total, entries
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Import-time profile of the action modules (python -X importtime).")
+    parser.add_argument("modules", nargs="*", default=DEFAULT_MODULES, help="Modules to import, each in a fresh interpreter.")
+    parser.add_argument("--top", type=int, default=15, help="Slowest imports listed per module.")
+    args = parser.parse_args()
+
+    for module in args.modules:
+        total, entries = profile_import(module)
+        if total is None:
+            continue
+        print(f"{module}: {total * 1000:.1f} ms, {len(entries)} modules")
+        # third-party packages at the top of the list are the candidates for a lazy import
+        top_level = {}
+        for cumulative, _self, _depth, name in entries:
+            package = name.split(".")[0]
+            top_level[package] = max(top_level.get(package, 0.0), cumulative)
+        for package, cumulative in sorted(top_level.items(), key=lambda item: -item[1])[:args.top]:
+            print(f"  {cumulative * 1000:9.1f} ms  {package}")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,30 +1,217 @@
 import argparse
-from langchain_community.vectorstores import Chroma
-from langchain_community.embeddings import FastEmbedEmbeddings
-from langchain.prompts import ChatPromptTemplate
-
-from groq import Groq
+from concurrent.futures import ThreadPoolExecutor, wait, ALL_COMPLETED, FIRST_COMPLETED
+import csv
+import json
 import os
-
-from groq import Groq
-
-__import__('pysqlite3')
 import sys
-sys.modules['sqlite3'] = sys.modules.pop('pysqlite3')
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from actions.vector_store import open_vector_store, CHROMA_BACKEND, NUMPY_BACKEND
+from actions.index_snapshots import current_snapshot
 
 
+INDEX_SNAPSHOTS_PATH = "../actions/index_snapshots"
+# used until the db-setup script published a snapshot
 CHROMA_PATH = "../actions/chroma"
+NUMPY_INDEX_PATH = "../actions/numpy_index"
+# fields of the batch input and output records
+ID_FIELD = "id"
+QUESTION_FIELD = "question"
+MODE_FIELD = "mode"
+# batch modes, a rerun only skips the ids answered in its own mode
+RETRIEVAL_ONLY_MODE = "retrieval_only"
+FULL_MODE = "full"
+
+
+def read_questions(path, input_format):
+    """
+        (id, question) pairs of a JSONL file (one object per line) or a CSV file with a header, "-" being stdin. Records
+        without an id are numbered by their position, so the same file always gives the same ids.
+    """
+    if input_format is None:
+        input_format = "csv" if path.lower().endswith(".csv") else "jsonl"
+    file = sys.stdin if path == "-" else open(path, "r", newline="")
+    try:
+        if input_format == "csv":
+            records = csv.DictReader(file)
+        else:
+            records = (json.loads(line) for line in file if line.strip())
+        questions = []
+        for position, record in enumerate(records):
+            question_id = record.get(ID_FIELD)
+            questions.append((str(question_id if question_id not in (None, "") else position), record[QUESTION_FIELD]))
+        return questions
+    finally:
+        if file is not sys.stdin:
+            file.close()
+
+
+def completed_ids(output_path, mode):
+    """
+        Ids already answered in `mode` in the output of an interrupted run; the records of the other mode are kept but
+        not counted. The records of `mode` with an error are dropped from the file, so they are tried again without
+        leaving the failed line behind, and so is a line cut off by the interruption.
+    """
+    if not os.path.exists(output_path):
+        return set()
+    done = set()
+    kept = []
+    rewrite = False
+    with open(output_path, "rb") as file:
+        for line in file:
+            try:
+                record = json.loads(line) if line.endswith(b"\n") else None
+            except ValueError:
+                record = None
+            if record is None:
+                rewrite = True
+                break
+            if record.get(MODE_FIELD) == mode:
+                if record.get("error") is not None or record[ID_FIELD] in done:
+                    rewrite = True
+                    continue
+                done.add(record[ID_FIELD])
+            kept.append(line)
+    if rewrite:
+        temporary_path = output_path + ".tmp"
+        with open(temporary_path, "wb") as file:
+            file.writelines(kept)
+        os.replace(temporary_path, output_path)
+    return done
+
+
+def chunk_summary(results):
+    return [
+        {"id": doc.metadata.get("id"), "source": doc.metadata.get("source"), "score": round(float(score), 6)}
+        for doc, score in results
+    ]
+
+
+def answer_with_llm(query_rag, question, results):
+    start = time.perf_counter()
+    prompt = query_rag.build_prompt(question, results)
+    prompt_ms = (time.perf_counter() - start) * 1000
+    start = time.perf_counter()
+    answer = query_rag.query_llm(prompt)
+    return answer, prompt_ms, (time.perf_counter() - start) * 1000
+
+
+def run_batch(args):
+    """
+        Answers every question of `args.batch` through the pipeline of the action server (query_rag.py), without the
+        semantic cache: questions are embedded `--batch-size` at a time in one call, searched in one bulk top-k query,
+        and the LLM calls run `--llm-concurrency` at a time. Every answer is appended to `--output` as soon as it is
+        done, so an interrupted run continues where it stopped.
+    """
+    from actions import query_rag
+
+    query_rag.VECTOR_STORE_BACKEND = args.backend
+    engine = query_rag.get_retrieval_engine()
+    questions = read_questions(args.batch, args.input_format)
+    mode = RETRIEVAL_ONLY_MODE if args.retrieval_only else FULL_MODE
+    done = completed_ids(args.output, mode)
+    pending = [(question_id, question) for question_id, question in questions if question_id not in done]
+    print(f"{len(questions)} questions, {len(questions) - len(pending)} already answered in {args.output} ({mode})")
+
+    start = time.perf_counter()
+    written = errors = 0
+    with open(args.output, "a") as output, ThreadPoolExecutor(max_workers=args.llm_concurrency) as llm_pool:
+        in_flight = {}
+
+        def write(record):
+            nonlocal written, errors
+            output.write(json.dumps(record) + "\n")
+            output.flush()
+            written += 1
+            errors += record.get("error") is not None
+
+        def collect(block):
+            completed, _ = wait(in_flight, return_when=ALL_COMPLETED if block else FIRST_COMPLETED)
+            for future in completed:
+                record = in_flight.pop(future)
+                try:
+                    record["answer"], prompt_ms, llm_ms = future.result()
+                    record["source"] = "llm"
+                    record["timings_ms"].update(prompt=round(prompt_ms, 3), llm=round(llm_ms, 3))
+                except Exception as e:
+                    record["error"] = repr(e)
+                write(record)
+
+        for batch_start in range(0, len(pending), args.batch_size):
+            batch = pending[batch_start:batch_start + args.batch_size]
+            texts = [question for _question_id, question in batch]
+            try:
+                # the share of the batch's embedding and search time is reported per question
+                embed_start = time.perf_counter()
+                embeddings = engine.embed_queries(texts)
+                embed_ms = (time.perf_counter() - embed_start) * 1000 / len(batch)
+                retrieval_start = time.perf_counter()
+                results = query_rag.retrieve_batch(engine, texts, embeddings)
+                retrieval_ms = (time.perf_counter() - retrieval_start) * 1000 / len(batch)
+            except Exception as e:
+                for question_id, question in batch:
+                    write({ID_FIELD: question_id, QUESTION_FIELD: question, MODE_FIELD: mode, "answer": None, "error": repr(e)})
+                continue
+
+            for (question_id, question), embedding, question_results in zip(batch, embeddings, results):
+                record = {
+                    ID_FIELD: question_id,
+                    QUESTION_FIELD: question,
+                    MODE_FIELD: mode,
+                    "answer": None,
+                    "source": None,
+                    "chunks": chunk_summary(question_results),
+                    "timings_ms": {"embedding": round(embed_ms, 3), "retrieval": round(retrieval_ms, 3)},
+                    "error": None,
+                }
+                if args.retrieval_only:
+                    write(record)
+                    continue
+                direct = query_rag.direct_answer(engine, embedding)
+                if direct is not None:
+                    record["answer"], record["source"] = direct, "direct"
+                    write(record)
+                    continue
+                in_flight[llm_pool.submit(answer_with_llm, query_rag, question, question_results)] = record
+                # bounded: the next batch is only embedded once the LLM calls caught up
+                while len(in_flight) >= 2 * args.llm_concurrency:
+                    collect(block=False)
+            print(f"{batch_start + len(batch)}/{len(pending)} questions processed")
+
+        if in_flight:
+            collect(block=True)
+
+    seconds = time.perf_counter() - start
+    print(f"{written} answers written to {args.output} in {seconds:.1f}s ({written / seconds if seconds else 0:.1f}/s), {errors} errors")
+
 
 def main():
     parser = argparse.ArgumentParser()
-    parser.add_argument("query_text", type=str, help="The query text.")
+    parser.add_argument("query_text", type=str, nargs="?", help="The query text.")
+    parser.add_argument("--backend", choices=[CHROMA_BACKEND, NUMPY_BACKEND], default=CHROMA_BACKEND, help="Vector store to query.")
+    parser.add_argument("--batch", type=str, default=None, help="JSONL or CSV file of questions (\"-\" for stdin), answered in batch mode.")
+    parser.add_argument("--input-format", choices=["jsonl", "csv"], default=None, help="Format of --batch, by its extension by default (jsonl for stdin).")
+    parser.add_argument("--output", type=str, default="answers.jsonl", help="JSONL file the batch answers are appended to; a rerun resumes it.")
+    parser.add_argument("--batch-size", type=int, default=64, help="Questions embedded and searched together.")
+    parser.add_argument("--llm-concurrency", type=int, default=4, help="LLM calls in parallel.")
+    parser.add_argument("--retrieval-only", action="store_true", help="Only record the retrieved chunks, without direct answers or LLM calls.")
     args = parser.parse_args()
+
+    if args.batch is not None:
+        run_batch(args)
+        return
+    if args.query_text is None:
+        parser.error("a query text or --batch is required")
     query_text = args.query_text
 
+    from langchain_community.embeddings import FastEmbedEmbeddings
     embedding_function = FastEmbedEmbeddings()
-    db = Chroma(persist_directory=CHROMA_PATH, embedding_function=embedding_function)
+    snapshot = current_snapshot(INDEX_SNAPSHOTS_PATH)
+    chroma_path, numpy_index_path = (snapshot.chroma_path, snapshot.numpy_index_path) if snapshot else (CHROMA_PATH, NUMPY_INDEX_PATH)
+    db = open_vector_store(args.backend, chroma_path, numpy_index_path, embedding_function)
 
-    results = db.similarity_search_with_relevance_scores(query_text, k=2)
+    results = db.search_by_vector(embedding_function.embed_query(query_text), k=2)
 
     print("PROMPT-START")
     print('\n---\n'.join(doc.page_content for doc, _score in results))
@@ -33,4 +220,3 @@ def main():
 
 if __name__ == "__main__":
     main()
-
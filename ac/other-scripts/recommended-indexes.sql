@@ -0,0 +1,10 @@
+-- Indexes backing the lookups of RazgaRUI (actions/classes.py).
+-- Run against the DEV, TEST and APP databases of DB_01_CONFIG.
+
+-- getXConnList: WHERE investor_id = ?
+-- findXInstrument: WHERE investor_id = ? AND title = ?
+CREATE INDEX idx_exchange_connectors_investor_title ON `exchange_connectors` (investor_id, title);
+
+-- getXInstrumentListByXID: WHERE exchange_id = ?
+-- findXInstrument: JOIN ON exchange_id = ? AND name = ?
+CREATE INDEX idx_exchange_instruments_exchange_name ON `exchange_instruments` (exchange_id, name);